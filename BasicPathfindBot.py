@@ -1,7 +1,24 @@
 import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Hashable
 
 from Robot import Robot
 from Utils.Position import Position
+from Utils.Occupancy import grid_to_mask
+from Pathfinding.AnytimeSearch import AnytimeSearch
+from Pathfinding.DStarLite import DStarLite
+from Pathfinding.FlowField import FlowField
+from Pathfinding.GridAStar import GridAStar
+from Pathfinding.JumpPointSearch import JumpPointSearch
+from Pathfinding.HierarchicalPlanner import HierarchicalPlanner
+from Pathfinding.PathCache import PathCache
+from Pathfinding.PlanningService import PlanningService, PLANNERS as PLANNING_SERVICE_PLANNERS
+from Pathfinding.ThetaStar import ThetaStar, LazyThetaStar
+from Pathfinding.VisibilityGraph import VisibilityGraph
+from Utils.Instrumentation import instrumentation
+from NavMesh import TriangleNavMesh
+import numpy as np
 import pygame
 import Field
 
@@ -11,11 +28,72 @@ class BasicPathfindBot(Robot):
     This robot goes to the target position in a straight line
     """
 
-    def __init__(self, field: Field, max_velocity: float = 500, max_acceleration: float = 1000):
+    # the grid planners path_find can use, by name
+    GRID_PLANNERS = {"astar": GridAStar, "jps": JumpPointSearch, "hpa": HierarchicalPlanner, "theta": ThetaStar,
+                     "lazy_theta": LazyThetaStar}
+    # grid planners are shared by every robot on the field, so the precomputation (JPS jump distances, the HPA*
+    # cluster graph) is only done once per margin mask and resolution.
+    # (margin version, resolution, planner) -> planner, least recently used first
+    GRID_PLANNER_CACHE_SIZE = 8
+    _grid_planner_cache: OrderedDict = OrderedDict()
+    # paths from the grid planners, shared by every robot. (start cell, goal cell, resolution, planner, margin version)
+    # -> cells. the margin version changes with the margin mask, so old paths are never reused
+    path_cache = PathCache(256)
+    # nav meshes generated from the margin mask, shared by every robot. margin version -> mesh (in pixels)
+    NAVMESH_CACHE_SIZE = 4
+    _navmesh_cache: OrderedDict = OrderedDict()
+    # visibility graphs over the corners of the margin mask, shared by every robot. margin version -> graph (in pixels)
+    VISIBILITY_GRAPH_CACHE_SIZE = 4
+    _visibility_graph_cache: OrderedDict = OrderedDict()
+    # flow fields to the goals robots went to, shared by every robot. (margin version, resolution, goal cell) -> field,
+    # least recently used first. a field is as big as its grid, so the fields of a margin mask are dropped as soon as
+    # the margin of its Field changes instead of waiting to be evicted. id(Field) -> the margin version its flow fields
+    # are for
+    FLOW_FIELD_CACHE_SIZE = 16
+    _flow_field_cache: OrderedDict = OrderedDict()
+    _flow_field_margin_versions: dict[int, int] = {}
+
+    def __init__(self, field: Field, max_velocity: float = 500, max_acceleration: float = 1000,
+                 planner: str = "astar", planning_resolution: float = 1 / 30):
         super().__init__(field, max_velocity=max_velocity, max_acceleration=max_acceleration)
         self.force = Position(0, 0, 0)
         self.path_to_next_point = []
 
+        # which backend path_find uses: "astar" (heap based grid A*), "jps" (jump point search, same paths as "astar"),
+        # "anytime" (ARA*, paths as short as "astar", but follow_trajectory spreads the search over frames),
+        # "dstar_lite" (D* Lite, paths as short as "astar", repaired instead of replanned when the margin changes),
+        # "flow_field" (the cost to the goal from every cell, built once per goal, then any start is answered by
+        # following it),
+        # "hpa" (hierarchical A*, near optimal but much faster on big grids), "theta" or "lazy_theta" (any-angle, a
+        # few straight segments instead of one point per cell), "navmesh" (A* over a triangle mesh of the free space,
+        # pulled tight, so the path is a few corners anywhere on the field), "visibility" (A* over a graph of the
+        # corners of the margin that can see each other, the shortest path around them) or "legacy" (the original
+        # list based A*)
+        self.planner = planner
+        self.planning_resolution = planning_resolution
+        # the grid planner last used by this robot, see get_grid_planner
+        self.grid_planner: GridAStar | HierarchicalPlanner | None = None
+        # with the "anytime" planner, how long follow_trajectory searches per frame, and after how much searching it
+        # settles for the best path so far instead of the shortest (see Pathfinding.AnytimeSearch)
+        self.planning_budget = 0.005
+        self.planning_timeout = 0.1
+        # (waypoint, path_cache key, search) of the "anytime" search in progress
+        self._anytime_search: tuple | None = None
+        # the "dstar_lite" planner keeps its search between queries, so it belongs to this robot
+        self.incremental_planner: DStarLite | None = None
+        self._incremental_resolution: float | None = None
+        self._incremental_margin_version: int | None = None
+        # if set, path_find answers queries between the locations of this RouteTable from it, when they're for the
+        # table's resolution and one of its ROUTE_PLANNERS
+        self.route_table = None
+        # if set, follow_trajectory plans with the grid planners in the background instead of inside the frame
+        self.planning_service: PlanningService | None = None
+        # id(waypoint) -> (waypoint, the waypoint it's planned from or None, (resolution, planner, margin version),
+        # future, path_cache key), see _request_plans
+        self._plans: dict[int, tuple] = {}
+        # the waypoint the robot last arrived at, plans made from it start where the robot is
+        self._last_reached: Position | None = None
+
     class Node:
         """A node class for A* Pathfinding"""
 
@@ -29,9 +107,11 @@ class BasicPathfindBot(Robot):
         def __eq__(self, other):
             return self.position == other.position
 
-    def follow_trajectory(self, time_delta_seconds: float, trajectory: list[Position] = None, _stall=[0]) -> bool:
+    def follow_trajectory(self, time_delta_seconds: float, trajectory: list[Position] = None) -> bool:
         """
         This function moves the robot along the trajectory. It returns true if the robot is at the target position
+        With a planning_service, every waypoint of the trajectory is planned in the background and the robot holds its
+        position until the plan for the next one arrives
         :param time_delta_seconds:
         :param trajectory:
         :return:
@@ -42,6 +122,10 @@ class BasicPathfindBot(Robot):
         else:
             self.trajectory = trajectory
 
+        planning_in_background = self.planning_service is not None and self.planner in PLANNING_SERVICE_PLANNERS
+        if planning_in_background:
+            self._request_plans(trajectory)
+
         if not trajectory:
             self.velocity = Position(0, 0)
             return True
@@ -51,54 +135,190 @@ class BasicPathfindBot(Robot):
             # handles an invalid target
             if (self.field.mask.get_at((int(trajectory[0].x), int(trajectory[0].y))) or
                     self.field.margin_mask.get_at((int(trajectory[0].x), int(trajectory[0].y)))):  # if target in a wall
-                print("Invalid target")
+                instrumentation.event("path_find.invalid_target", f"{trajectory[0]} is in a wall or margin")
                 trajectory.pop(0)
                 self.velocity = Position(0, 0)
                 return False
 
-            start_time = time.time()
-            self.path_to_next_point = self.path_find(trajectory[0], debug=False, loop_between_display=[0, 0],
-                                                     resolution=1 / 30)
-            end_time = time.time()
-            print(f"Pathfinding took {end_time - start_time} seconds")
-            print(self.path_to_next_point)
+            if planning_in_background or self.planner == "anytime":
+                if planning_in_background:
+                    path = self._take_plan(trajectory[0])
+                else:
+                    path = self._step_anytime_search(trajectory[0])
+                if path is None:  # still planning, hold position until the plan arrives
+                    self.velocity = Position(0, 0)
+                    return False
+                self.path_to_next_point = path
+            else:
+                start_time = time.perf_counter()
+                self.path_to_next_point = self.path_find(trajectory[0], debug=False, loop_between_display=[0, 0],
+                                                         resolution=self.planning_resolution)
+                if instrumentation.enabled:
+                    instrumentation.add_time(f"path_find.{self.planner}", time.perf_counter() - start_time)
             if self.path_to_next_point[0] is None:
-                print("Invalid target")
+                instrumentation.event("path_find.no_path", f"no path to {trajectory[0]}")
                 trajectory.pop(0)
                 self.path_to_next_point = []
                 self.velocity = Position(0, 0)
                 return False
 
-            _stall[0] = 4
             self.velocity = Position(0, 0)
             self.path_to_next_point.append(trajectory[0])  # accounts for error b/c of resolution
 
-        if _stall[0] > 0:
-            _stall[0] -= 1
-            return False
+        if self.planner == "dstar_lite" and self.incremental_planner is not None and \
+                self._incremental_margin_version != self.field.margin_version:
+            self.replan()  # the margin changed under the path, repair it
+            if not self.path_to_next_point:
+                return False
 
         target_position = self.path_to_next_point[0]
         if self.go_to_position(target_position, time_delta_seconds, update_position=True):
             self.path_to_next_point.pop(0)
             if len(self.path_to_next_point) == 0:
-                trajectory.pop(0)
+                self._last_reached = trajectory.pop(0)
                 self.velocity = Position(0, 0)
 
         return False
 
-    def path_find(self,target_position: Position,  curr_position: Position=None, loop_between_display=None, debug=False, display=False, resolution: float = 1) -> [
-        Position]:
+    def clear_trajectory(self) -> None:
+        """Stops following the trajectory: forgets the waypoints, the path to the next one and any plans for them"""
+        self.trajectory = []
+        self.path_to_next_point = []
+        self._anytime_search = None
+        self.cancel_plans()
+
+    def cancel_plans(self) -> None:
+        """Cancels every background plan this robot asked for"""
+        for _, _, _, future, _ in self._plans.values():
+            self.planning_service.cancel(future)
+        self._plans.clear()
+
+    def _request_plans(self, trajectory: list[Position]) -> None:
+        """
+        Makes sure every waypoint of the trajectory that the robot isn't already heading to has a plan in the planning
+        service, each from the waypoint before it. Plans for waypoints that were removed, that start somewhere else
+        now, or that were made for another margin mask, resolution or planner, are cancelled
+        """
+        query = (self.planning_resolution, self.planner, self.field.margin_version)
+        plans = {}
+        # the robot is either on its way to the first waypoint already, or holding where it last arrived
+        previous = trajectory[0] if self.path_to_next_point and trajectory else self._last_reached
+        for waypoint in trajectory[1:] if self.path_to_next_point else trajectory:
+            plan = self._plans.pop(id(waypoint), None)
+            if plan is not None and plan[0] is waypoint and plan[1] is previous and plan[2] == query:
+                plans[id(waypoint)] = plan
+            else:
+                if plan is not None:
+                    self.planning_service.cancel(plan[3])
+                start = self.position if previous is None or previous is self._last_reached else previous
+                plans[id(waypoint)] = (waypoint, previous, query) + self._submit_plan(waypoint, start)
+            previous = waypoint
+        for plan in self._plans.values():  # stale
+            self.planning_service.cancel(plan[3])
+        self._plans = plans
+
+    def _submit_plan(self, target_position: Position, curr_position: Position) -> tuple[Future, Hashable]:
+        """Asks the planning service for a grid path, unless it's in path_cache. Returns the future and the cache key"""
+        resolution = self.planning_resolution
+        start, goal, key = self._grid_query(target_position, curr_position, resolution, self.planner)
+        path = self.path_cache.get(key, False)
+        if path is not False:
+            future = Future()
+            future.set_result(path)
+            return future, key
+        goal = self._free_goal_cell(goal, target_position, resolution)
+        # if a robot already built this planner, the workers search copies of it instead of building their own
+        shared = self._grid_planner_cache.get((self.field.margin_version, resolution, self.planner))
+        future = self.planning_service.submit(self.planner, self.field.get_occupancy(resolution),
+                                              (self.field.margin_version, resolution), start, goal, shared)
+        return future, key
+
+    def _take_plan(self, waypoint: Position) -> list[Position] | None:
+        """
+        Takes the finished background plan for a waypoint
+        :return: The path as path_find returns it, or None if it isn't ready yet
+        """
+        plan = self._plans.get(id(waypoint))
+        if plan is None or plan[0] is not waypoint or not plan[3].done():
+            return None
+        del self._plans[id(waypoint)]
+        _, _, (resolution, _, _), future, key = plan
+        try:
+            cells = future.result()
+        except Exception as error:  # a worker that failed (or a plan cancelled under us) is a failed plan
+            instrumentation.event("planning_service.failed", f"planning to {waypoint} failed: {error!r}")
+            return [None]
+        self.path_cache.put(key, cells)
+        if cells is None:
+            return [None]
+        return self._cells_to_positions(cells, resolution)
+
+    def _step_anytime_search(self, waypoint: Position) -> list[Position] | None:
+        """
+        Runs the "anytime" search to a waypoint for planning_budget seconds, starting it if it isn't running yet
+        :return: The path as path_find returns it once the search is done (or has had planning_timeout seconds and has
+        a path), otherwise None
+        """
+        resolution = self.planning_resolution
+        if self._anytime_search is not None:
+            target, key, search = self._anytime_search
+            if target is not waypoint or key[4] != self.field.margin_version:
+                self._anytime_search = None
+        if self._anytime_search is None:
+            start, goal, key = self._grid_query(waypoint, self.position, resolution, "anytime")
+            path = self.path_cache.get(key, False)
+            if path is not False:
+                return [None] if path is None else self._cells_to_positions(path, resolution)
+            goal = self._free_goal_cell(goal, waypoint, resolution)
+            self._anytime_search = (waypoint, key, AnytimeSearch(self.get_grid_planner(resolution, "astar"), start,
+                                                                 goal))
+        _, key, search = self._anytime_search
+        search.step(max_seconds=self.planning_budget)
+        if not search.done and not (search.complete and search.search_time >= self.planning_timeout):
+            return None
+        self._anytime_search = None
+        if search.done:  # only the shortest path is cached
+            self.path_cache.put(key, search.best_path if search.complete else None)
+        if not search.complete:
+            return [None]
+        return self._cells_to_positions(search.best_path, resolution)
+
+    def path_find(self,target_position: Position,  curr_position: Position=None, loop_between_display=None, debug=False, display=False, resolution: float = 1,
+                  planner: str = None) -> [Position]:
         """A* pathfinding algorithm
         :param debug: kinda useless
-        :param loop_between_display: [loop between display, current loop]. -1 just doesn't display
+        :param loop_between_display: [loop between display, current loop]. -1 just doesn't display (legacy only)
         :param curr_position: the current position. If none, it'll use the robot's position
         :param target_position: the target position
-        :param display: if the pathfinding should display
+        :param display: if the pathfinding should display (legacy only)
         :param resolution: how many pixels per foot
+        :param planner: the backend to use, see self.planner. If none, it'll use self.planner
+        :return: the path as a list of positions, or [None] if there is no path
         """
+        if planner is None:
+            planner = self.planner
+        # routes between the table's locations were planned offline, as shortest grid paths at the table's
+        # resolution. they only stand in for planners that find those same paths
+        table = self.route_table
+        if table is not None and planner in table.ROUTE_PLANNERS and resolution == table.resolution:
+            route = table.lookup(self.position if curr_position is None else curr_position, target_position)
+            if route is not None:
+                return route
+        if planner in self.GRID_PLANNERS or planner == "anytime":
+            return self._grid_path_find(target_position, curr_position, resolution, planner)
+        elif planner == "navmesh":
+            return self._navmesh_path_find(target_position, curr_position)
+        elif planner == "visibility":
+            return self._visibility_path_find(target_position, curr_position)
+        elif planner == "dstar_lite":
+            return self._incremental_path_find(target_position, curr_position, resolution)
+        elif planner == "flow_field":
+            return self._flow_field_path_find(target_position, curr_position, resolution)
+        elif planner != "legacy":
+            raise ValueError(f"Unknown planner {planner}")
+
         # I stole this off the internet
         # Create start and end node
-        print("Pathfinding")
         if loop_between_display is None:
             loop_between_display = [-1, 0]
 
@@ -117,21 +337,15 @@ class BasicPathfindBot(Robot):
         self.velocity = Position(0, 0)
 
         # Add the start node
-        curr_mask: pygame.mask.Mask = self.field.margin_mask.copy()
-
-        curr_mask = pygame.mask.from_surface(
-            pygame.transform.smoothscale(curr_mask.to_surface(unsetcolor=(0, 0, 0, 0), setcolor=(255, 255, 255, 255)),
-                                         (resolution * curr_mask.get_size()[0], resolution * curr_mask.get_size()[1])),
-        )
+        # the field keeps the margin occupancy at each resolution, so it isn't rescaled every call
+        curr_grid: np.ndarray = self.field.get_occupancy(resolution)
         open_list.append(start_node)
-        visited: pygame.Surface = pygame.Surface(curr_mask.get_size())
-        visited.fill((0, 0, 0))
-        print(f"There are {curr_mask.get_size()[0] * curr_mask.get_size()[1]} pixels in the mask")
+        visited = np.zeros(curr_grid.shape, dtype=bool)
 
         # display
         if display:
             pygame.display.set_mode(self.field.image.get_size()).blit(
-                pygame.transform.scale(curr_mask.to_surface(), self.field.image.get_size()), (0, 0))
+                pygame.transform.scale(grid_to_mask(curr_grid).to_surface(), self.field.image.get_size()), (0, 0))
             pygame.display.flip()
             time.sleep(0.5)
         # Loop until you find the end
@@ -168,26 +382,26 @@ class BasicPathfindBot(Robot):
                                          current_node.position[1] + new_position[1])
 
                 # Make sure within range (inverted)
-                if node_position.y > (curr_mask.get_size()[1] - 1) or node_position.y < 0 or node_position.x > (
-                        curr_mask.get_size()[0] - 1) or node_position.x < 0:
+                if node_position.y > (curr_grid.shape[1] - 1) or node_position.y < 0 or node_position.x > (
+                        curr_grid.shape[0] - 1) or node_position.x < 0:
                     continue
                 # Make sure walkable terrain
-                if curr_mask.get_at((node_position.x, node_position.y)) or (
-                        curr_mask and curr_mask.get_at((node_position.x, node_position.y))):
+                if curr_grid[int(node_position.x), int(node_position.y)]:
                     continue
                 # Make sure not visited
-                if visited.get_at((int(node_position.x), int(node_position.y))) != (0, 0, 0):
+                if visited[int(node_position.x), int(node_position.y)]:
                     continue
 
                 # set visited
-                visited.set_at((int(node_position.x), int(node_position.y)), (255, 0, 0))
+                visited[int(node_position.x), int(node_position.y)] = True
 
                 # display stuff
                 if display:
                     if loop_between_display[1] == 0 and loop_between_display[0] >= 0:
                         loop_between_display[1] = loop_between_display[0]
                         pygame.display.set_mode(self.field.image.get_size()).blit(
-                            pygame.transform.scale(visited, self.field.image.get_size()), (0, 0))
+                            pygame.transform.scale(grid_to_mask(visited).to_surface(setcolor=(255, 0, 0)),
+                                                   self.field.image.get_size()), (0, 0))
                         pygame.display.flip()
                         time.sleep(0.02)
                     else:
@@ -220,6 +434,248 @@ class BasicPathfindBot(Robot):
                 open_list.append(child)
         return [None]
 
+    @classmethod
+    def clear_caches(cls) -> None:
+        """
+        Forgets every shared grid planner, nav mesh, visibility graph, flow field and path, so the next queries start
+        from scratch
+        """
+        BasicPathfindBot._grid_planner_cache.clear()
+        BasicPathfindBot._navmesh_cache.clear()
+        BasicPathfindBot._visibility_graph_cache.clear()
+        BasicPathfindBot._flow_field_cache.clear()
+        BasicPathfindBot._flow_field_margin_versions.clear()
+        BasicPathfindBot.path_cache.clear()
+
+    def get_grid_planner(self, resolution: float = 1, planner: str = None) -> GridAStar | HierarchicalPlanner:
+        """
+        Gets the grid planner for the current margin mask at the given resolution, building it if no robot has yet
+        :param resolution: how many pixels per foot
+        :param planner: which of GRID_PLANNERS to use. If none, it'll use self.planner
+        :return: the planner
+        """
+        if planner is None:
+            planner = self.planner
+        cache = BasicPathfindBot._grid_planner_cache
+        key = (self.field.margin_version, resolution, planner)
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = self.GRID_PLANNERS[planner](self.field.get_occupancy(resolution))
+            if len(cache) > self.GRID_PLANNER_CACHE_SIZE:
+                cache.popitem(last=False)
+        self.grid_planner = cache[key]
+        return self.grid_planner
+
+    def _grid_path_find(self, target_position: Position, curr_position: Position = None,
+                        resolution: float = 1, planner: str = None) -> [Position]:
+        """
+        path_find backed by one of GRID_PLANNERS. Returns the same kind of path as the legacy planner: positions at the
+        center of the cells, starting at the current cell. That's one per cell, except for the any-angle planners
+        which only return the corners. Queries between the same cells are answered from path_cache
+        """
+        if planner is None:
+            planner = self.planner
+        if curr_position is None:
+            curr_position = self.position
+        self.velocity = Position(0, 0)
+
+        start, goal, key = self._grid_query(target_position, curr_position, resolution, planner)
+        path = self.path_cache.get(key, False)
+        if path is False:
+            goal = self._free_goal_cell(goal, target_position, resolution)
+            if planner == "anytime":
+                path = AnytimeSearch(self.get_grid_planner(resolution, "astar"), start, goal).run()
+            else:
+                path = self.get_grid_planner(resolution, planner).find_path(start, goal)
+            self.path_cache.put(key, path)
+        if path is None:
+            return [None]
+        return self._cells_to_positions(path, resolution)
+
+    def _grid_query(self, target_position: Position, curr_position: Position, resolution: float,
+                    planner: str) -> tuple[tuple[int, int], tuple[int, int], tuple]:
+        """The start cell, the goal cell and the path_cache key of a grid query"""
+        start = (int(curr_position.x * resolution), int(curr_position.y * resolution))
+        goal = (int(target_position.x * resolution), int(target_position.y * resolution))
+        return start, goal, (start, goal, resolution, planner, self.field.margin_version)
+
+    @staticmethod
+    def _cells_to_positions(path, resolution: float) -> [Position]:
+        # offset it by 0.5 so the positions are at the center of the cells, not the top left corner
+        return [Position((x + 0.5) / resolution, (y + 0.5) / resolution) for x, y in path]
+
+    def get_flow_field(self, goal: tuple[int, int], resolution: float = 1) -> FlowField:
+        """
+        Gets the flow field to a goal cell for the current margin mask, building it if no robot has yet
+        :param goal: the (x, y) cell of the planning grid to go to
+        :param resolution: how many pixels per foot
+        :return: the field
+        """
+        cache = BasicPathfindBot._flow_field_cache
+        margin_version = self.field.margin_version
+        # margin versions are unique across fields, so only this field's own flow fields have its previous version
+        previous_version = BasicPathfindBot._flow_field_margin_versions.get(id(self.field))
+        if margin_version != previous_version:
+            for stale in [key for key in cache if key[0] == previous_version]:
+                del cache[stale]
+            BasicPathfindBot._flow_field_margin_versions[id(self.field)] = margin_version
+        key = (margin_version, resolution, goal)
+        if key in cache:
+            cache.move_to_end(key)
+            instrumentation.count("flow_field.cache_hits")
+        else:
+            cache[key] = FlowField(self.get_grid_planner(resolution, "astar"), goal)
+            if len(cache) > self.FLOW_FIELD_CACHE_SIZE:
+                cache.popitem(last=False)
+            instrumentation.count("flow_field.cache_misses")
+        return cache[key]
+
+    def _flow_field_path_find(self, target_position: Position, curr_position: Position = None,
+                              resolution: float = 1) -> [Position]:
+        """path_find backed by the flow field to the target's cell: the same paths as "astar", shared by every start"""
+        if curr_position is None:
+            curr_position = self.position
+        self.velocity = Position(0, 0)
+        start, goal, _ = self._grid_query(target_position, curr_position, resolution, "flow_field")
+        goal = self._free_goal_cell(goal, target_position, resolution)
+        path = self.get_flow_field(goal, resolution).find_path(start)
+        if path is None:
+            return [None]
+        return self._cells_to_positions(path, resolution)
+
+    def get_incremental_planner(self, resolution: float = 1) -> DStarLite:
+        """
+        Gets this robot's D* Lite planner. It's built the first time (or when the resolution changes), after that a
+        new margin mask is applied to it as a list of changed cells, so the search is repaired instead of redone
+        :param resolution: how many pixels per foot
+        :return: the planner
+        """
+        grid = self.field.get_occupancy(resolution)
+        if self.incremental_planner is None or self._incremental_resolution != resolution:
+            self.incremental_planner = DStarLite(grid)
+            self._incremental_resolution = resolution
+        elif self._incremental_margin_version != self.field.margin_version:
+            self.incremental_planner.update_grid(grid)
+        self._incremental_margin_version = self.field.margin_version
+        return self.incremental_planner
+
+    def _incremental_path_find(self, target_position: Position, curr_position: Position = None,
+                               resolution: float = 1) -> [Position]:
+        """path_find backed by this robot's D* Lite planner, same paths as "astar" but not cached"""
+        if curr_position is None:
+            curr_position = self.position
+        self.velocity = Position(0, 0)
+        start, goal, _ = self._grid_query(target_position, curr_position, resolution, "dstar_lite")
+        goal = self._free_goal_cell(goal, target_position, resolution)
+        path = self.get_incremental_planner(resolution).find_path(start, goal)
+        if path is None:
+            return [None]
+        return self._cells_to_positions(path, resolution)
+
+    def replan(self, changed_cells: list[tuple[tuple[int, int], bool]] = None) -> bool:
+        """
+        Repairs the path to the next waypoint with the "dstar_lite" planner, from where the robot is now. For when the
+        margin mask changed (follow_trajectory does this by itself) or cells of the planning grid changed
+        :param changed_cells: ((x, y), blocked) cells of the planning grid (at planning_resolution) that changed
+        :return: If there is a path to the next waypoint
+        """
+        planner = self.get_incremental_planner(self.planning_resolution)
+        if changed_cells:
+            planner.update_cells(changed_cells)
+        if not self.trajectory:
+            return False
+        velocity = self.velocity  # replanning mid path doesn't stop the robot
+        path = self._incremental_path_find(self.trajectory[0], resolution=self.planning_resolution)
+        self.velocity = velocity
+        if path[0] is None:
+            instrumentation.event("path_find.no_path", f"no path to {self.trajectory[0]} after replanning")
+            self.path_to_next_point = []
+            return False
+        # the first cell is the one the robot is in
+        self.path_to_next_point = path[1:] + [self.trajectory[0]]
+        return True
+
+    def get_navmesh(self) -> TriangleNavMesh:
+        """
+        Gets the nav mesh of the current margin mask, generating it if no robot has yet
+        :return: the mesh, in pixels
+        """
+        cache = BasicPathfindBot._navmesh_cache
+        key = self.field.margin_version
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            mesh = TriangleNavMesh(pixels_per_foot=1)
+            mesh.generate_from_field(self.field)
+            cache[key] = mesh
+            if len(cache) > self.NAVMESH_CACHE_SIZE:
+                cache.popitem(last=False)
+        return cache[key]
+
+    def _navmesh_path_find(self, target_position: Position, curr_position: Position = None) -> [Position]:
+        """
+        path_find backed by the nav mesh. The path starts at the current position and ends at the target, with only
+        the corners in between. The mesh keeps the timings of the query (locate_time, search_time, funnel_time)
+        """
+        if curr_position is None:
+            curr_position = self.position
+        self.velocity = Position(0, 0)
+        path = self.get_navmesh().find_path(Position(curr_position.x, curr_position.y),
+                                            Position(target_position.x, target_position.y))
+        if path is None:
+            return [None]
+        return path
+
+    def get_visibility_graph(self) -> VisibilityGraph:
+        """
+        Gets the visibility graph of the current margin mask, building it if no robot has yet
+        :return: the graph, in pixels
+        """
+        cache = BasicPathfindBot._visibility_graph_cache
+        key = self.field.margin_version
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = VisibilityGraph(self.field)
+            if len(cache) > self.VISIBILITY_GRAPH_CACHE_SIZE:
+                cache.popitem(last=False)
+        return cache[key]
+
+    def _visibility_path_find(self, target_position: Position, curr_position: Position = None) -> [Position]:
+        """
+        path_find backed by the visibility graph. The path starts at the current position and ends at the target,
+        with only the corners in between
+        """
+        if curr_position is None:
+            curr_position = self.position
+        self.velocity = Position(0, 0)
+        path = self.get_visibility_graph().find_path(Position(curr_position.x, curr_position.y),
+                                                     Position(target_position.x, target_position.y))
+        if path is None:
+            return [None]
+        return path
+
+    def _free_goal_cell(self, goal: tuple[int, int], target_position: Position, resolution: float) -> tuple[int, int]:
+        """
+        The planning grid is conservative, so a target that is clear of the margin can still be in a blocked cell.
+        In that case the free neighbouring cell closest to the target is used instead (follow_trajectory adds the
+        target itself to the end of the path), otherwise the goal is returned as is
+        """
+        grid = self.field.get_occupancy(resolution)
+        width, height = grid.shape
+        if not (0 <= goal[0] < width and 0 <= goal[1] < height) or not grid[goal] or \
+                self.field.margin_occupancy[int(target_position.x), int(target_position.y)]:
+            return goal
+        best, best_distance = goal, float("inf")
+        for x in range(goal[0] - 1, goal[0] + 2):
+            for y in range(goal[1] - 1, goal[1] + 2):
+                if 0 <= x < width and 0 <= y < height and not grid[x, y]:
+                    distance = target_position.get_distance_to(Position((x + 0.5) / resolution, (y + 0.5) / resolution))
+                    if distance < best_distance:
+                        best, best_distance = (x, y), distance
+        return best
+
     def go_to_position(self, target_position: Position, time_delta_seconds: float, update_position=False,
                        slowdown=True) -> bool:
         """
@@ -0,0 +1,288 @@
+"""
+The benchmark suite: field setup, margins, path finding, ray casting and simulation, on images/Map.png.
+Results are written as JSON, and can be compared against a saved baseline to catch regressions.
+Runs headless: python -m Benchmarks.BenchmarkSuite [--output results.json] [--baseline baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+from BasicPathfindBot import BasicPathfindBot
+from BeeLineRobot import BeeLineRobot
+from Field import Field, Circle
+from RobotBatch import RobotBatch
+from Simulation import Simulation
+from Utils.Position import Position
+from Utils.RayCast import ray_cast, ray_cast_many
+
+# bump when the metrics change meaning, so old baselines aren't compared against new numbers
+SUITE_VERSION = 1
+GROUPS = ("field", "margin", "path_find", "ray_cast", "simulation")
+# (start, goal) pairs in pixels of images/Map.png, scaled with the map. all of them are clear of a 25 pixel margin at
+# the default 2x scale
+PATH_CORPUS = [
+    ((592, 176), (395, 200)), ((193, 115), (525, 146)), ((632, 293), (361, 240)), ((639, 80), (205, 311)),
+    ((636, 196), (300, 93)), ((165, 157), (331, 194)), ((607, 218), (209, 211)), ((286, 308), (538, 140)),
+    ((406, 176), (181, 264)), ((294, 309), (462, 311)), ((607, 95), (186, 80)), ((407, 234), (597, 299)),
+    ((434, 208), (157, 215)), ((301, 120), (563, 254)), ((335, 220), (145, 91)), ((486, 301), (139, 285)),
+]
+PLANNERS = ("astar", "jps", "anytime", "dstar_lite", "flow_field", "hpa", "theta", "lazy_theta", "navmesh", "visibility")
+MARGINS = ((10, "circle"), (25, "circle"), (40, "circle"), (25, "square"))
+PLANNING_RESOLUTION = 1 / 4
+MARGIN = 25
+RAY_COUNT = 2000
+
+
+def best_time(func, repeats: int) -> float:
+    """The best time of repeats calls, in seconds"""
+    best = float("inf")
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def metric(value: float, unit: str, better: str | None = "lower") -> dict:
+    """
+    :param value: The measurement
+    :param unit: What it's measured in
+    :param better: "lower" or "higher", which way is an improvement. None for numbers that are only informative
+    :return: The metric as stored in the results
+    """
+    return {"value": value, "unit": unit, "better": better}
+
+
+def load_map(map_scale: int) -> pygame.Surface:
+    image = pygame.image.load("images/Map.png")
+    return pygame.transform.scale(image, (image.get_width() * map_scale, image.get_height() * map_scale))
+
+
+def bench_field(image: pygame.Surface, repeats: int) -> dict:
+    return {
+        "field.construct": metric(best_time(lambda: Field(image), repeats) * 1000, "ms"),
+        # the first margin also computes the distance transform
+        "field.first_margin": metric(best_time(lambda: Field(image, margin=MARGIN), repeats) * 1000, "ms"),
+    }
+
+
+def bench_margin(image: pygame.Surface, repeats: int) -> dict:
+    """set_margin_mask on a field that already has its distance fields, but not the margin"""
+    results = {}
+    for margin, shape in MARGINS:
+        best = float("inf")
+        for _ in range(repeats):
+            field = Field(image)
+            field.get_distance_field("euclidean")
+            field.get_distance_field("chebyshev")
+            start_time = time.perf_counter()
+            field.set_margin_mask(margin, shape)
+            best = min(best, time.perf_counter() - start_time)
+        results[f"margin.{shape}_{margin}"] = metric(best * 1000, "ms")
+    return results
+
+
+def bench_path_find(image: pygame.Surface, map_scale: int, repeats: int) -> dict:
+    """
+    Every planner over PATH_CORPUS: the time to build the planner (a nav mesh for "navmesh", a visibility graph for
+    "visibility") and the mean time of a query that isn't cached. "anytime" queries run the search to the end.
+    Every query of the corpus has a new goal, so "dstar_lite" starts a new search for each one instead of repairing
+    """
+    field = Field(image, margin=MARGIN)
+    field.get_occupancy(PLANNING_RESOLUTION)  # shared by the grid planners, so it's not part of the first one's build
+    robot = BasicPathfindBot(field)
+    corpus = [(Position(start[0] * map_scale, start[1] * map_scale), Position(goal[0] * map_scale, goal[1] * map_scale))
+              for start, goal in PATH_CORPUS]
+    results = {}
+    for planner in PLANNERS:
+        def build():
+            BasicPathfindBot.clear_caches()
+            if planner == "navmesh":
+                robot.get_navmesh()
+            elif planner == "visibility":
+                robot.get_visibility_graph()
+            elif planner == "anytime":
+                robot.get_grid_planner(PLANNING_RESOLUTION, "astar")  # the searches run over its grid
+            elif planner == "dstar_lite":
+                robot.incremental_planner = None
+                robot.get_incremental_planner(PLANNING_RESOLUTION)
+            elif planner == "flow_field":
+                robot.get_grid_planner(PLANNING_RESOLUTION, "astar")  # the fields are swept over its grid
+            else:
+                robot.get_grid_planner(PLANNING_RESOLUTION, planner)
+
+        def query_corpus():
+            paths = []
+            for start, goal in corpus:
+                BasicPathfindBot.path_cache.clear()
+                BasicPathfindBot._flow_field_cache.clear()  # so a "flow_field" query includes building its field
+                paths.append(robot.path_find(goal, curr_position=start, resolution=PLANNING_RESOLUTION,
+                                             planner=planner))
+            return paths
+
+        build_time = best_time(build, repeats)
+        query_time = best_time(query_corpus, repeats)
+        paths = [path for path in query_corpus() if path[0] is not None]
+        length = sum(a.get_distance_to(b) for path in paths for a, b in zip(path, path[1:]))
+        results[f"path_find.{planner}.build"] = metric(build_time * 1000, "ms")
+        results[f"path_find.{planner}.query"] = metric(query_time / len(corpus) * 1000, "ms")
+        results[f"path_find.{planner}.found"] = metric(len(paths), "paths", "higher")
+        results[f"path_find.{planner}.length"] = metric(length, "pixels", None)
+    BasicPathfindBot.clear_caches()
+    return results
+
+
+def bench_ray_cast(image: pygame.Surface, repeats: int) -> dict:
+    field = Field(image, margin=MARGIN)
+    rng = np.random.default_rng(537)
+    size = np.array(image.get_size())
+    starts = rng.uniform(0, size, (RAY_COUNT, 2))
+    ends = rng.uniform(0, size, (RAY_COUNT, 2))
+    start_positions = [Position(x, y) for x, y in starts.tolist()]
+    end_positions = [Position(x, y) for x, y in ends.tolist()]
+    distance_field = field.distance_field
+
+    def stepped():
+        for start, end in zip(start_positions, end_positions):
+            ray_cast(start, end, field.mask)
+
+    def sphere_traced():
+        for start, end in zip(start_positions, end_positions):
+            ray_cast(start, end, field.mask, distance_field=distance_field)
+
+    grid = field.occupancy
+    return {
+        "ray_cast.stepped": metric(RAY_COUNT / best_time(stepped, repeats), "rays/s", "higher"),
+        "ray_cast.sphere_trace": metric(RAY_COUNT / best_time(sphere_traced, repeats), "rays/s", "higher"),
+        "ray_cast.many": metric(RAY_COUNT / best_time(lambda: ray_cast_many(starts, ends, grid), repeats), "rays/s",
+                                "higher"),
+    }
+
+
+def bench_simulation(image: pygame.Surface, map_scale: int, repeats: int) -> dict:
+    """Steps per second of a scripted Simulation with a few robots, and robot steps per second of a RobotBatch"""
+    field = Field(image, margin=MARGIN)
+    routes = [[Position(x * map_scale, y * map_scale) for x, y in route] for route in (
+        ((160, 100), (620, 100), (620, 290)), ((620, 290), (160, 290), (160, 100)), ((400, 100), (400, 290)),
+        ((620, 100), (160, 100), (160, 290)))]
+
+    def run_simulation():
+        simulation = Simulation(field, time_step=1 / 50)
+        for route in routes:
+            robot = BeeLineRobot(field, max_velocity=400, max_acceleration=600)
+            robot.position = route[0].copy()
+            robot.sprite = Circle(0, 0, 10)
+            simulation.add_robot(robot, waypoints=[waypoint.copy() for waypoint in route])
+        return simulation.run(max_steps=2000)
+
+    steps = run_simulation()
+    simulation_time = best_time(run_simulation, repeats)
+
+    robot_count, batch_steps = 1000, 200
+    rng = np.random.default_rng(537)
+
+    def run_batch():
+        batch = RobotBatch(robot_count, max_velocity=400, max_acceleration=600,
+                           positions=rng.uniform(0, image.get_size(), (robot_count, 2)))
+        targets = rng.uniform(0, image.get_size(), (robot_count, 2))
+        for _ in range(batch_steps):
+            batch.go_to_positions(targets, 1 / 50, update_position=True)
+
+    return {
+        "simulation.steps": metric(steps / simulation_time, "steps/s", "higher"),
+        "simulation.batch": metric(robot_count * batch_steps / best_time(run_batch, repeats), "robot steps/s",
+                                   "higher"),
+    }
+
+
+def run(groups=GROUPS, map_scale: int = 2, repeats: int = 3) -> dict:
+    """
+    Runs the benchmarks
+    :param groups: Which of GROUPS to run
+    :param map_scale: How much to scale images/Map.png by
+    :param repeats: How many times each timing is repeated (the best time is kept)
+    :return: The results: metadata and {name: metric}
+    """
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        raise ValueError(f"Unknown benchmark groups {sorted(unknown)}")
+    pygame.init()
+    image = load_map(map_scale)
+    metrics = {}
+    if "field" in groups:
+        metrics.update(bench_field(image, repeats))
+    if "margin" in groups:
+        metrics.update(bench_margin(image, repeats))
+    if "path_find" in groups:
+        metrics.update(bench_path_find(image, map_scale, repeats))
+    if "ray_cast" in groups:
+        metrics.update(bench_ray_cast(image, repeats))
+    if "simulation" in groups:
+        metrics.update(bench_simulation(image, map_scale, repeats))
+    return {
+        "suite_version": SUITE_VERSION,
+        "metadata": {"map_scale": map_scale, "repeats": repeats, "python": platform.python_version(),
+                     "numpy": np.__version__, "pygame": pygame.version.ver, "machine": platform.machine(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "metrics": metrics,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2) -> list[dict]:
+    """
+    Compares results against a baseline
+    :param results: What run returned
+    :param baseline: What run returned before
+    :param threshold: How much worse (as a fraction) a metric has to be to count as a regression
+    :return: The metrics that got worse than threshold, with their baseline and current values
+    """
+    if baseline.get("suite_version") != results.get("suite_version"):
+        raise ValueError(f"The baseline is from suite version {baseline.get('suite_version')}, "
+                         f"these results are version {results.get('suite_version')}")
+    regressions = []
+    for name, current in results["metrics"].items():
+        previous = baseline["metrics"].get(name)
+        if previous is None or current["better"] is None or previous["value"] == 0:
+            continue
+        change = (current["value"] - previous["value"]) / abs(previous["value"])
+        worse = -change if current["better"] == "higher" else change
+        if worse > threshold:
+            regressions.append({"name": name, "baseline": previous["value"], "current": current["value"],
+                                "unit": current["unit"], "worse_by": worse})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="where to write the results as JSON")
+    parser.add_argument("--baseline", help="results to compare against, exits with 1 if anything regressed")
+    parser.add_argument("--threshold", type=float, default=0.2, help="how much worse counts as a regression")
+    parser.add_argument("--groups", default=",".join(GROUPS), help="which benchmarks to run, comma separated")
+    parser.add_argument("--map-scale", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=3)
+    arguments = parser.parse_args()
+
+    results = run(arguments.groups.split(","), arguments.map_scale, arguments.repeats)
+    for name, value in results["metrics"].items():
+        print(f"{name}: {value['value']:.4g} {value['unit']}")
+    if arguments.output:
+        with open(arguments.output, "w") as fout:
+            json.dump(results, fout, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as fin:
+            regressions = compare(results, json.load(fin), arguments.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['name']}: {regression['baseline']:.4g} -> {regression['current']:.4g} "
+                  f"{regression['unit']} ({regression['worse_by']:.0%} worse)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
@@ -0,0 +1,72 @@
+"""
+Compares Field construction against the old per-pixel get_at/set_at loop.
+Runs headless: python -m Benchmarks.FieldBenchmark [map_scale]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from Field import Field
+
+TARGET_SECONDS = 0.1
+
+
+def legacy_field_image(image: pygame.Surface) -> pygame.Surface:
+    """The white-to-transparent loop Field.__init__ used to run"""
+    field_image = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+    field_image.fill((255, 255, 255, 0))
+    field_image.blit(image, (0, 0))
+    for x in range(field_image.get_width()):
+        for y in range(field_image.get_height()):
+            if field_image.get_at((x, y)) == (255, 255, 255, 255):
+                field_image.set_at((x, y), (255, 255, 255, 0))
+    return field_image
+
+
+def best_time(func, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def run(map_scale: int = 4, repeats: int = 5) -> dict:
+    """
+    Times Field construction at the given map scale
+    :param map_scale: how much to scale images/Map.png by
+    :param repeats: how many times to run the fast path (the best time is kept)
+    :return: the timings in seconds, and whether the old and new masks match
+    """
+    pygame.init()
+    image = pygame.image.load("images/Map.png")
+    image = pygame.transform.scale(image, (image.get_width() * map_scale, image.get_height() * map_scale))
+
+    field_time = best_time(lambda: Field(image), repeats)
+    start_time = time.perf_counter()
+    legacy_mask = pygame.mask.from_surface(legacy_field_image(image))
+    legacy_time = time.perf_counter() - start_time
+    mask = Field(image).mask
+
+    return {
+        "map_scale": map_scale,
+        "field_seconds": field_time,
+        "legacy_seconds": legacy_time,
+        "speedup": legacy_time / field_time,
+        "masks_match": legacy_mask.count() == mask.count() == legacy_mask.overlap_area(mask, (0, 0)),
+    }
+
+
+if __name__ == "__main__":
+    results = run(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
+    print(f"Field construction at {results['map_scale']}x: {results['field_seconds'] * 1000:.1f} ms "
+          f"(legacy loop {results['legacy_seconds'] * 1000:.1f} ms, {results['speedup']:.0f}x faster)")
+    print(f"Masks match: {results['masks_match']}")
+    if results["field_seconds"] > TARGET_SECONDS:
+        print(f"SLOWER THAN TARGET ({TARGET_SECONDS * 1000:.0f} ms)")
+        sys.exit(1)
@@ -0,0 +1,160 @@
+"""
+Times the geometry types (Translation, Position, Rotation) and counts how many of them a robot makes per frame.
+Runs headless: python -m Benchmarks.GeometryBenchmark [repeats]
+"""
+import os
+import sys
+import time
+from math import cos, pi, sin
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from BeeLineRobot import BeeLineRobot
+from Utils.Position import Position
+from Utils.Rotation import Rotation
+from Utils.Translation import Translation
+
+FRAMES = 1000
+# geometry objects per Robot.go_to_position frame before the geometry types had in place operations, counted by this
+# benchmark on the baseline tree (the old types made some more of their own on top of the old robot code)
+BASELINE_OBJECTS_PER_FRAME = 23.1
+
+
+class AllocationCounter:
+    """Counts the Translations, Positions and Rotations made while it's active"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self.count = 0
+        self._originals = (Translation.__init__, Position.__init__, Rotation.__new__)
+        translation_init, position_init, rotation_new = self._originals
+
+        def counting_translation_init(instance, *args, **kwargs):
+            if type(instance) is Translation:  # a Position calling its parent's __init__ is already counted
+                self.count += 1
+            translation_init(instance, *args, **kwargs)
+
+        def counting_position_init(instance, *args, **kwargs):
+            self.count += 1
+            position_init(instance, *args, **kwargs)
+
+        def counting_rotation_new(cls, *args, **kwargs):
+            self.count += 1
+            return rotation_new(cls, *args, **kwargs)
+
+        Translation.__init__ = counting_translation_init
+        Position.__init__ = counting_position_init
+        Rotation.__new__ = counting_rotation_new
+        return self
+
+    def __exit__(self, *exc_info):
+        Translation.__init__, Position.__init__, Rotation.__new__ = self._originals
+
+
+def allocating_go_to_position(robot, target_position: Position, time_delta_seconds: float) -> bool:
+    """
+    Robot.go_to_position (with update_position and slowdown) the way it used to be written, with a new object for
+    every operation: get_distance_to(Position(0, 0)) for lengths and a = a + b instead of a += b
+    """
+    at_target = False
+    smoother = robot.acceleration_smoother
+    target_distance = target_position.get_distance_to(robot.position)
+    current_magnitude = robot.velocity.get_distance_to(Position(0, 0))
+    if target_distance < time_delta_seconds * (robot.max_acceleration - smoother.get_value()):
+        smoother.set_state(0)
+        robot.velocity = Position(0, 0)
+        current_magnitude = robot.velocity.get_distance_to(Position(0, 0)) / time_delta_seconds
+        at_target = True
+    elif target_distance <= robot.calculate_critical_distance():
+        current_magnitude = smoother.update(0, time_delta_seconds)
+    else:
+        current_magnitude = smoother.update(robot.max_acceleration, time_delta_seconds)
+
+    rotation_to = robot.position.get_angle_to(target_position)
+    new_velocity = Position(cos(rotation_to * pi / 180) * current_magnitude,
+                            sin(rotation_to * pi / 180) * current_magnitude)
+    # apply_force and update, with the old error_function of pos * 1
+    force = (new_velocity - robot.velocity) * 1
+    force.scale_to(robot.max_acceleration, only_downscale=True)
+    robot.velocity = robot.velocity + force
+    robot.velocity.scale_to(robot.max_velocity, only_downscale=True)
+    robot.position = robot.position + robot.velocity * time_delta_seconds
+    return at_target
+
+
+def count_objects_per_frame(go_to_position) -> float:
+    """The geometry objects made per frame by a robot driving towards a far away target"""
+    robot = BeeLineRobot(None, max_velocity=400, max_acceleration=600)
+    robot.position = Position(0, 0)
+    target = Position(10000, 10000)
+    with AllocationCounter() as counter:
+        for _ in range(FRAMES):
+            go_to_position(robot, target, 1 / 50)
+    return counter.count / FRAMES
+
+
+def time_operation(func, repeats: int) -> float:
+    """The best time of one call, in nanoseconds"""
+    best = float("inf")
+    for _ in range(5):
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            func()
+        best = min(best, time.perf_counter() - start_time)
+    return best / repeats * 1e9
+
+
+def run(repeats: int = 100000) -> dict:
+    """
+    Times common geometry operations, the way the code used to do them and the way it does now, and counts the
+    objects made per frame by a robot driving to a target, with the old allocating code and with Robot.go_to_position
+    :param repeats: How many times to run each operation
+    :return: The nanoseconds per operation and the objects made per frame
+    """
+    a = Position(3.0, 4.0)
+    b = Position(1.0, 2.0)
+
+    def add_copy():
+        nonlocal a
+        a = a + b
+
+    def add_in_place():
+        nonlocal a
+        a += b
+
+    operations = {
+        "norm (distance to a new Position(0, 0))": lambda: a.get_distance_to(Position(0, 0)),
+        "norm": a.norm,
+        "add (new object)": add_copy,
+        "add (in place)": add_in_place,
+        "scale_to": lambda: a.scale_to(5.0),
+        "construct": lambda: Position(1.0, 2.0, 3.0),
+    }
+    timings = {name: time_operation(operation, repeats) for name, operation in operations.items()}
+
+    allocating_objects = count_objects_per_frame(allocating_go_to_position)
+    objects = count_objects_per_frame(
+        lambda robot, target, time_delta_seconds: robot.go_to_position(target, time_delta_seconds, True))
+
+    robot = BeeLineRobot(None, max_velocity=400, max_acceleration=600)
+    robot.position = Position(0, 0)
+    target = Position(10000, 10000)
+    start_time = time.perf_counter()
+    for _ in range(FRAMES):
+        robot.go_to_position(target, 1 / 50, update_position=True)
+    frame_time = (time.perf_counter() - start_time) / FRAMES
+
+    return {"nanoseconds": timings, "objects_per_frame": objects, "allocating_objects_per_frame": allocating_objects,
+            "baseline_objects_per_frame": BASELINE_OBJECTS_PER_FRAME, "frame_microseconds": frame_time * 1e6}
+
+
+if __name__ == "__main__":
+    results = run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+    for name, nanoseconds in results["nanoseconds"].items():
+        print(f"{name}: {nanoseconds:.0f} ns")
+    print(f"Robot.go_to_position: {results['objects_per_frame']:.1f} geometry objects, "
+          f"{results['frame_microseconds']:.1f} us per frame")
+    print(f"before the in place operations: {results['allocating_objects_per_frame']:.1f} geometry objects per frame "
+          f"with the same types, {results['baseline_objects_per_frame']:.1f} with the old ones")
@@ -1,6 +1,50 @@
+import hashlib
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
 import pygame
 from pygame import sprite
-from Utils.DebugPrint import DebugPrint
+from Utils.DistanceTransform import distance_transform
+from Utils.Instrumentation import instrumentation
+from Utils.Occupancy import grid_to_mask
+
+# how many margin masks are kept around, so toggling between margins doesn't recompute them
+MARGIN_CACHE_SIZE = 4
+# margin versions are unique across every field, so a version alone says which field and which margin mask it's for
+_margin_versions = count(1)
+
+
+def field_hash(field: "Field") -> str:
+    """
+    A hash of the obstacles of a field (not the margin), to check a saved route table or nav mesh is for the same field
+    image
+    :param field: The field
+    :return: The hex digest
+    """
+    digest = hashlib.sha1(np.array(field.occupancy.shape, dtype=np.int64).tobytes())
+    digest.update(np.packbits(field.occupancy).tobytes())
+    return digest.hexdigest()
+
+
+def _downsample(grid: np.ndarray, resolution: float) -> np.ndarray:
+    """Resamples a grid so that a cell is set if any cell of the original grid it overlaps is set"""
+    width, height = grid.shape
+    # counts of set cells over every [0, x) by [0, y) rectangle, so any block can be counted with 4 lookups
+    sums = np.zeros((width + 1, height + 1), dtype=np.int64)
+    sums[1:, 1:] = grid.cumsum(axis=0).cumsum(axis=1)
+
+    def bounds(cells: int, size: int) -> tuple[np.ndarray, np.ndarray]:
+        index = np.arange(cells)
+        start = np.minimum(np.floor(index / resolution).astype(np.int64), size - 1)
+        end = np.clip(np.ceil((index + 1) / resolution).astype(np.int64), start + 1, size)
+        return start, end
+
+    x_start, x_end = bounds(int(resolution * width), width)
+    y_start, y_end = bounds(int(resolution * height), height)
+    counts = sums[x_end][:, y_end] - sums[x_start][:, y_end] - sums[x_end][:, y_start] + sums[x_start][:, y_start]
+    return counts > 0
+
 
 class Field(sprite.Sprite):
     def __init__(self, image: pygame.image, margin: int = 0, margin_shape="circle"):
@@ -10,15 +54,22 @@ class Field(sprite.Sprite):
 
         self.image: pygame.surface.Surface = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
         self.image.fill((255, 255, 255, 0))
-        self.image.blit(image, (0, 0))
-
-        # make image transparent
-        self.image = self.image.convert_alpha()
-        # make white pixels transparent
-        for x in range(self.image.get_width()):
-            for y in range(self.image.get_height()):
-                if self.image.get_at((x, y)) == (255, 255, 255, 255):
-                    self.image.set_at((x, y), (255, 255, 255, 0))
+        # the SDL2 blender gives the same result as the default one here, and is a lot faster on big surfaces
+        self.image.blit(image, (0, 0), special_flags=pygame.BLEND_ALPHA_SDL2)
+
+        # make image transparent (converting needs a display, so it's skipped when running headless)
+        if pygame.display.get_surface() is not None:
+            self.image = self.image.convert_alpha()
+        # make white pixels transparent. works on a view of the raw pixels instead of get_at/set_at per pixel
+        pixels = pygame.surfarray.pixels2d(self.image)
+        # map_rgb returns a signed int, the pixel array is unsigned
+        opaque_white = self.image.map_rgb((255, 255, 255, 255)) & 0xFFFFFFFF
+        pixels[pixels == opaque_white] = self.image.map_rgb((255, 255, 255, 0)) & 0xFFFFFFFF
+        del pixels  # unlocks the surface
+        alpha = pygame.surfarray.pixels_alpha(self.image)
+        # occupancy grid indexed [x, y], True where there is an obstacle (same threshold as mask.from_surface)
+        self.occupancy: np.ndarray = alpha > 127
+        del alpha
 
         # sets stuff up for collision detection
         self.rect = self.image.get_rect()
@@ -27,8 +78,19 @@ class Field(sprite.Sprite):
 
         # margins
         self.margin_mask: pygame.mask.Mask = self.mask
+        self.margin_occupancy: np.ndarray = self.occupancy
         self.margin: int = margin
+        self.margin_shape: str = margin_shape
         self._margin_mask_surface_cache = None  # this is a performance optimization. (cache, has_changed)
+        self._distance_fields: dict[str, np.ndarray] = {}
+        # recently used margins:
+        # (margin, margin_shape) -> [margin mask, margin occupancy, margin surface cache, margin distance field,
+        #                            {resolution: downsampled margin occupancy}, margin version]
+        self._margin_cache: OrderedDict[tuple[int, str], list] = OrderedDict()
+        self._margin_entry: list = None
+        # which margin mask is set, anything computed from the margin mask can be keyed by it. every cached mask keeps
+        # its version, so toggling back to a margin that's still cached keeps everything computed from it valid
+        self.margin_version: int = 0
         self.set_margin_mask(margin, margin_shape)
 
     def draw(self, screen, show_margin_mask=False):
@@ -40,53 +102,93 @@ class Field(sprite.Sprite):
 
         # draw the field
         if show_margin_mask:
+            if self._margin_mask_surface_cache is None:
+                self._update_margin_mask_cache()
             screen.blit(self._margin_mask_surface_cache, self.rect)
         else:
             screen.blit(self.image, self.rect)
 
     def set_margin_mask(self, margin: int, margin_shape="circle") -> pygame.mask.Mask:
         """Sets the margin mask to the given margin.
-        Note that this is an incredibly slow operation, so it should only be done once.
+        The margin is a threshold over the distance from each pixel to the nearest obstacle, so after the distance
+        field has been computed once (on the first non-zero margin) this is fast, and the last few margins are cached.
         :param margin: the margin to set to
-        :return: None"""
+        :param margin_shape: "circle" (euclidean distance) or "square" (max(|dx|, |dy|))
+        :return: the new margin mask"""
 
-        self.margin = margin
-        
-        if margin == 0:
-            self.margin_mask = self.mask
-            self._update_margin_mask_cache()
-            return self.margin_mask
-
-        margin_mask = pygame.mask.from_surface(self.image, margin).to_surface(unsetcolor=(255, 255, 255, 0))
-        points = []
-        for x in range(margin_mask.get_size()[0]):
-            for y in range(margin_mask.get_size()[1]):
-                if margin_mask.get_at((x, y)) == (255, 255, 255, 255):
-                    points.append((x, y))
-
-        if margin_shape == "circle":
-            for x, y in points:
-                pygame.draw.circle(margin_mask, (255, 255, 255, 255), (x, y), margin)
-        elif margin_shape == "square":
-            for x, y in points:
-                pygame.draw.rect(margin_mask, (255, 255, 255, 255), (x - margin, y - margin, margin * 2, margin * 2))
-        else:
+        if margin_shape not in ("circle", "square"):
             raise ValueError("margin_shape must be either 'circle' or 'square'")
 
-        self.margin_mask = pygame.mask.from_surface(margin_mask)
-        self._update_margin_mask_cache()
+        self.margin = margin
+        self.margin_shape = margin_shape
+
+        key = (margin, margin_shape) if margin != 0 else (0, "circle")  # every shape of a 0 margin is the same
+        entry = self._margin_cache.get(key)
+        instrumentation.count("field.margin_cache_misses" if entry is None else "field.margin_cache_hits")
+        if entry is None:
+            if margin == 0:
+                entry = [self.mask, self.occupancy, None, None, {}, next(_margin_versions)]
+            else:
+                occupancy = self.get_distance_field("euclidean" if margin_shape == "circle" else "chebyshev") <= margin
+                entry = [grid_to_mask(occupancy), occupancy, None, None, {}, next(_margin_versions)]
+            self._margin_cache[key] = entry
+            if len(self._margin_cache) > MARGIN_CACHE_SIZE:
+                self._margin_cache.popitem(last=False)
+        else:
+            self._margin_cache.move_to_end(key)
 
+        self._margin_entry = entry
+        self.margin_mask, self.margin_occupancy, self._margin_mask_surface_cache, _, _, self.margin_version = entry
         return self.margin_mask
 
+    def get_distance_field(self, metric: str = "euclidean") -> np.ndarray:
+        """Gets the distance from every pixel to the nearest obstacle pixel of self.mask. Computed once per metric
+        :param metric: "euclidean" or "chebyshev"
+        :return: a float32 array indexed [x, y]"""
+        if metric not in self._distance_fields:
+            self._distance_fields[metric] = distance_transform(self.occupancy, metric)
+        return self._distance_fields[metric]
+
+    @property
+    def distance_field(self) -> np.ndarray:
+        """The euclidean distance from every pixel to the nearest obstacle pixel of self.mask"""
+        return self.get_distance_field("euclidean")
+
+    def get_margin_distance_field(self) -> np.ndarray:
+        """Gets a lower bound of the distance from every pixel to the nearest pixel of self.margin_mask.
+        Every pixel of the margin is within the margin of an obstacle (margin * sqrt(2) for square margins), so the
+        distance to the obstacles minus that is never more than the real distance to the margin
+        :return: a float32 array indexed [x, y] (values <= 0 are inside the margin)"""
+        if self._margin_entry[3] is None:
+            reach = self.margin if self.margin_shape == "circle" else self.margin * np.sqrt(2)
+            self._margin_entry[3] = self.distance_field - np.float32(reach)
+        return self._margin_entry[3]
+
+    def get_occupancy(self, resolution: float = 1) -> np.ndarray:
+        """Gets the margin occupancy at a lower (or higher) resolution, for planning on a coarser grid.
+        The grid is conservative: a cell is blocked if any pixel it overlaps is in the margin. Each resolution is built
+        once per margin, and dropped along with the margin
+        :param resolution: cells per pixel. the grid is int(resolution * width) by int(resolution * height)
+        :return: a bool array indexed [x, y], True where blocked. don't modify it, it's shared"""
+        if resolution <= 0:
+            raise ValueError("resolution must be positive")
+        if resolution == 1:
+            return self.margin_occupancy
+        levels = self._margin_entry[4]
+        if resolution not in levels:
+            levels[resolution] = _downsample(self.margin_occupancy, resolution)
+        return levels[resolution]
+
     # this part is a performance optimization. it basically caches the margin mask surface so it doesn't have to
     # be recreated every frame
     def _update_margin_mask_cache(self):
         """Updates the margin mask cache. This is a performance optimization, and should not be called manually"""
-        DebugPrint.add_debug_function("updating margin mask cache")
+        instrumentation.count("field.margin_surface_builds")
         original = self.image.copy()
         margins = self.margin_mask.to_surface(setcolor=(125, 125, 125), unsetcolor=(255, 255, 255))
         margins.blit(original, (0, 0))
         self._margin_mask_surface_cache = margins
+        self._margin_entry[2] = margins  # so toggling back to this margin doesn't have to rebuild it
 
 
 class Circle(sprite.Sprite):
@@ -1,15 +1,62 @@
 import math
 
 from pygame.mask import Mask
-from Field import Field
+from Field import Field, field_hash
 import pygame
 from math import atan2, pi
 from time import time
 import pickle
-from Utils.DebugPrint import DebugPrint
+from heapq import heappush, heappop
+
+import numpy as np
 
 from Utils.RayCast import ray_cast
+from Utils.Instrumentation import instrumentation
 from Utils.Position import Position
+from Utils.Contours import remove_pinches, trace_contours, simplify_contours, signed_area, contains_point
+from Utils.Triangulation import triangulate_polygon, make_delaunay
+
+
+# the binary mesh format (.navbin). a fixed size little endian header, then the arrays one after the other, each
+# starting on an 8 byte boundary, in the order of _BINARY_ARRAYS
+BINARY_MAGIC = b"PYNAVMSH"
+BINARY_VERSION = 2
+_BINARY_HAS_INDEX = 1  # flag: the bucket grid is stored
+_BINARY_HAS_FIELD = 2  # flag: the mesh was generated from a field, whose hash, margin and margin shape are stored
+_BINARY_HEADER = np.dtype([
+    ("magic", "S8"), ("version", "<u4"), ("flags", "<u4"), ("pixels_per_foot", "<f8"), ("field_hash", "S40"),
+    ("margin", "<i8"), ("margin_shape", "S8"),
+    ("point_count", "<u8"), ("triangle_count", "<u8"), ("adjacency_count", "<u8"), ("bucket_count", "<u8"),
+    ("bucket_entry_count", "<u8"), ("index_origin", "<f8", (2,)), ("index_cell_size", "<f8"),
+    ("index_shape", "<u8", (2,)),
+])
+# (attribute, dtype, shape from the header)
+_BINARY_ARRAYS = (
+    ("point_array", "<f8", lambda header: (header["point_count"], 2)),
+    ("triangle_array", "<i4", lambda header: (header["triangle_count"], 3)),
+    ("adjacency_offsets", "<i4", lambda header: (header["triangle_count"] + 1,)),
+    ("adjacency", "<i4", lambda header: (header["adjacency_count"],)),
+    ("portals", "<f8", lambda header: (header["adjacency_count"], 2, 2)),
+    ("bucket_offsets", "<i4", lambda header: (header["bucket_count"] + 1,)),
+    ("bucket_triangles", "<i4", lambda header: (header["bucket_entry_count"],)),
+)
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def _cross(o, a, b) -> float:
+    """Positive if b is to the left of the line from o through a (counterclockwise in x/y terms)"""
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def _triangle_contains(a: np.ndarray, b: np.ndarray, c: np.ndarray, point: np.ndarray) -> np.ndarray:
+    """For (n, 2) arrays of triangle corners, which triangles contain the point (edges included)"""
+    d1 = (b[..., 0] - a[..., 0]) * (point[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (point[..., 0] - a[..., 0])
+    d2 = (c[..., 0] - b[..., 0]) * (point[..., 1] - b[..., 1]) - (c[..., 1] - b[..., 1]) * (point[..., 0] - b[..., 0])
+    d3 = (a[..., 0] - c[..., 0]) * (point[..., 1] - c[..., 1]) - (a[..., 1] - c[..., 1]) * (point[..., 0] - c[..., 0])
+    return ((d1 >= 0) & (d2 >= 0) & (d3 >= 0)) | ((d1 <= 0) & (d2 <= 0) & (d3 <= 0))
 
 
 class Edge:
@@ -29,6 +76,39 @@ class TriangleNavMesh:
         self.triangles: list[tuple[Position, Position, Position]] = []  # 3 points
         self.points: list[Position] = []
         self.graph: list[list[int]] = []
+        # the Field.margin_version the mesh was generated from (or checked against by load_binary), None if neither
+        self.margin_version: int | None = None
+        # the field (see Field.field_hash), margin and margin shape the mesh was generated from, None if it wasn't.
+        # unlike the margin version these mean the same in every process, so they're what saved meshes are checked by
+        self.field_hash: str | None = None
+        self.margin: int | None = None
+        self.margin_shape: str | None = None
+        self.generation_time = 0.0
+
+        # the mesh as arrays, for queries (see build_arrays). the adjacency is in CSR form: the neighbours of
+        # triangle t are adjacency[adjacency_offsets[t]:adjacency_offsets[t + 1]], and portals has the two ends of
+        # the edge shared with each of them
+        self.point_array = np.zeros((0, 2))
+        self.triangle_array = np.zeros((0, 3), dtype=np.int32)
+        self.centroids = np.zeros((0, 2))
+        self.adjacency_offsets = np.zeros(1, dtype=np.int32)
+        self.adjacency = np.zeros(0, dtype=np.int32)
+        self.portals = np.zeros((0, 2, 2))
+        # a bucket grid over the triangles' bounding boxes, for locate (see build_index). the triangles that overlap
+        # bucket (x, y) are bucket_triangles[bucket_offsets[b]:bucket_offsets[b + 1]] with b = x * index_shape[1] + y
+        self.index_origin = np.zeros(2)
+        self.index_cell_size = 1.0
+        self.index_shape = (0, 0)
+        self.bucket_offsets = np.zeros(1, dtype=np.int32)
+        self.bucket_triangles = np.zeros(0, dtype=np.int32)
+        # portals as python lists, made the first time a search needs them
+        self._portal_list: list | None = None
+
+        # counters from the last query
+        self.triangles_expanded = 0
+        self.locate_time = 0.0
+        self.search_time = 0.0
+        self.funnel_time = 0.0
 
     def create_surface(self, size: tuple[int, int] = (1000, 1000), point_color=(0, 255, 0, 255),
                        line_color=(255, 0, 0, 255)) -> pygame.Surface:
@@ -41,16 +121,15 @@ class TriangleNavMesh:
         """
         screen = pygame.Surface(size, pygame.SRCALPHA)
         screen.fill((0, 0, 0, 0))
-        for triangle in self.triangles:
-            pygame.draw.line(screen, line_color, (self.points[triangle[0]] * self.pixels_per_foot).as_tuple()[:2],
-                             (self.points[triangle[1]] * self.pixels_per_foot).as_tuple()[:2], 2)
-            pygame.draw.line(screen, line_color, (self.points[triangle[1]] * self.pixels_per_foot).as_tuple()[:2],
-                             (self.points[triangle[2]] * self.pixels_per_foot).as_tuple()[:2], 2)
-            pygame.draw.line(screen, line_color, (self.points[triangle[2]] * self.pixels_per_foot).as_tuple()[:2],
-                             (self.points[triangle[0]] * self.pixels_per_foot).as_tuple()[:2], 2)
-
-        for points in self.points:
-            pygame.draw.circle(screen, point_color, (points * self.pixels_per_foot).as_tuple()[:2], 3)
+        # drawn from the arrays, which a mesh loaded from a binary file has without the lists
+        pixels = (self.point_array * self.pixels_per_foot).tolist()
+        for a, b, c in self.triangle_array.tolist():
+            pygame.draw.line(screen, line_color, pixels[a], pixels[b], 2)
+            pygame.draw.line(screen, line_color, pixels[b], pixels[c], 2)
+            pygame.draw.line(screen, line_color, pixels[c], pixels[a], 2)
+
+        for point in pixels:
+            pygame.draw.circle(screen, point_color, point, 3)
         return screen
 
     def manually_make_nodes(self, image: pygame.Surface, scale=3) -> None:
@@ -99,7 +178,6 @@ class TriangleNavMesh:
                                  triangle[0].as_tuple()[:2], 2)
 
             for i in range(1, len(curr_triangle)):
-                print(curr_triangle[i-1] * self.pixels_per_foot, curr_triangle[i] * self.pixels_per_foot)
                 pygame.draw.line(screen, (0, 255, 0), tuple(map(int, (curr_triangle[i - 1] * self.pixels_per_foot).as_tuple()[:2])),
                                  tuple(map(int, (curr_triangle[i] * self.pixels_per_foot).as_tuple()[:2])), 2)
 
@@ -137,6 +215,77 @@ class TriangleNavMesh:
             last_mouse_state = pygame.mouse.get_pressed()
             pygame.display.flip()
 
+    def generate_from_field(self, field: Field, tolerance: float = 2.0, min_area: float = 16) -> None:
+        """
+        Generates the nav mesh from the free space of the field's margin mask, replacing whatever was loaded.
+        The boundaries of the free space are traced along the pixel edges, tolerance pixels clear of the margin, and
+        simplified so no boundary moves by more than tolerance pixels, so they never cut into the margin. The free
+        space between them is triangulated (constrained Delaunay, so the triangles never cross a boundary and are as
+        fat as the boundaries allow). Each triangle's neighbours are the triangles it shares an edge with.
+        :param field: The field to generate from
+        :param tolerance: How far (in pixels) the simplified boundaries can be from the real ones
+        :param min_area: Free regions smaller than this many square pixels are left out
+        :return:
+        """
+        start_time = time()
+        # a simplified boundary can cut up to tolerance into the margin, so the boundaries are traced around the margin
+        # grown by that much (and a pixel, for the pixel edges they follow). that keeps the mesh out of the margin
+        grid = field.margin_occupancy
+        if tolerance > 0:
+            metric = "euclidean" if field.margin_shape == "circle" else "chebyshev"
+            grid = grid | (field.get_distance_field(metric) <= field.margin + tolerance + 1)
+        # two free pixels that only touch at a corner can't be driven between, and would make boundaries touch
+        grid = remove_pinches(grid)
+        contours = [contour for contour in simplify_contours(trace_contours(grid), tolerance)
+                    if abs(signed_area(contour)) >= min_area or signed_area(contour) < 0]
+        areas = [signed_area(contour) for contour in contours]
+
+        # free regions have a positive area, obstacles inside them a negative one. an obstacle belongs to the
+        # smallest free region around it
+        outers = [i for i, area in enumerate(areas) if area > 0]
+        bounds = [(contour.min(axis=0), contour.max(axis=0)) for contour in contours]
+        holes: dict[int, list[int]] = {outer: [] for outer in outers}
+        for hole in (i for i, area in enumerate(areas) if area < 0):
+            x, y = contours[hole][0]
+            containing = [outer for outer in outers if (bounds[outer][0] <= (x, y)).all() and
+                          (bounds[outer][1] >= (x, y)).all() and contains_point(contours[outer], x, y)]
+            if containing:
+                holes[min(containing, key=lambda outer: areas[outer])].append(hole)
+
+        points: list[tuple[float, float]] = []
+        rings: list[list[int]] = []
+        for contour in contours:
+            rings.append(list(range(len(points), len(points) + len(contour))))
+            points.extend(map(tuple, contour.astype(float).tolist()))
+        constrained_edges = {(min(a, b), max(a, b)) for ring in rings for a, b in zip(ring, ring[1:] + ring[:1])}
+
+        triangles = []
+        for outer in outers:
+            triangles.extend(triangulate_polygon(points, [rings[outer]] + [rings[hole] for hole in holes[outer]],
+                                                 bucket_size=max(8.0, 4 * tolerance)))
+        triangles = make_delaunay(points, triangles, constrained_edges)
+
+        self.points = [Position(x / self.pixels_per_foot, y / self.pixels_per_foot) for x, y in points]
+        self.triangles = triangles
+        self.graph = self._build_graph(triangles)
+        self.build_arrays()
+        self.margin_version = field.margin_version
+        self.field_hash, self.margin, self.margin_shape = field_hash(field), field.margin, field.margin_shape
+        self.generation_time = time() - start_time
+
+    @staticmethod
+    def _build_graph(triangles: list[tuple[int, int, int]]) -> list[list[int]]:
+        """Links every triangle to the triangles it shares an edge with"""
+        edge_triangles: dict[tuple[int, int], list[int]] = {}
+        for index, (a, b, c) in enumerate(triangles):
+            for edge in ((a, b), (b, c), (c, a)):
+                edge_triangles.setdefault((min(edge), max(edge)), []).append(index)
+        graph = [[] for _ in triangles]
+        for shared in edge_triangles.values():
+            for first in shared:
+                graph[first].extend(second for second in shared if second != first)
+        return graph
+
     def load_graph(self, filename: str) -> None:
         """
         This function loads the nav mesh from a file
@@ -147,12 +296,422 @@ class TriangleNavMesh:
             raise ValueError("File must be a .navmesh file")
         with open(filename, "r") as fin:
             point_count, triangle_count, edge_count = map(int, fin.readline().split(" "))
-            self.points = [Position(float(i[0]), float(i[2])) for i in fin.readline().split(" ")]
+            # points are "x,y" pairs separated by spaces
+            self.points = [Position(*map(float, point.split(","))) for point in fin.readline().split()]
             self.triangles = [tuple(map(int, fin.readline().split(" "))) for _ in range(triangle_count)]
             self.graph = [list() for _ in range(triangle_count)]
             for _ in range(edge_count):
                 a, b = map(int, fin.readline().split(" "))
-                self.graph[a].append(b)
+                # triangles sharing an edge can be crossed between both ways, whichever way round it's listed
+                if b not in self.graph[a]:
+                    self.graph[a].append(b)
+                if a not in self.graph[b]:
+                    self.graph[b].append(a)
+        self.margin_version = self.field_hash = self.margin = self.margin_shape = None
+        self.build_arrays()
+
+    def save_binary(self, filename: str, include_index: bool = True) -> None:
+        """
+        Saves the mesh's arrays in the binary format, which load_binary maps straight into memory
+        :param filename: The name of the file to save to, ending in .navbin
+        :param include_index: If the bucket grid is saved too, otherwise it's rebuilt on load
+        :return:
+        """
+        if not filename.endswith(".navbin"):
+            raise ValueError("File must be a .navbin file")
+        include_index = include_index and len(self.bucket_offsets) > 1
+        header = np.zeros((), dtype=_BINARY_HEADER)
+        header["magic"] = BINARY_MAGIC
+        header["version"] = BINARY_VERSION
+        has_field = self.field_hash is not None
+        header["flags"] = (_BINARY_HAS_INDEX if include_index else 0) | (_BINARY_HAS_FIELD if has_field else 0)
+        header["pixels_per_foot"] = self.pixels_per_foot
+        if has_field:
+            header["field_hash"] = self.field_hash.encode()
+            header["margin"] = self.margin
+            header["margin_shape"] = self.margin_shape.encode()
+        header["point_count"] = len(self.point_array)
+        header["triangle_count"] = len(self.triangle_array)
+        header["adjacency_count"] = len(self.adjacency)
+        if include_index:
+            header["bucket_count"] = len(self.bucket_offsets) - 1
+            header["bucket_entry_count"] = len(self.bucket_triangles)
+            header["index_origin"] = self.index_origin
+            header["index_cell_size"] = self.index_cell_size
+            header["index_shape"] = self.index_shape
+
+        with open(filename, "wb") as fout:
+            fout.write(header.tobytes())
+            offset = _BINARY_HEADER.itemsize
+            for name, dtype, shape in _BINARY_ARRAYS:
+                if name.startswith("bucket") and not include_index:
+                    continue
+                fout.write(bytes(_aligned(offset) - offset))
+                offset = _aligned(offset)
+                array = np.ascontiguousarray(getattr(self, name), dtype=dtype).reshape(shape(header))
+                fout.write(array.tobytes())
+                offset += array.nbytes
+
+    def load_binary(self, filename: str, field: Field = None) -> None:
+        """
+        Loads a mesh saved by save_binary. The arrays are read only views of the memory mapped file, so nothing is
+        read or copied until a query touches it. Only the arrays are loaded, see build_lists for points, triangles and
+        graph
+        :param filename: The name of the file to load from
+        :param field: The field the mesh is for, if it should be checked. A mesh generated from a field has to be for
+        the same field image, margin and margin shape, and then gets the field's margin version
+        :return:
+        """
+        if not filename.endswith(".navbin"):
+            raise ValueError("File must be a .navbin file")
+        data = np.memmap(filename, dtype=np.uint8, mode="r")
+        if data.size < _BINARY_HEADER.itemsize:
+            raise ValueError(f"{filename} is too short to be a nav mesh")
+        header = data[:_BINARY_HEADER.itemsize].view(_BINARY_HEADER)[0]
+        if header["magic"] != BINARY_MAGIC:
+            raise ValueError(f"{filename} isn't a binary nav mesh")
+        if header["version"] != BINARY_VERSION:
+            raise ValueError(f"{filename} is version {header['version']}, only version {BINARY_VERSION} is supported")
+        has_index = bool(header["flags"] & _BINARY_HAS_INDEX)
+        if header["flags"] & _BINARY_HAS_FIELD:
+            saved_field = (header["field_hash"].decode(), int(header["margin"]), header["margin_shape"].decode())
+        else:
+            saved_field = (None, None, None)
+        if field is not None and saved_field[0] is not None:
+            if saved_field[1:] != (field.margin, field.margin_shape):
+                raise ValueError(f"{filename} is for a {saved_field[2]} margin of {saved_field[1]}, the field has a "
+                                 f"{field.margin_shape} margin of {field.margin}")
+            if saved_field[0] != field_hash(field):
+                raise ValueError(f"{filename} is for a different field image")
+
+        offset = _BINARY_HEADER.itemsize
+        for name, dtype, shape in _BINARY_ARRAYS:
+            if name.startswith("bucket") and not has_index:
+                continue
+            offset = _aligned(offset)
+            shape = tuple(int(size) for size in shape(header))
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            if offset + size > data.size:
+                raise ValueError(f"{filename} is truncated")
+            setattr(self, name, data[offset:offset + size].view(dtype).reshape(shape))
+            offset += size
+
+        self.pixels_per_foot = float(header["pixels_per_foot"])
+        self.field_hash, self.margin, self.margin_shape = saved_field
+        self.margin_version = field.margin_version if field is not None and self.field_hash is not None else None
+        self.centroids = self.point_array[self.triangle_array].mean(axis=1) if len(self.triangle_array) else \
+            np.zeros((0, 2))
+        self.points, self.triangles, self.graph = [], [], []
+        self._portal_list = None
+        if has_index:
+            self.index_origin = np.array(header["index_origin"], dtype=np.float64)
+            self.index_cell_size = float(header["index_cell_size"])
+            self.index_shape = tuple(int(size) for size in header["index_shape"])
+        else:
+            self.build_index()
+
+    def build_lists(self) -> None:
+        """
+        Rebuilds points, triangles and graph from the arrays, for a mesh loaded with load_binary
+        :return:
+        """
+        self.points = [Position(x, y) for x, y in self.point_array.tolist()]
+        self.triangles = [tuple(triangle) for triangle in self.triangle_array.tolist()]
+        offsets = self.adjacency_offsets.tolist()
+        adjacency = self.adjacency.tolist()
+        self.graph = [adjacency[offsets[triangle]:offsets[triangle + 1]] for triangle in range(len(self.triangles))]
+
+    def build_arrays(self) -> None:
+        """
+        Builds the arrays queries run on from points, triangles and graph. Only neighbours that really share an
+        edge are kept, since a path has to cross that edge
+        :return:
+        """
+        self.point_array = np.array([(point.x, point.y) for point in self.points], dtype=np.float64).reshape(-1, 2)
+        self.triangle_array = np.array(self.triangles, dtype=np.int32).reshape(-1, 3)
+        self.centroids = self.point_array[self.triangle_array].mean(axis=1) if len(self.triangle_array) else \
+            np.zeros((0, 2))
+
+        neighbours = [[other for other in dict.fromkeys(self.graph[triangle]) if other != triangle and
+                       len(set(self.triangles[triangle]) & set(self.triangles[other])) == 2]
+                      for triangle in range(len(self.triangles))]
+        self.adjacency_offsets = np.zeros(len(neighbours) + 1, dtype=np.int32)
+        self.adjacency_offsets[1:] = np.cumsum([len(others) for others in neighbours])
+        self.adjacency = np.array([other for others in neighbours for other in others], dtype=np.int32)
+        self.portals = np.array(
+            [self.point_array[sorted(set(self.triangles[triangle]) & set(self.triangles[other]))]
+             for triangle, others in enumerate(neighbours) for other in others]).reshape(-1, 2, 2)
+        self._portal_list = None
+        self.build_index()
+
+    def build_index(self, triangles_per_bucket: float = 2.0) -> None:
+        """
+        Builds the bucket grid locate uses: a uniform grid over the mesh, each bucket listing the triangles whose
+        bounding box overlaps it. Buckets are sized so there are about as many as triangles / triangles_per_bucket,
+        which makes locating a point O(1) on average
+        :param triangles_per_bucket: Roughly how many triangles to aim for per bucket
+        :return:
+        """
+        if len(self.triangle_array) == 0:
+            self.index_origin, self.index_cell_size, self.index_shape = np.zeros(2), 1.0, (0, 0)
+            self.bucket_offsets = np.zeros(1, dtype=np.int32)
+            self.bucket_triangles = np.zeros(0, dtype=np.int32)
+            return
+        corners = self.point_array[self.triangle_array]
+        low, high = corners.min(axis=1), corners.max(axis=1)
+        origin = low.min(axis=0)
+        extent = np.maximum(high.max(axis=0) - origin, 1e-9)
+        bucket_count = max(1.0, len(self.triangle_array) / triangles_per_bucket)
+        cell_size = float(max(np.sqrt(extent[0] * extent[1] / bucket_count), extent.max() / 4096))
+        shape = tuple(int(size) for size in np.floor(extent / cell_size).astype(np.int64) + 1)
+
+        # every (bucket, triangle) pair, with the bounding box of each triangle expanded into its buckets
+        first = np.floor((low - origin) / cell_size).astype(np.int64)
+        last = np.minimum(np.floor((high - origin) / cell_size).astype(np.int64), np.array(shape) - 1)
+        spans = last - first + 1
+        counts = spans[:, 0] * spans[:, 1]
+        triangles = np.repeat(np.arange(len(counts)), counts)
+        offsets_in_box = np.arange(len(triangles)) - np.repeat(np.cumsum(counts) - counts, counts)
+        x = first[triangles, 0] + offsets_in_box // spans[triangles, 1]
+        y = first[triangles, 1] + offsets_in_box % spans[triangles, 1]
+        buckets = x * shape[1] + y
+        order = np.argsort(buckets, kind="stable")
+
+        self.index_origin = origin
+        self.index_cell_size = cell_size
+        self.index_shape = shape
+        self.bucket_offsets = np.zeros(shape[0] * shape[1] + 1, dtype=np.int32)
+        self.bucket_offsets[1:] = np.cumsum(np.bincount(buckets, minlength=shape[0] * shape[1]))
+        self.bucket_triangles = triangles[order].astype(np.int32)
+
+    def _buckets(self, points: np.ndarray) -> np.ndarray:
+        """The bucket of each of an (n, 2) array of points, -1 for points outside the grid"""
+        cells = np.floor((points - self.index_origin) / self.index_cell_size).astype(np.int64)
+        inside = (cells >= 0).all(axis=1) & (cells < np.array(self.index_shape)).all(axis=1)
+        return np.where(inside, cells[:, 0] * self.index_shape[1] + cells[:, 1], -1)
+
+    def locate(self, position: Position) -> int:
+        """
+        Finds the triangle a position is in
+        :param position: The position, in the mesh's units
+        :return: The index of the triangle, or -1 if it isn't in any
+        """
+        point = np.array([position.x, position.y], dtype=np.float64)
+        bucket = int(self._buckets(point[None])[0])
+        if bucket == -1:
+            return -1
+        candidates = self.bucket_triangles[self.bucket_offsets[bucket]:self.bucket_offsets[bucket + 1]]
+        corners = self.point_array[self.triangle_array[candidates]]
+        inside = _triangle_contains(corners[:, 0], corners[:, 1], corners[:, 2], point)
+        return int(candidates[np.argmax(inside)]) if inside.any() else -1
+
+    def locate_many(self, points) -> np.ndarray:
+        """
+        Finds the triangles a lot of positions are in at once
+        :param points: An (n, 2) array of (x, y), or a list of positions, in the mesh's units
+        :return: An (n,) array of triangle indexes, -1 for the positions that aren't in any
+        """
+        if not isinstance(points, np.ndarray):
+            points = [(point.x, point.y) for point in points]
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        result = np.full(len(points), -1, dtype=np.int64)
+        buckets = self._buckets(points)
+        queried = np.flatnonzero(buckets >= 0)
+        if len(queried) == 0:
+            return result
+
+        # every (point, candidate triangle) pair, tested in one go
+        starts = self.bucket_offsets[buckets[queried]].astype(np.int64)
+        counts = self.bucket_offsets[buckets[queried] + 1] - starts
+        pair_points = np.repeat(queried, counts)
+        pair_candidates = self.bucket_triangles[
+            np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+        corners = self.point_array[self.triangle_array[pair_candidates]]
+        inside = _triangle_contains(corners[:, 0], corners[:, 1], corners[:, 2], points[pair_points])
+        # written in reverse so that, like locate, the first containing candidate is the one kept
+        result[pair_points[inside][::-1]] = pair_candidates[inside][::-1]
+        return result
+
+    def nearest_triangle(self, position: Position) -> tuple[int, Position]:
+        """
+        Finds the triangle closest to a position, for positions that aren't on the mesh
+        :param position: The position, in the mesh's units
+        :return: The index of the triangle and the closest position on it
+        """
+        triangles = self.point_array[self.triangle_array]
+        point = np.array([position.x, position.y])
+        # the closest point on each edge, then the closest of those per triangle
+        starts = triangles
+        ends = np.roll(triangles, -1, axis=1)
+        edges = ends - starts
+        lengths = np.maximum((edges ** 2).sum(axis=2), 1e-12)
+        t = np.clip(((point - starts) * edges).sum(axis=2) / lengths, 0, 1)
+        closest = starts + edges * t[..., None]
+        distances = ((closest - point) ** 2).sum(axis=2)
+        triangle, edge = np.unravel_index(int(np.argmin(distances)), distances.shape)
+        x, y = closest[triangle, edge]
+        return int(triangle), Position(float(x), float(y))
+
+    def find_path(self, start: Position, goal: Position) -> list[Position] | None:
+        """
+        Finds a short path over the mesh: A* over the triangles, then the funnel algorithm pulls the corridor of
+        triangles tight into the shortest line through it. Positions off the mesh (in a margin, or in the sliver the
+        simplified boundary cuts off) are joined to the closest point of the mesh.
+        :param start: Where to start, in the mesh's units
+        :param goal: Where to go, in the mesh's units
+        :return: The corners of the path from start to goal (both included), or None if there is no path
+        """
+        path = self._find_path(start, goal)
+        if instrumentation.enabled:
+            instrumentation.add_time("planner.TriangleNavMesh.locate", self.locate_time)
+            instrumentation.add_time("planner.TriangleNavMesh.search", self.search_time)
+            instrumentation.add_time("planner.TriangleNavMesh.funnel", self.funnel_time)
+            instrumentation.count("planner.TriangleNavMesh.triangles_expanded", self.triangles_expanded)
+        return path
+
+    def _find_path(self, start: Position, goal: Position) -> list[Position] | None:
+        self.triangles_expanded = 0
+        self.search_time = self.funnel_time = 0.0
+        start_time = time()
+        if len(self.triangle_array) == 0:
+            self.locate_time = time() - start_time
+            return None
+        endpoints = []
+        for position in (start, goal):
+            triangle = self.locate(position)
+            on_mesh = position
+            if triangle == -1:
+                triangle, on_mesh = self.nearest_triangle(position)
+            endpoints.append((triangle, on_mesh))
+        (start_triangle, mesh_start), (goal_triangle, mesh_goal) = endpoints
+        self.locate_time = time() - start_time
+
+        start_time = time()
+        corridor = self._search(start_triangle, goal_triangle, mesh_start, mesh_goal)
+        self.search_time = time() - start_time
+        if corridor is None:
+            return None
+
+        start_time = time()
+        path = self._string_pull(corridor, mesh_start, mesh_goal)
+        if mesh_start is not start:
+            path.insert(0, start)
+        if mesh_goal is not goal:
+            path.append(goal)
+        self.funnel_time = time() - start_time
+        return path
+
+    def _search(self, start: int, goal: int, start_position: Position, goal_position: Position) -> list[int] | None:
+        """
+        A* from triangle to triangle. A triangle is reached at the point of the edge it was entered through that's
+        closest to where the previous triangle was reached, and the cost is the length of the line through those
+        points. That's close to the length of the pulled path, even through long thin triangles
+        """
+        offsets = memoryview(self.adjacency_offsets)
+        adjacency = memoryview(self.adjacency)
+        if self._portal_list is None:
+            self._portal_list = self.portals.tolist()
+        portals = self._portal_list
+        goal_x, goal_y = goal_position.x, goal_position.y
+
+        g = {start: 0.0}
+        entries = {start: (start_position.x, start_position.y)}
+        parents = {start: -1}
+        closed = set()
+        open_heap = [(0.0, start)]
+        while open_heap:
+            _, current = heappop(open_heap)
+            if current in closed:
+                continue
+            closed.add(current)
+            self.triangles_expanded += 1
+            if current == goal:
+                corridor = []
+                while current != -1:
+                    corridor.append(current)
+                    current = parents[current]
+                return corridor[::-1]
+            current_g = g[current]
+            entry_x, entry_y = entries[current]
+            for i in range(offsets[current], offsets[current + 1]):
+                neighbour = adjacency[i]
+                (ax, ay), (bx, by) = portals[i]
+                dx, dy = bx - ax, by - ay
+                t = min(1.0, max(0.0, ((entry_x - ax) * dx + (entry_y - ay) * dy) / (dx * dx + dy * dy or 1.0)))
+                x, y = ax + dx * t, ay + dy * t
+                new_g = current_g + math.hypot(x - entry_x, y - entry_y)
+                if neighbour not in closed and new_g < g.get(neighbour, float("inf")):
+                    g[neighbour] = new_g
+                    entries[neighbour] = (x, y)
+                    parents[neighbour] = current
+                    heappush(open_heap, (new_g + math.hypot(x - goal_x, y - goal_y), neighbour))
+        return None
+
+    def _portals(self, corridor: list[int]) -> list[tuple[tuple[float, float], tuple[float, float]]]:
+        """The (left, right) ends of every edge the corridor crosses, left and right as seen going through it"""
+        points = self.point_array
+        portals = []
+        for current, following in zip(corridor, corridor[1:]):
+            a, b, c = (int(i) for i in self.triangle_array[current])
+            if _cross(points[a], points[b], points[c]) < 0:
+                a, b, c = a, c, b  # counterclockwise (in x/y terms), so the inside is to the left of every edge
+            shared = set(int(i) for i in self.triangle_array[following])
+            for u, v in ((a, b), (b, c), (c, a)):
+                if u in shared and v in shared:
+                    # leaving through u -> v, v is on the left
+                    portals.append((tuple(points[v]), tuple(points[u])))
+                    break
+        return portals
+
+    def _string_pull(self, corridor: list[int], start: Position, goal: Position) -> list[Position]:
+        """The simple stupid funnel algorithm: the shortest path from start to goal through the corridor"""
+        start_point, goal_point = (start.x, start.y), (goal.x, goal.y)
+        portals = [(start_point, start_point)] + self._portals(corridor) + [(goal_point, goal_point)]
+        path = [start_point]
+        apex = left = right = start_point
+        apex_index = left_index = right_index = 0
+        i = 1
+        while i < len(portals):
+            new_left, new_right = portals[i]
+            # narrow the funnel from the right
+            if _cross(apex, right, new_right) >= 0:
+                if apex == right or _cross(apex, left, new_right) < 0:
+                    right, right_index = new_right, i
+                else:
+                    # the right side crossed the left one, so the left corner is on the path
+                    path.append(left)
+                    apex = right = left
+                    apex_index = right_index = left_index
+                    i = apex_index + 1
+                    continue
+            # narrow the funnel from the left
+            if _cross(apex, left, new_left) <= 0:
+                if apex == left or _cross(apex, right, new_left) > 0:
+                    left, left_index = new_left, i
+                else:
+                    path.append(right)
+                    apex = left = right
+                    apex_index = left_index = right_index
+                    i = apex_index + 1
+                    continue
+            i += 1
+        if path[-1] != goal_point:
+            path.append(goal_point)
+        return [start] + [Position(float(x), float(y)) for x, y in path[1:-1]] + [goal]
+
+
+def convert_text_to_binary(source: str, destination: str, pixels_per_foot: float = 1) -> TriangleNavMesh:
+    """
+    Converts a .trinavmesh text mesh to the binary format
+    :param source: The .trinavmesh file
+    :param destination: The .navbin file to write
+    :param pixels_per_foot: The scale of the mesh, the text format doesn't store it
+    :return: The converted mesh
+    """
+    mesh = TriangleNavMesh(pixels_per_foot)
+    mesh.load_graph(source)
+    mesh.save_binary(destination)
+    return mesh
 
 
 if __name__ == "__main__":
@@ -0,0 +1,236 @@
+import time
+from heapq import heapify, heappush, heappop
+
+from Pathfinding.GridAStar import GridAStar, octile_distance, SQRT_2
+from Utils.Instrumentation import instrumentation
+
+
+class AnytimeSearch:
+    """
+    One resumable ARA* (anytime repairing A*) query over the grid of a GridAStar.
+
+    step runs the search for a limited number of expansions or seconds and returns, keeping its open set and costs,
+    so a long query can be spread over several frames. The first pass uses a heuristic inflated by `inflation`, which
+    finds a path quickly whose cost is at most inflation times the shortest. Every later pass lowers the inflation by
+    inflation_step and repairs the previous pass's search instead of starting over, until a pass at final_inflation
+    (1 is the shortest path) is done.
+
+    best_path is the best path found so far, None until the first pass is done. partial_path also has something to
+    show before that: the path to the expanded cell closest to the goal.
+
+    The search only reads the planner's grid, so many searches can share one planner (GridAStar's own search
+    arrays aren't used). Same move rules as GridAStar.
+    """
+
+    def __init__(self, planner: GridAStar, start: tuple[int, int], goal: tuple[int, int], inflation: float = 3.0,
+                 final_inflation: float = 1.0, inflation_step: float = 0.5):
+        """
+        :param planner: The planner whose grid to search
+        :param start: The (x, y) cell to start from. It's allowed to be blocked (the robot may be inside a margin)
+        :param goal: The (x, y) cell to go to
+        :param inflation: How much the heuristic is inflated on the first pass
+        :param final_inflation: The inflation of the last pass, at least 1
+        :param inflation_step: How much the inflation drops after each pass
+        """
+        if final_inflation < 1:
+            raise ValueError("final_inflation must be at least 1, below that the paths aren't bounded")
+        if inflation < final_inflation or inflation_step <= 0:
+            raise ValueError("inflation must be at least final_inflation, and inflation_step positive")
+        self.planner = planner
+        self.start = start
+        self.goal = goal
+        self.inflation = inflation
+        self.final_inflation = final_inflation
+        self.inflation_step = inflation_step
+
+        # the results so far
+        self.best_path: list[tuple[int, int]] | None = None
+        self.best_cost = float("inf")
+        self.complete = False  # if best_path reaches the goal
+        self.done = False  # if there is nothing left to improve
+        # the inflation best_path was found with, its cost is at most this times the shortest
+        self.bound = float("inf")
+        # counters over every step so far
+        self.nodes_expanded = 0
+        self.passes = 0
+        self.search_time = 0.0
+
+        self._goal_xy = (goal[0] + 1, goal[1] + 1)
+        self._goal_cell = planner.cell_id(*goal)
+        self._g: dict[int, float] = {}
+        self._parent: dict[int, int] = {}
+        self._closed: set[int] = set()
+        # cells whose cost went down after they were closed this pass, they're reopened on the next pass
+        self._inconsistent: set[int] = set()
+        self._open: list[tuple[float, float, int]] = []
+        # the expanded cell closest to the goal, for the partial path
+        self._closest: tuple[float, int] | None = None
+
+        if not (planner.in_bounds(*start) and planner.in_bounds(*goal)) or planner.is_blocked(*goal):
+            self.done = True
+            return
+        start_cell = planner.cell_id(*start)
+        self._g[start_cell] = 0.0
+        self._parent[start_cell] = -1
+        h = self._heuristic(start_cell)
+        self._open.append((self.inflation * h, h, start_cell))
+
+    def _heuristic(self, cell: int) -> float:
+        x, y = divmod(cell, self.planner._stride)
+        return octile_distance(x - self._goal_xy[0], y - self._goal_xy[1])
+
+    def step(self, max_expansions: int = None, max_seconds: float = None) -> bool:
+        """
+        Runs the search until it's done or a budget runs out
+        :param max_expansions: The most cells to expand. If none, no limit
+        :param max_seconds: The most time to spend. If none, no limit
+        :return: If the search is done
+        """
+        if self.done:
+            return True
+        start_time = time.perf_counter()
+        deadline = None if max_seconds is None else start_time + max_seconds
+        expanded_before = self.nodes_expanded
+        try:
+            while not self.done:
+                budget = None if max_expansions is None else max_expansions - (self.nodes_expanded - expanded_before)
+                if budget is not None and budget <= 0:
+                    break
+                # the clock is checked every few expansions, reading it every time costs more than expanding
+                if self._improve_path(64 if budget is None else min(64, budget)):
+                    self._finish_pass()
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.search_time += elapsed
+            if instrumentation.enabled:
+                instrumentation.add_time("planner.AnytimeSearch.step", elapsed)
+                instrumentation.count("planner.AnytimeSearch.nodes_expanded", self.nodes_expanded - expanded_before)
+        return self.done
+
+    def run(self) -> list[tuple[int, int]] | None:
+        """
+        Runs the search to the end
+        :return: The shortest path (with final_inflation 1), or None if there is no path
+        """
+        self.step()
+        return self.best_path if self.complete else None
+
+    def _improve_path(self, max_expansions: int) -> bool:
+        """
+        Expands up to max_expansions cells of the current pass
+        :return: If the pass is over, no open cell can improve on the goal's cost
+        """
+        planner = self.planner
+        blocked = planner._blocked
+        stride = planner._stride
+        orthogonal_offsets = planner._orthogonal_offsets
+        diagonal_offsets = planner._diagonal_offsets
+        g, parent, closed, open_heap = self._g, self._parent, self._closed, self._open
+        inconsistent = self._inconsistent
+        inflation = self.inflation
+        goal_x, goal_y = self._goal_xy
+        goal_cell = self._goal_cell
+        inf = float("inf")
+        free = [False] * 4
+
+        expanded = 0
+        while open_heap:
+            f, h, current = open_heap[0]
+            if current in closed or f > g[current] + inflation * h + 1e-9:
+                heappop(open_heap)  # stale heap entry
+                continue
+            if g.get(goal_cell, inf) <= f:
+                break
+            if expanded >= max_expansions:
+                self.nodes_expanded += expanded
+                return False
+            heappop(open_heap)
+            closed.add(current)
+            expanded += 1
+            if self._closest is None or h < self._closest[0]:
+                self._closest = (h, current)
+
+            current_g = g[current]
+            for i in range(4):
+                neighbour = current + orthogonal_offsets[i]
+                free[i] = not blocked[neighbour]
+                if free[i]:
+                    new_g = current_g + 1.0
+                    if new_g < g.get(neighbour, inf):
+                        g[neighbour] = new_g
+                        parent[neighbour] = current
+                        if neighbour in closed:
+                            inconsistent.add(neighbour)
+                        else:
+                            nx, ny = divmod(neighbour, stride)
+                            nh = octile_distance(nx - goal_x, ny - goal_y)
+                            heappush(open_heap, (new_g + inflation * nh, nh, neighbour))
+
+            for offset, a, b in diagonal_offsets:
+                if not (free[a] and free[b]):
+                    continue
+                neighbour = current + offset
+                if blocked[neighbour]:
+                    continue
+                new_g = current_g + SQRT_2
+                if new_g < g.get(neighbour, inf):
+                    g[neighbour] = new_g
+                    parent[neighbour] = current
+                    if neighbour in closed:
+                        inconsistent.add(neighbour)
+                    else:
+                        nx, ny = divmod(neighbour, stride)
+                        nh = octile_distance(nx - goal_x, ny - goal_y)
+                        heappush(open_heap, (new_g + inflation * nh, nh, neighbour))
+        self.nodes_expanded += expanded
+        return True
+
+    def _finish_pass(self) -> None:
+        """Keeps the path of the pass that just ended, then starts the next pass with less inflation (or stops)"""
+        self.passes += 1
+        goal_cost = self._g.get(self._goal_cell)
+        if goal_cost is None:
+            # the open set ran out without reaching the goal, so there is no path at any inflation
+            self.done = True
+            return
+        if goal_cost < self.best_cost or not self.complete:
+            self.best_cost = goal_cost
+            self.best_path = self._reconstruct(self._goal_cell)
+            self.complete = True
+        self.bound = self.inflation
+        if self.inflation <= self.final_inflation:
+            self.done = True
+            return
+
+        # ARA*: the next pass continues from this one, with the inconsistent cells put back in the open set
+        self.inflation = max(self.final_inflation, self.inflation - self.inflation_step)
+        g, inflation = self._g, self.inflation
+        cells = {cell for _, _, cell in self._open if cell not in self._closed} | self._inconsistent
+        self._open = []
+        for cell in cells:
+            h = self._heuristic(cell)
+            self._open.append((g[cell] + inflation * h, h, cell))
+        heapify(self._open)
+        self._closed = set()
+        self._inconsistent = set()
+
+    def _reconstruct(self, cell: int) -> list[tuple[int, int]]:
+        path = []
+        parent = self._parent
+        while cell != -1:
+            path.append(self.planner.cell_position(cell))
+            cell = parent[cell]
+        return path[::-1]
+
+    def partial_path(self) -> list[tuple[int, int]] | None:
+        """
+        :return: best_path if there is one, otherwise the path to the expanded cell closest to the goal (None if
+        nothing was expanded yet)
+        """
+        if self.complete:
+            return self.best_path
+        if self._closest is None:
+            return None
+        return self._reconstruct(self._closest[1])
@@ -0,0 +1,275 @@
+import time
+from heapq import heappush, heappop
+from typing import Iterable
+
+import numpy as np
+
+from Pathfinding.GridAStar import GridAStar, octile_distance, SQRT_2
+from Utils.Instrumentation import instrumentation
+
+INF = float("inf")
+# keys are sums of float distances added up in different orders, so equal keys can differ in the last bits. they're
+# rounded to this many decimals so that they compare (and sort in the heap) as equal
+KEY_DECIMALS = 9
+
+
+class DStarLite(GridAStar):
+    """
+    D* Lite (optimized version) over the same grid and move rules as GridAStar.
+
+    The search runs backwards from the goal, so its costs (g) are distances to the goal and stay valid while the
+    start moves along the path. When cells of the grid change (update_cells, or update_grid with a whole new grid),
+    only the cells whose distance to the goal actually changes are searched again, instead of the whole grid. A
+    replan after a small edit costs a fraction of a new search.
+
+    The planner keeps the search for one goal: find_path with the same goal as last time reuses it, a different goal
+    starts a new search. Unlike the other grid planners it changes as it's used, so it shouldn't be shared between
+    robots heading to different goals.
+    nodes_expanded counts the cells expanded by the last find_path (a new search or a repair).
+    """
+
+    def __init__(self, grid: np.ndarray):
+        super().__init__(grid)
+        interior = np.zeros((self.width + 2, self.height + 2), dtype=np.uint8)
+        interior[1:-1, 1:-1] = 1
+        self._interior = memoryview(interior.ravel())
+        self._free = [False] * 4
+        self.start: tuple[int, int] | None = None
+        self.goal: tuple[int, int] | None = None
+        self.cells_changed = 0
+        self._reset()
+
+    def search_copy(self) -> "DStarLite":
+        """
+        D* Lite isn't shareable: it changes its grid and keeps its search between queries, so a copy would share
+        state that the original goes on changing. Make another DStarLite from the grid instead
+        :return: Never returns
+        """
+        raise TypeError("DStarLite isn't shareable, it changes its grid and keeps its search between queries")
+
+    def _reset(self) -> None:
+        self._g: dict[int, float] = {}
+        self._rhs: dict[int, float] = {}
+        # cell -> its key in the heap. heap entries that don't match are stale
+        self._queued: dict[int, tuple[float, float]] = {}
+        self._heap: list[tuple[float, float, int]] = []
+        self._km = 0.0
+        self._set_start(-1)
+        self._last_start_cell = -1
+        self._goal_cell = -1
+
+    def _heuristic(self, a: int, b: int) -> float:
+        ax, ay = divmod(a, self._stride)
+        bx, by = divmod(b, self._stride)
+        return octile_distance(ax - bx, ay - by)
+
+    def _key(self, cell: int) -> tuple[float, float]:
+        best = min(self._g.get(cell, INF), self._rhs.get(cell, INF))
+        x, y = divmod(cell, self._stride)
+        dx = abs(x - self._start_x)
+        dy = abs(y - self._start_y)
+        h = dx * SQRT_2 + (dy - dx) if dx < dy else dy * SQRT_2 + (dx - dy)
+        return round(best + h + self._km, KEY_DECIMALS), round(best, KEY_DECIMALS)
+
+    def _set_start(self, cell: int) -> None:
+        self._start_cell = cell
+        self._start_x, self._start_y = divmod(cell, self._stride)
+
+    def _queue(self, cell: int) -> None:
+        """Puts a cell in the heap if it's inconsistent (its g isn't its rhs), takes it out otherwise"""
+        self._queued.pop(cell, None)
+        if self._g.get(cell, INF) != self._rhs.get(cell, INF):
+            key = self._key(cell)
+            self._queued[cell] = key
+            heappush(self._heap, (key[0], key[1], cell))
+
+    def _moves(self, cell: int) -> list[tuple[int, float]]:
+        """The (neighbour, cost) moves out of a cell: into free cells only, and diagonals without cutting corners"""
+        blocked = self._blocked
+        moves = []
+        free = []
+        for offset in self._orthogonal_offsets:
+            neighbour = cell + offset
+            free.append(not blocked[neighbour])
+            if free[-1]:
+                moves.append((neighbour, 1.0))
+        for offset, a, b in self._diagonal_offsets:
+            neighbour = cell + offset
+            if free[a] and free[b] and not blocked[neighbour]:
+                moves.append((neighbour, SQRT_2))
+        return moves
+
+    def _neighbours(self, cell: int) -> list[int]:
+        """Every cell a move could go between with this one, blocked or not"""
+        return [cell + offset for offset in self._orthogonal_offsets] + \
+            [cell + offset for offset, _, _ in self._diagonal_offsets]
+
+    def _update_cell(self, cell: int) -> None:
+        """Recomputes the rhs (one step lookahead cost to the goal) of a cell and puts it in the heap if inconsistent"""
+        if not self._interior[cell]:
+            return  # the blocked border
+        if cell != self._goal_cell:
+            best = INF
+            blocked = self._blocked
+            # nothing can move into a blocked cell, so its cost only matters if the start is in it
+            if not blocked[cell] or cell == self._start_cell:
+                g = self._g
+                free = self._free
+                for i, offset in enumerate(self._orthogonal_offsets):
+                    neighbour = cell + offset
+                    free[i] = not blocked[neighbour]
+                    if free[i]:
+                        total = 1.0 + g.get(neighbour, INF)
+                        if total < best:
+                            best = total
+                for offset, a, b in self._diagonal_offsets:
+                    neighbour = cell + offset
+                    if free[a] and free[b] and not blocked[neighbour]:
+                        total = SQRT_2 + g.get(neighbour, INF)
+                        if total < best:
+                            best = total
+            self._rhs[cell] = best
+        self._queue(cell)
+
+    def _compute_shortest_path(self) -> int:
+        """Expands cells until the start is consistent, returns how many were expanded"""
+        g, rhs, queued, heap = self._g, self._rhs, self._queued, self._heap
+        start, goal = self._start_cell, self._goal_cell
+        blocked, interior, incoming = self._blocked, self._interior, self._incoming_moves
+        expanded = 0
+        while heap:
+            k1, k2, cell = heap[0]
+            if queued.get(cell) != (k1, k2):
+                heappop(heap)  # stale heap entry
+                continue
+            start_key = self._key(start)
+            if (k1, k2) >= start_key and rhs.get(start, INF) == g.get(start, INF):
+                break
+            new_key = self._key(cell)
+            if (k1, k2) < new_key:
+                # the start moved since it was queued, so its key went up
+                heappop(heap)
+                queued[cell] = new_key
+                heappush(heap, (new_key[0], new_key[1], cell))
+                continue
+            heappop(heap)
+            del queued[cell]
+            expanded += 1
+            if g.get(cell, INF) > rhs[cell]:
+                cell_g = g[cell] = rhs[cell]
+                # the cost went down, so it can only lower the rhs of the cells that can move into this one
+                if not blocked[cell]:
+                    for offset, cost, side_a, side_b in incoming:
+                        neighbour = cell + offset
+                        if blocked[cell + side_a] or blocked[cell + side_b] or not interior[neighbour] or \
+                                neighbour == goal or (blocked[neighbour] and neighbour != start):
+                            continue
+                        total = cell_g + cost
+                        if total < rhs.get(neighbour, INF):
+                            rhs[neighbour] = total
+                            self._queue(neighbour)
+            else:
+                g[cell] = INF
+                self._update_cell(cell)
+                for neighbour in self._neighbours(cell):
+                    self._update_cell(neighbour)
+        return expanded
+
+    def find_path(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        """
+        Finds the shortest path between two cells, repairing the last search if the goal is the same.
+        The start cell itself is allowed to be blocked (the robot may be sitting inside a margin), the goal is not.
+        :param start: The (x, y) cell to start from
+        :param goal: The (x, y) cell to go to
+        :return: The list of (x, y) cells from start to goal (both included), or None if there is no path
+        """
+        start_time = time.perf_counter()
+        self.nodes_expanded = 0
+        try:
+            if not (self.in_bounds(*start) and self.in_bounds(*goal)) or self.is_blocked(*goal):
+                return None
+            if goal != self.goal:
+                self._reset()
+                self.goal = goal
+                self._goal_cell = self.cell_id(*goal)
+                self._set_start(self.cell_id(*start))
+                self._last_start_cell = self._start_cell
+                self._rhs[self._goal_cell] = 0.0
+                key = self._key(self._goal_cell)
+                self._queued[self._goal_cell] = key
+                heappush(self._heap, (key[0], key[1], self._goal_cell))
+            elif start != self.start:
+                # the heap keys were computed with the heuristic from the old start. instead of recomputing all of
+                # them, every new key is raised by how far the start moved (km), which keeps the order right
+                self._set_start(self.cell_id(*start))
+                self._km += self._heuristic(self._last_start_cell, self._start_cell)
+                self._last_start_cell = self._start_cell
+                if self._blocked[self._start_cell]:
+                    self._update_cell(self._start_cell)  # blocked cells only get a cost once the start is in them
+            self.start = start
+            self.nodes_expanded = self._compute_shortest_path()
+            return self._extract_path()
+        finally:
+            self.search_time = time.perf_counter() - start_time
+            if instrumentation.enabled:
+                instrumentation.add_time("planner.DStarLite", self.search_time)
+                instrumentation.count("planner.DStarLite.nodes_expanded", self.nodes_expanded)
+
+    def _extract_path(self) -> list[tuple[int, int]] | None:
+        """Follows the cheapest moves from the start down to the goal"""
+        g = self._g
+        cell = self._start_cell
+        if g.get(cell, INF) == INF:
+            return None
+        path = [self.cell_position(cell)]
+        while cell != self._goal_cell:
+            best, best_cost = -1, INF
+            for neighbour, cost in self._moves(cell):
+                total = cost + g.get(neighbour, INF)
+                if total < best_cost:
+                    best, best_cost = neighbour, total
+            if best == -1 or len(path) > self.width * self.height:
+                return None
+            cell = best
+            path.append(self.cell_position(cell))
+        return path
+
+    def update_cells(self, changes: Iterable[tuple[tuple[int, int], bool]]) -> int:
+        """
+        Changes cells of the grid. The next find_path repairs the search around them
+        :param changes: ((x, y), blocked) pairs
+        :return: How many cells actually changed
+        """
+        changed = []
+        for (x, y), is_blocked in changes:
+            if not self.in_bounds(x, y):
+                raise ValueError(f"Cell {(x, y)} is outside the {self.width}x{self.height} grid")
+            cell = self.cell_id(x, y)
+            if bool(self._blocked[cell]) != bool(is_blocked):
+                self._blocked[cell] = 1 if is_blocked else 0
+                changed.append(cell)
+        if self.goal is not None:
+            # a cell's blocked state changes the cost of moving into it, and of the diagonals past its corners. both
+            # are moves out of its neighbours
+            touched = set()
+            for cell in changed:
+                touched.update(self._neighbours(cell))
+                touched.add(cell)
+            for cell in touched:
+                self._update_cell(cell)
+        self.cells_changed = len(changed)
+        if instrumentation.enabled:
+            instrumentation.count("planner.DStarLite.cells_changed", self.cells_changed)
+        return self.cells_changed
+
+    def update_grid(self, grid: np.ndarray) -> int:
+        """
+        Changes the grid to a new one of the same size, see update_cells
+        :param grid: A (width, height) boolean array, True where the cell is blocked
+        :return: How many cells changed
+        """
+        if grid.shape != (self.width, self.height):
+            raise ValueError(f"The grid is {grid.shape[0]}x{grid.shape[1]}, the planner's is {self.width}x{self.height}")
+        current = self.blocked.reshape(self.width + 2, self.height + 2)[1:-1, 1:-1].astype(bool)
+        xs, ys = np.nonzero(current != grid)
+        return self.update_cells(((x, y), bool(grid[x, y])) for x, y in zip(xs.tolist(), ys.tolist()))
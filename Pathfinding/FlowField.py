@@ -0,0 +1,145 @@
+import time
+from heapq import heappush, heappop
+
+import numpy as np
+
+from Pathfinding.GridAStar import GridAStar, SQRT_2
+from Utils.Instrumentation import instrumentation
+
+# (dx, dy) of each step direction, indexed by FlowField.directions
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+class FlowField:
+    """
+    The cost to go to one goal from every cell of a grid, and which way to step from each cell to get there.
+
+    It's built with one Dijkstra sweep outwards from the goal over the grid of a GridAStar (same move rules), after
+    that a path from any start is found by following the steps down to the goal, in time proportional to the length
+    of the path. Worth it when many starts (several robots, or one robot replanning) share a goal.
+    """
+
+    def __init__(self, planner: GridAStar, goal: tuple[int, int]):
+        """
+        :param planner: The planner whose grid to use, only its grid is read
+        :param goal: The (x, y) cell to go to
+        """
+        start_time = time.perf_counter()
+        self.planner = planner
+        self.goal = goal
+        width, height = planner.width, planner.height
+        stride = planner._stride
+        cell_count = (width + 2) * stride
+        costs = np.full(cell_count, np.inf)
+        # the cell to step to from each cell, -1 where there is none (the goal, and cells that can't reach it)
+        steps = np.full(cell_count, -1, dtype=np.int64)
+        self.cells_reached = 0
+
+        if planner.in_bounds(*goal) and not planner.is_blocked(*goal):
+            self.cells_reached = self._sweep(planner.cell_id(*goal), costs, steps)
+
+        # the public arrays are (width, height) like the grid
+        self.costs: np.ndarray = costs.reshape(width + 2, stride)[1:-1, 1:-1]
+        step_cells = steps.reshape(width + 2, stride)[1:-1, 1:-1]
+        has_step = step_cells >= 0
+        offsets = step_cells - np.arange(cell_count).reshape(width + 2, stride)[1:-1, 1:-1]
+        # the index in DIRECTIONS of the step from each cell, -1 where there is none
+        self.directions = np.full((width, height), -1, dtype=np.int8)
+        for i, (dx, dy) in enumerate(DIRECTIONS):
+            self.directions[has_step & (offsets == dx * stride + dy)] = i
+        self._steps = memoryview(steps)
+        self.build_time = time.perf_counter() - start_time
+        if instrumentation.enabled:
+            instrumentation.add_time("planner.FlowField.build", self.build_time)
+            instrumentation.count("planner.FlowField.cells_reached", self.cells_reached)
+
+    def _sweep(self, goal_cell: int, costs: np.ndarray, steps: np.ndarray) -> int:
+        """Dijkstra from the goal, following the moves backwards. Returns how many cells were reached"""
+        planner = self.planner
+        blocked = planner._blocked
+        incoming = planner._incoming_moves
+        cost, step = memoryview(costs), memoryview(steps)
+        done = bytearray(len(costs))
+
+        cost[goal_cell] = 0.0
+        heap = [(0.0, goal_cell)]
+        reached = 0
+        while heap:
+            current_cost, current = heappop(heap)
+            if done[current]:
+                continue
+            done[current] = 1
+            reached += 1
+            for offset, move_cost, side_a, side_b in incoming:
+                neighbour = current + offset
+                # the move from neighbour into current, only free cells continue the sweep. blocked cells next to
+                # free ones are left out too, a start in them is joined in find_path
+                if blocked[neighbour] or blocked[current + side_a] or blocked[current + side_b] or done[neighbour]:
+                    continue
+                new_cost = current_cost + move_cost
+                if new_cost < cost[neighbour]:
+                    cost[neighbour] = new_cost
+                    step[neighbour] = current
+                    heappush(heap, (new_cost, neighbour))
+        return reached
+
+    def cost(self, start: tuple[int, int]) -> float:
+        """
+        :param start: The (x, y) cell to start from
+        :return: The cost of the shortest path from start to the goal, inf if there is none
+        """
+        if not self.planner.in_bounds(*start):
+            return float("inf")
+        if self.planner.is_blocked(*start):
+            entry = self._entry(self.planner.cell_id(*start))
+            return entry[1] if entry is not None else float("inf")
+        return float(self.costs[start])
+
+    def _entry(self, cell: int) -> tuple[int, float] | None:
+        """The best free cell to step into from a blocked cell, with the cost of going to the goal through it"""
+        planner = self.planner
+        blocked = planner._blocked
+        costs = self.costs
+        stride = planner._stride
+        best = None
+        free = [False] * 4
+        moves = [(offset, 1.0, i, i) for i, offset in enumerate(planner._orthogonal_offsets)] + \
+            [(offset, SQRT_2, a, b) for offset, a, b in planner._diagonal_offsets]
+        for offset, move_cost, a, b in moves:
+            neighbour = cell + offset
+            if move_cost == 1.0:
+                free[a] = not blocked[neighbour]
+            if blocked[neighbour] or not (free[a] and free[b]):
+                continue
+            x, y = divmod(neighbour, stride)
+            total = move_cost + costs[x - 1, y - 1]
+            if total < float("inf") and (best is None or total < best[1]):
+                best = (neighbour, float(total))
+        return best
+
+    def find_path(self, start: tuple[int, int]) -> list[tuple[int, int]] | None:
+        """
+        Follows the field from a start to the goal.
+        The start cell itself is allowed to be blocked (the robot may be sitting inside a margin), the goal is not.
+        :param start: The (x, y) cell to start from
+        :return: The list of (x, y) cells from start to goal (both included), or None if there is no path
+        """
+        planner = self.planner
+        if not planner.in_bounds(*start) or self.cells_reached == 0:
+            return None
+        cell = planner.cell_id(*start)
+        path = [start]
+        if planner.is_blocked(*start):
+            entry = self._entry(cell)
+            if entry is None:
+                return None
+            cell = entry[0]
+            path.append(planner.cell_position(cell))
+        elif self.costs[start] == np.inf:
+            return None
+        steps = self._steps
+        goal_cell = planner.cell_id(*self.goal)
+        while cell != goal_cell:
+            cell = steps[cell]
+            path.append(planner.cell_position(cell))
+        return path
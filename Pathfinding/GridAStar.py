@@ -0,0 +1,229 @@
+import copy
+import time
+from heapq import heappush, heappop
+from math import sqrt
+
+import numpy as np
+
+from Utils.Instrumentation import instrumentation
+
+SQRT_2 = sqrt(2)
+
+
+def octile_distance(dx: float, dy: float) -> float:
+    """
+    The exact cost of the cheapest 8-connected move sequence between two cells on an empty grid.
+    This is the admissible (and consistent) heuristic for grids where straight steps cost 1 and diagonal steps cost
+    sqrt(2)
+    :param dx: The x distance in cells
+    :param dy: The y distance in cells
+    :return: The octile distance
+    """
+    dx = abs(dx)
+    dy = abs(dy)
+    if dx < dy:
+        return dx * SQRT_2 + (dy - dx)
+    return dy * SQRT_2 + (dx - dy)
+
+
+class GridAStar:
+    """
+    A* over an 8-connected occupancy grid.
+
+    All per-cell state lives in flat NumPy arrays indexed by cell id, and the open set is a binary heap. The grid is
+    padded with a blocked border, so generating neighbours never needs a bounds check. Instead of clearing the cost
+    arrays before every search, each search gets a new generation number and a cell's cost is only trusted if its
+    stamp matches the current generation.
+
+    Straight steps cost 1 and diagonal steps cost sqrt(2). A diagonal step is only allowed when both of the orthogonal
+    cells next to it are free, so paths never clip the corner of an obstacle.
+
+    It still expands every cell closer to the goal than the path, so its time grows with the number of cells: it's a
+    few milliseconds on a coarse grid (1/8 of the map's pixels), but hundreds at full pixel resolution. For fine grids
+    use JumpPointSearch (same paths) or HierarchicalPlanner, which stay in milliseconds at full resolution.
+    """
+
+    def __init__(self, grid: np.ndarray):
+        """
+        :param grid: A (width, height) boolean array, True where the cell is blocked (see Utils.Occupancy.mask_to_grid)
+        """
+        self.width, self.height = grid.shape
+        self._stride = self.height + 2
+
+        padded = np.ones((self.width + 2, self.height + 2), dtype=np.uint8)
+        padded[1:-1, 1:-1] = grid
+
+        # the arrays are kept around for inspection, the memoryviews are what the search loop uses because indexing
+        # them returns plain python numbers, which is a lot faster than indexing a numpy array one element at a time
+        self.blocked = padded.ravel()
+        self._blocked = memoryview(self.blocked)
+        self._make_search_arrays()
+
+        s = self._stride
+        # (offset, cost) pairs. the orthogonal moves come first so the diagonals can check them
+        self._orthogonal_offsets = (-1, 1, -s, s)
+        # (offset, first orthogonal index, second orthogonal index)
+        self._diagonal_offsets = ((-s - 1, 0, 2), (-s + 1, 1, 2), (s - 1, 0, 3), (s + 1, 1, 3))
+        # the same moves seen from the cell they go into, for searches that run backwards from the goal:
+        # (offset from the cell to where the move comes from, cost, the offsets from the cell of the two cells a
+        # diagonal move passes between). straight moves don't pass anything, they check the cell itself twice
+        o = self._orthogonal_offsets
+        self._incoming_moves = tuple((-offset, 1.0, 0, 0) for offset in o) + \
+            tuple((-offset, SQRT_2, -o[a], -o[b]) for offset, a, b in self._diagonal_offsets)
+
+        # counters from the last search
+        self.nodes_expanded = 0
+        self.search_time = 0.0
+
+    def _make_search_arrays(self) -> None:
+        """The arrays one search writes to, everything else only depends on the grid"""
+        cell_count = len(self.blocked)
+        self.g_costs = np.zeros(cell_count, dtype=np.float64)
+        self.parents = np.full(cell_count, -1, dtype=np.int64)
+        self._seen_generation = np.zeros(cell_count, dtype=np.uint32)
+        self._closed_generation = np.zeros(cell_count, dtype=np.uint32)
+        self._g = memoryview(self.g_costs)
+        self._parent = memoryview(self.parents)
+        self._seen = memoryview(self._seen_generation)
+        self._closed = memoryview(self._closed_generation)
+        self._generation = 0
+
+    def search_copy(self) -> "GridAStar":
+        """
+        Makes a planner that shares this one's grid and everything precomputed from it (JPS jump distances...), but
+        has its own search arrays, so the two can search at the same time on different threads. Neither may change
+        the grid afterwards
+        :return: The planner, of the same class
+        """
+        planner = copy.copy(self)
+        planner._make_search_arrays()
+        return planner
+
+    def cell_id(self, x: int, y: int) -> int:
+        """
+        Gets the flat id of a cell
+        :param x: The x index of the cell
+        :param y: The y index of the cell
+        :return: The id of the cell
+        """
+        return (x + 1) * self._stride + (y + 1)
+
+    def cell_position(self, cell: int) -> tuple[int, int]:
+        """
+        Gets the x, y index of a cell from its flat id
+        :param cell: The id of the cell
+        :return: (x, y)
+        """
+        x, y = divmod(cell, self._stride)
+        return x - 1, y - 1
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_blocked(self, x: int, y: int) -> bool:
+        """
+        Checks if a cell is blocked. Cells outside the grid count as blocked
+        """
+        if not self.in_bounds(x, y):
+            return True
+        return bool(self._blocked[self.cell_id(x, y)])
+
+    def _next_generation(self) -> int:
+        self._generation += 1
+        if self._generation >= np.iinfo(np.uint32).max:
+            self._seen_generation.fill(0)
+            self._closed_generation.fill(0)
+            self._generation = 1
+        return self._generation
+
+    def _reconstruct(self, cell: int) -> list[tuple[int, int]]:
+        path = []
+        parent = self._parent
+        while cell != -1:
+            path.append(self.cell_position(cell))
+            cell = parent[cell]
+        return path[::-1]
+
+    def find_path(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        """
+        Finds the shortest path between two cells.
+        The start cell itself is allowed to be blocked (the robot may be sitting inside a margin), the goal is not.
+        :param start: The (x, y) cell to start from
+        :param goal: The (x, y) cell to go to
+        :return: The list of (x, y) cells from start to goal (both included), or None if there is no path
+        """
+        start_time = time.perf_counter()
+        self.nodes_expanded = 0
+        try:
+            if not (self.in_bounds(*start) and self.in_bounds(*goal)) or self.is_blocked(*goal):
+                return None
+            return self._search(start, goal)
+        finally:
+            self.search_time = time.perf_counter() - start_time
+            if instrumentation.enabled:
+                name = type(self).__name__
+                instrumentation.add_time(f"planner.{name}", self.search_time)
+                instrumentation.count(f"planner.{name}.nodes_expanded", self.nodes_expanded)
+
+    def _search(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        generation = self._next_generation()
+        blocked, g, parent, seen, closed = self._blocked, self._g, self._parent, self._seen, self._closed
+        stride = self._stride
+        orthogonal_offsets = self._orthogonal_offsets
+        diagonal_offsets = self._diagonal_offsets
+
+        goal_x, goal_y = goal[0] + 1, goal[1] + 1
+        start_cell = self.cell_id(*start)
+        goal_cell = self.cell_id(*goal)
+
+        g[start_cell] = 0.0
+        parent[start_cell] = -1
+        seen[start_cell] = generation
+        start_h = octile_distance(start[0] + 1 - goal_x, start[1] + 1 - goal_y)
+        # (f, h, cell). ties on f go to the cell closest to the goal
+        open_heap = [(start_h, start_h, start_cell)]
+        expanded = 0
+        free = [False] * 4
+
+        while open_heap:
+            _, _, current = heappop(open_heap)
+            if closed[current] == generation:
+                continue  # stale heap entry
+            closed[current] = generation
+            expanded += 1
+
+            if current == goal_cell:
+                self.nodes_expanded = expanded
+                return self._reconstruct(current)
+
+            current_g = g[current]
+            for i in range(4):
+                neighbour = current + orthogonal_offsets[i]
+                free[i] = not blocked[neighbour]
+                if free[i] and closed[neighbour] != generation:
+                    new_g = current_g + 1.0
+                    if seen[neighbour] != generation or new_g < g[neighbour]:
+                        seen[neighbour] = generation
+                        g[neighbour] = new_g
+                        parent[neighbour] = current
+                        nx, ny = divmod(neighbour, stride)
+                        h = octile_distance(nx - goal_x, ny - goal_y)
+                        heappush(open_heap, (new_g + h, h, neighbour))
+
+            for offset, a, b in diagonal_offsets:
+                if not (free[a] and free[b]):
+                    continue
+                neighbour = current + offset
+                if blocked[neighbour] or closed[neighbour] == generation:
+                    continue
+                new_g = current_g + SQRT_2
+                if seen[neighbour] != generation or new_g < g[neighbour]:
+                    seen[neighbour] = generation
+                    g[neighbour] = new_g
+                    parent[neighbour] = current
+                    nx, ny = divmod(neighbour, stride)
+                    h = octile_distance(nx - goal_x, ny - goal_y)
+                    heappush(open_heap, (new_g + h, h, neighbour))
+
+        self.nodes_expanded = expanded
+        return None
@@ -0,0 +1,350 @@
+import copy
+import time
+from heapq import heappush, heappop
+from math import ceil, inf
+
+import numpy as np
+
+from Pathfinding.GridAStar import SQRT_2, octile_distance
+from Utils.Instrumentation import instrumentation
+
+# (dx, dy, cost) of every move, same rules as GridAStar
+_MOVES = ((1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+          (1, 1, SQRT_2), (1, -1, SQRT_2), (-1, 1, SQRT_2), (-1, -1, SQRT_2))
+# an entrance shorter than this gets one transition in its middle, a longer one gets one at each end
+_LONG_ENTRANCE = 6
+
+
+def _move_slices(size: int, d: int) -> tuple[slice, slice]:
+    """(target slice, source slice) along one axis of a size x size tile, for a move of d"""
+    return slice(max(d, 0), size + min(d, 0)), slice(max(-d, 0), size - max(d, 0))
+
+
+def cluster_distances(blocked: np.ndarray, sources: np.ndarray) -> np.ndarray:
+    """
+    Computes the shortest distance from every source to every cell of its cluster, moving only inside the cluster.
+    All the clusters and sources are relaxed together with array operations until nothing improves.
+    :param blocked: An (n, size, size) bool array, the blocked cells of each cluster
+    :param sources: An (n, k, 2) int array, the local (x, y) of up to k sources per cluster (-1 for unused slots)
+    :return: An (n, k, size, size) float64 array of distances (inf where unreachable)
+    """
+    cluster_count, size, _ = blocked.shape
+    source_count = sources.shape[1]
+    distances = np.full((cluster_count, source_count, size, size), inf)
+    clusters, slots = np.nonzero(sources[:, :, 0] >= 0)
+    distances[clusters, slots, sources[clusters, slots, 0], sources[clusters, slots, 1]] = 0
+
+    free = ~blocked
+    moves = []
+    for dx, dy, cost in _MOVES:
+        target_x, source_x = _move_slices(size, dx)
+        target_y, source_y = _move_slices(size, dy)
+        allowed = free[:, target_x, target_y].copy()
+        if dx and dy:
+            # no corner cutting: the two cells beside the diagonal have to be free too
+            allowed &= free[:, source_x, target_y] & free[:, target_x, source_y]
+        moves.append((target_x, target_y, source_x, source_y, cost, ~allowed[:, None]))
+
+    changed = True
+    while changed:
+        changed = False
+        for target_x, target_y, source_x, source_y, cost, not_allowed in moves:
+            candidates = distances[:, :, source_x, source_y] + cost
+            candidates[np.broadcast_to(not_allowed, candidates.shape)] = inf
+            targets = distances[:, :, target_x, target_y]
+            better = candidates < targets
+            if better.any():
+                targets[better] = candidates[better]
+                changed = True
+    return distances
+
+
+class HierarchicalPlanner:
+    """
+    Hierarchical pathfinding (HPA*) over the same grid and move rules as GridAStar.
+
+    The grid is split into square clusters. Wherever two neighbouring clusters share a run of free cells along their
+    border, transition nodes are placed on both sides, and the distances between all the nodes of a cluster (moving
+    only inside it) are precomputed. A query connects the start and goal to the nodes of their clusters, runs A* over
+    this small abstract graph, and then refines each abstract edge into cells by walking down the precomputed
+    distances, so only the clusters along the path are ever touched at cell level.
+
+    The precomputation only depends on the grid, so one planner can be shared by every robot on the field. Paths are
+    near optimal: they can only cross cluster borders at transition nodes.
+    """
+
+    def __init__(self, grid: np.ndarray, cluster_size: int = 16):
+        """
+        :param grid: A (width, height) boolean array, True where the cell is blocked
+        :param cluster_size: The width and height of a cluster in cells
+        """
+        start_time = time.perf_counter()
+        self.width, self.height = grid.shape
+        self.cluster_size = cluster_size
+        self.clusters_x = ceil(self.width / cluster_size)
+        self.clusters_y = ceil(self.height / cluster_size)
+
+        # the grid is padded with blocked cells up to a whole number of clusters
+        self.blocked = np.ones((self.clusters_x * cluster_size, self.clusters_y * cluster_size), dtype=bool)
+        self.blocked[:self.width, :self.height] = grid
+        # (cluster x, cluster y, local x, local y) -> blocked
+        self.cluster_blocked = self.blocked.reshape(self.clusters_x, cluster_size, self.clusters_y, cluster_size) \
+            .transpose(0, 2, 1, 3)
+
+        # abstract graph
+        self.node_cells: list[tuple[int, int]] = []
+        self.node_ids: dict[tuple[int, int], int] = {}
+        self.edges: list[list[tuple[int, float]]] = []
+        self.cluster_nodes: dict[tuple[int, int], list[int]] = {}
+        self._find_entrances()
+        self._connect_clusters()
+
+        self.build_time = time.perf_counter() - start_time
+        # counters from the last search
+        self.nodes_expanded = 0
+        self.search_time = 0.0
+
+    def search_copy(self) -> "HierarchicalPlanner":
+        """
+        Makes a planner that shares this one's abstract graph, for searching on another thread. A search only keeps
+        its state in local variables, so the copy just has its own counters
+        :return: The planner
+        """
+        return copy.copy(self)
+
+    def cluster_of(self, x: int, y: int) -> tuple[int, int]:
+        return x // self.cluster_size, y // self.cluster_size
+
+    def _add_node(self, cell: tuple[int, int]) -> int:
+        if cell not in self.node_ids:
+            self.node_ids[cell] = len(self.node_cells)
+            self.node_cells.append(cell)
+            self.edges.append([])
+            self.cluster_nodes.setdefault(self.cluster_of(*cell), []).append(self.node_ids[cell])
+        return self.node_ids[cell]
+
+    def _add_transition(self, a: tuple[int, int], b: tuple[int, int]) -> None:
+        a_id = self._add_node(a)
+        b_id = self._add_node(b)
+        self.edges[a_id].append((b_id, 1.0))
+        self.edges[b_id].append((a_id, 1.0))
+
+    def _find_entrances(self) -> None:
+        size = self.cluster_size
+        blocked = self.blocked
+        # borders between clusters side by side (constant x), then between clusters above each other (constant y)
+        for vertical_border in (True, False):
+            border_count = self.clusters_x if vertical_border else self.clusters_y
+            length = blocked.shape[1] if vertical_border else blocked.shape[0]
+            for border in range(1, border_count):
+                line = border * size
+                if vertical_border:
+                    open_cells = ~blocked[line - 1, :] & ~blocked[line, :]
+                else:
+                    open_cells = ~blocked[:, line - 1] & ~blocked[:, line]
+                # runs of open cells, split at cluster corners
+                run_start = None
+                for i in range(length + 1):
+                    is_open = i < length and open_cells[i] and not (run_start is not None and i % size == 0)
+                    if is_open and run_start is None:
+                        run_start = i
+                    elif not is_open and run_start is not None:
+                        run_end = i - 1
+                        if run_end - run_start + 1 < _LONG_ENTRANCE:
+                            positions = ((run_start + run_end) // 2,)
+                        else:
+                            positions = (run_start, run_end)
+                        for position in positions:
+                            if vertical_border:
+                                self._add_transition((line - 1, position), (line, position))
+                            else:
+                                self._add_transition((position, line - 1), (position, line))
+                        run_start = i if (i < length and open_cells[i]) else None
+
+    def _connect_clusters(self) -> None:
+        size = self.cluster_size
+        clusters = list(self.cluster_nodes)
+        self._cluster_index = {cluster: i for i, cluster in enumerate(clusters)}
+        max_nodes = max((len(nodes) for nodes in self.cluster_nodes.values()), default=0)
+        sources = np.full((len(clusters), max_nodes, 2), -1, dtype=np.int64)
+        for i, cluster in enumerate(clusters):
+            for slot, node in enumerate(self.cluster_nodes[cluster]):
+                x, y = self.node_cells[node]
+                sources[i, slot] = (x - cluster[0] * size, y - cluster[1] * size)
+
+        cluster_xs = np.array([cluster[0] for cluster in clusters], dtype=np.intp)
+        cluster_ys = np.array([cluster[1] for cluster in clusters], dtype=np.intp)
+        tiles = self.cluster_blocked[cluster_xs, cluster_ys]
+        # (cluster index, slot) -> distances from that node to every cell of its cluster
+        self.node_distances = cluster_distances(tiles, sources)
+        self._node_slot = {}
+        for i, cluster in enumerate(clusters):
+            nodes = self.cluster_nodes[cluster]
+            for slot, node in enumerate(nodes):
+                self._node_slot[node] = slot
+                for other in nodes:
+                    if other == node:
+                        continue
+                    x, y = self.node_cells[other]
+                    cost = self.node_distances[i, slot, x - cluster[0] * size, y - cluster[1] * size]
+                    if cost < inf:
+                        self.edges[node].append((other, float(cost)))
+
+    def _local_distances(self, cell: tuple[int, int]) -> np.ndarray:
+        """Distances from a cell to every cell of its cluster"""
+        cluster = self.cluster_of(*cell)
+        size = self.cluster_size
+        source = np.array([[[cell[0] - cluster[0] * size, cell[1] - cluster[1] * size]]])
+        return cluster_distances(self.cluster_blocked[cluster][None], source)[0, 0]
+
+    def _descend(self, distances: np.ndarray, cluster: tuple[int, int], cell: tuple[int, int]) \
+            -> list[tuple[int, int]]:
+        """Walks down a distance field from cell to its source, returns the cells from cell to the source"""
+        size = self.cluster_size
+        tile = self.cluster_blocked[cluster]
+        origin_x, origin_y = cluster[0] * size, cluster[1] * size
+        x, y = cell[0] - origin_x, cell[1] - origin_y
+        path = [cell]
+        while distances[x, y] > 0:
+            best = None
+            for dx, dy, cost in _MOVES:
+                px, py = x + dx, y + dy
+                if not (0 <= px < size and 0 <= py < size):
+                    continue
+                if dx and dy and (tile[px, y] or tile[x, py]):
+                    continue
+                if abs(distances[px, py] + cost - distances[x, y]) < 1e-6:
+                    if best is None or distances[px, py] < distances[best]:
+                        best = (px, py)
+            x, y = best
+            path.append((x + origin_x, y + origin_y))
+        return path
+
+    def find_path(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        """
+        Finds a path between two cells. Same interface as GridAStar.find_path
+        :param start: The (x, y) cell to start from
+        :param goal: The (x, y) cell to go to
+        :return: The list of (x, y) cells from start to goal (both included), or None if there is no path
+        """
+        start_time = time.perf_counter()
+        self.nodes_expanded = 0
+        try:
+            in_bounds = all(0 <= x < self.width and 0 <= y < self.height for x, y in (start, goal))
+            if not in_bounds or self.blocked[goal]:
+                return None
+            return self._search(start, goal)
+        finally:
+            self.search_time = time.perf_counter() - start_time
+            if instrumentation.enabled:
+                instrumentation.add_time("planner.HierarchicalPlanner", self.search_time)
+                instrumentation.count("planner.HierarchicalPlanner.nodes_expanded", self.nodes_expanded)
+
+    def _entries(self, start: tuple[int, int]) -> list[tuple[tuple[int, int], float]]:
+        """
+        The cells a search can leave the start from, with the cost of getting there.
+        That's the start itself, unless it's blocked (a robot inside a margin): then it's the free cells one move
+        away, which may be in a neighbouring cluster
+        """
+        x, y = start
+        if not self.blocked[start]:
+            return [(start, 0.0)]
+        entries = []
+        for dx, dy, cost in _MOVES:
+            cell = (x + dx, y + dy)
+            if not (0 <= cell[0] < self.width and 0 <= cell[1] < self.height) or self.blocked[cell]:
+                continue
+            if dx and dy and (self.blocked[x + dx, y] or self.blocked[x, y + dy]):
+                continue
+            entries.append((cell, cost))
+        return entries
+
+    def _search(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        size = self.cluster_size
+        goal_cluster = self.cluster_of(*goal)
+        goal_distances = self._local_distances(goal)
+
+        def local_cost(distances: np.ndarray, cluster: tuple[int, int], cell: tuple[int, int]) -> float:
+            return float(distances[cell[0] - cluster[0] * size, cell[1] - cluster[1] * size])
+
+        # the abstract graph plus two temporary nodes: start is -1, goal is -2.
+        # start edges go through the cheapest entry cell, which is kept for refining the path later
+        entries = [(cell, cost, self._local_distances(cell)) for cell, cost in self._entries(start)]
+        start_edges: dict[int, tuple[float, int]] = {}
+        for entry, (cell, step_cost, distances) in enumerate(entries):
+            cluster = self.cluster_of(*cell)
+            targets = list(self.cluster_nodes.get(cluster, []))
+            if cluster == goal_cluster:
+                targets.append(-2)
+            for node in targets:
+                cost = step_cost + local_cost(distances, cluster, goal if node == -2 else self.node_cells[node])
+                if cost < start_edges.get(node, (inf,))[0]:
+                    start_edges[node] = (cost, entry)
+        goal_costs = {node: local_cost(goal_distances, goal_cluster, self.node_cells[node])
+                      for node in self.cluster_nodes.get(goal_cluster, [])}
+
+        def cell_of(node: int) -> tuple[int, int]:
+            return start if node == -1 else goal if node == -2 else self.node_cells[node]
+
+        g = {-1: 0.0}
+        parents = {-1: None}
+        closed = set()
+        open_heap = [(octile_distance(start[0] - goal[0], start[1] - goal[1]), -1)]
+        expanded = 0
+        while open_heap:
+            _, current = heappop(open_heap)
+            if current in closed:
+                continue
+            closed.add(current)
+            expanded += 1
+            if current == -2:
+                break
+            if current == -1:
+                neighbours = [(node, cost) for node, (cost, _) in start_edges.items()]
+            else:
+                neighbours = self.edges[current]
+                if current in goal_costs:
+                    neighbours = neighbours + [(-2, goal_costs[current])]
+            for neighbour, cost in neighbours:
+                if cost == inf or neighbour in closed:
+                    continue
+                new_g = g[current] + cost
+                if new_g < g.get(neighbour, inf):
+                    g[neighbour] = new_g
+                    parents[neighbour] = current
+                    x, y = cell_of(neighbour)
+                    heappush(open_heap, (new_g + octile_distance(x - goal[0], y - goal[1]), neighbour))
+        self.nodes_expanded = expanded
+        if -2 not in closed:
+            return None
+
+        abstract_path = [-2]
+        while parents[abstract_path[-1]] is not None:
+            abstract_path.append(parents[abstract_path[-1]])
+        abstract_path.reverse()
+        entry_cell, _, entry_distances = entries[start_edges[abstract_path[1]][1]]
+        return self._refine(abstract_path, start, goal, entry_cell, entry_distances, goal_distances)
+
+    def _refine(self, abstract_path: list[int], start: tuple[int, int], goal: tuple[int, int],
+                entry_cell: tuple[int, int], entry_distances: np.ndarray,
+                goal_distances: np.ndarray) -> list[tuple[int, int]]:
+        """Turns a path over the abstract graph back into cells"""
+        path = [start]
+        if entry_cell != start:
+            path.append(entry_cell)
+        for a, b in zip(abstract_path, abstract_path[1:]):
+            if a == -1:
+                cell_b = goal if b == -2 else self.node_cells[b]
+                segment = self._descend(entry_distances, self.cluster_of(*entry_cell), cell_b)[::-1]
+            elif b == -2:
+                segment = self._descend(goal_distances, self.cluster_of(*goal), self.node_cells[a])
+            else:
+                cell_a, cell_b = self.node_cells[a], self.node_cells[b]
+                cluster = self.cluster_of(*cell_a)
+                if cluster != self.cluster_of(*cell_b):
+                    segment = [cell_a, cell_b]  # a transition between clusters
+                else:
+                    distances = self.node_distances[self._cluster_index[cluster], self._node_slot[a]]
+                    segment = self._descend(distances, cluster, cell_b)[::-1]
+            path.extend(segment[1:])
+        return path
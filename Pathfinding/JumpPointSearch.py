@@ -0,0 +1,223 @@
+from heapq import heappush, heappop
+
+import numpy as np
+
+from Pathfinding.GridAStar import GridAStar, octile_distance
+from Utils.Instrumentation import instrumentation
+
+
+def _sign(x: int) -> int:
+    return (x > 0) - (x < 0)
+
+
+class JumpPointSearch(GridAStar):
+    """
+    Jump Point Search over the same grid and move rules as GridAStar, so it finds paths of the same cost.
+
+    On a uniform cost grid most of the cells A* expands are symmetric: there are many equally short ways to reach
+    them. JPS only keeps one of them by scanning in straight and diagonal lines from each node and stopping
+    ("jumping") only at cells where a shorter path could turn, so it expands far fewer nodes than A*.
+    nodes_expanded counts expanded jump points, cells_scanned counts every cell looked at while jumping.
+
+    Like JPS+, the straight scans are precomputed once per grid: for every cell and straight direction, how far it
+    is to the next wall or forced neighbour. A straight scan is then a lookup, and only diagonal scans step cell by
+    cell.
+
+    This is the variant that doesn't cut corners: a diagonal step needs both orthogonal cells next to it to be free.
+    """
+
+    def __init__(self, grid):
+        super().__init__(grid)
+        self.cells_scanned = 0
+
+        blocked = self.blocked.reshape(self.width + 2, self.height + 2).astype(bool)
+        # (dx, dy) -> how many steps from each cell to the first cell (itself included) that is blocked or has a
+        # forced neighbour when moving in that direction
+        self.jump_distances: dict[tuple[int, int], np.ndarray] = {}
+        self._jump_distances = {}
+        for direction in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            distances = self._straight_jump_distances(blocked, *direction).ravel()
+            self.jump_distances[direction] = distances
+            self._jump_distances[direction] = memoryview(distances)
+
+    @staticmethod
+    def _straight_jump_distances(blocked: np.ndarray, dx: int, dy: int) -> np.ndarray:
+        def shifted(sx: int, sy: int) -> np.ndarray:
+            # shifted(sx, sy)[x, y] == blocked[x + sx, y + sy], with everything outside the grid blocked
+            result = np.ones_like(blocked)
+            width, height = blocked.shape
+            result[max(0, -sx):width - max(0, sx), max(0, -sy):height - max(0, sy)] = \
+                blocked[max(0, sx):width - max(0, -sx), max(0, sy):height - max(0, -sy)]
+            return result
+
+        side_x, side_y = dy, dx  # perpendicular to the direction
+        forced = ~blocked & (
+                (~shifted(side_x, side_y) & shifted(side_x - dx, side_y - dy)) |
+                (~shifted(-side_x, -side_y) & shifted(-side_x - dx, -side_y - dy)))
+        stops = blocked | forced
+
+        axis = 0 if dx else 1
+        step = dx or dy
+        shape = [1, 1]
+        shape[axis] = blocked.shape[axis]
+        index = np.arange(blocked.shape[axis]).reshape(shape)
+        index = np.broadcast_to(index, blocked.shape)
+        if step > 0:
+            # the padded border is blocked, so every cell has a stop ahead of it
+            following = np.where(stops, index, blocked.shape[axis])
+            following = np.flip(np.minimum.accumulate(np.flip(following, axis), axis=axis), axis)
+            return (following - index).astype(np.int32)
+        previous = np.maximum.accumulate(np.where(stops, index, -1), axis=axis)
+        return (index - previous).astype(np.int32)
+
+    def find_path(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        self.cells_scanned = 0
+        path = super().find_path(start, goal)
+        if instrumentation.enabled:
+            instrumentation.count("planner.JumpPointSearch.cells_scanned", self.cells_scanned)
+        return path
+
+    def _jump_straight(self, cell: int, dx: int, dy: int, goal_cell: int) -> int:
+        """Scans from cell in a straight line, returns the first jump point or -1 if it runs into a wall"""
+        distance = self._jump_distances[(dx, dy)][cell]
+        self.cells_scanned += distance + 1
+        step = dx * self._stride + dy
+        stop = cell + distance * step
+
+        # the goal is a jump point too, but it isn't part of the precomputed distances
+        if dx:
+            offset = goal_cell - cell
+            steps_to_goal = offset // step if offset % self._stride == 0 else -1  # same row
+        else:
+            steps_to_goal = (goal_cell - cell) * dy if goal_cell // self._stride == cell // self._stride else -1
+        if 0 <= steps_to_goal <= distance:
+            return goal_cell
+        return -1 if self._blocked[stop] else stop
+
+    def _jump(self, cell: int, dx: int, dy: int, goal_cell: int) -> int:
+        """Scans from cell in the direction (dx, dy), returns the first jump point or -1 if it runs into a wall"""
+        if not (dx and dy):
+            return self._jump_straight(cell, dx, dy, goal_cell)
+
+        blocked = self._blocked
+        horizontal = dx * self._stride
+        while True:
+            self.cells_scanned += 1
+            if blocked[cell]:
+                return -1
+            if cell == goal_cell:
+                return cell
+            # a diagonal node is a jump point if either of the straight scans from it finds one
+            if self._jump_straight(cell + horizontal, dx, 0, goal_cell) != -1 or \
+                    self._jump_straight(cell + dy, 0, dy, goal_cell) != -1:
+                return cell
+            if blocked[cell + horizontal] or blocked[cell + dy]:
+                return -1
+            cell += horizontal + dy
+
+    def _directions(self, cell: int, parent: int) -> list[tuple[int, int]]:
+        """The directions worth searching from cell, given the jump point it was reached from"""
+        blocked = self._blocked
+        stride = self._stride
+        directions = []
+        if parent == -1:
+            free = {(dx, dy): not blocked[cell + dx * stride + dy] for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))}
+            for (dx, dy), is_free in free.items():
+                if is_free:
+                    directions.append((dx, dy))
+            for dx in (-1, 1):
+                for dy in (-1, 1):
+                    if free[(dx, 0)] and free[(0, dy)]:
+                        directions.append((dx, dy))
+            return directions
+
+        x, y = divmod(cell, stride)
+        parent_x, parent_y = divmod(parent, stride)
+        dx = _sign(x - parent_x)
+        dy = _sign(y - parent_y)
+        if dx and dy:
+            vertical_free = not blocked[cell + dy]
+            horizontal_free = not blocked[cell + dx * stride]
+            if vertical_free:
+                directions.append((0, dy))
+            if horizontal_free:
+                directions.append((dx, 0))
+            if vertical_free and horizontal_free:
+                directions.append((dx, dy))
+        elif dx:
+            next_free = not blocked[cell + dx * stride]
+            for side in (-1, 1):
+                if not blocked[cell + side]:
+                    directions.append((0, side))
+                    if next_free:
+                        directions.append((dx, side))
+            if next_free:
+                directions.append((dx, 0))
+        else:
+            next_free = not blocked[cell + dy]
+            for side in (-1, 1):
+                if not blocked[cell + side * stride]:
+                    directions.append((side, 0))
+                    if next_free:
+                        directions.append((side, dy))
+            if next_free:
+                directions.append((0, dy))
+        return directions
+
+    def _reconstruct(self, cell: int) -> list[tuple[int, int]]:
+        # fills in the straight or diagonal runs between jump points, so the path has every cell like GridAStar's
+        jump_points = super()._reconstruct(cell)
+        path = [jump_points[0]]
+        for x, y in jump_points[1:]:
+            last_x, last_y = path[-1]
+            dx, dy = _sign(x - last_x), _sign(y - last_y)
+            for _ in range(max(abs(x - last_x), abs(y - last_y))):
+                last_x += dx
+                last_y += dy
+                path.append((last_x, last_y))
+        return path
+
+    def _search(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        generation = self._next_generation()
+        g, parent, seen, closed = self._g, self._parent, self._seen, self._closed
+        stride = self._stride
+
+        goal_x, goal_y = goal[0] + 1, goal[1] + 1
+        start_cell = self.cell_id(*start)
+        goal_cell = self.cell_id(*goal)
+
+        g[start_cell] = 0.0
+        parent[start_cell] = -1
+        seen[start_cell] = generation
+        start_h = octile_distance(start[0] + 1 - goal_x, start[1] + 1 - goal_y)
+        open_heap = [(start_h, start_h, start_cell)]
+        expanded = 0
+
+        while open_heap:
+            _, _, current = heappop(open_heap)
+            if closed[current] == generation:
+                continue
+            closed[current] = generation
+            expanded += 1
+
+            if current == goal_cell:
+                self.nodes_expanded = expanded
+                return self._reconstruct(current)
+
+            current_g = g[current]
+            current_x, current_y = divmod(current, stride)
+            for dx, dy in self._directions(current, parent[current]):
+                jump_point = self._jump(current + dx * stride + dy, dx, dy, goal_cell)
+                if jump_point == -1 or closed[jump_point] == generation:
+                    continue
+                x, y = divmod(jump_point, stride)
+                new_g = current_g + octile_distance(x - current_x, y - current_y)
+                if seen[jump_point] != generation or new_g < g[jump_point]:
+                    seen[jump_point] = generation
+                    g[jump_point] = new_g
+                    parent[jump_point] = current
+                    h = octile_distance(x - goal_x, y - goal_y)
+                    heappush(open_heap, (new_g + h, h, jump_point))
+
+        self.nodes_expanded = expanded
+        return None
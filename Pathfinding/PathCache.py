@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from typing import Hashable
+
+from Utils.Instrumentation import instrumentation
+
+
+class PathCache:
+    """
+    A bounded least recently used cache of planned paths.
+
+    Keys are whatever identifies a query, BasicPathfindBot uses (start cell, goal cell, resolution, planner, field
+    margin version). Because the margin version changes every time Field.set_margin_mask switches masks, paths planned
+    against an old mask can never be returned; they just fall out of the cache as new paths are added.
+    Paths are stored as tuples, so callers can't change what's in the cache by editing the path they got back.
+    """
+
+    def __init__(self, max_size: int = 256):
+        """
+        :param max_size: How many paths to keep before evicting the least recently used one
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self._paths: OrderedDict[Hashable, tuple | None] = OrderedDict()
+
+        # statistics since the cache was made (or since reset_stats)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._paths
+
+    def get(self, key: Hashable, default=None):
+        """
+        Looks up a path, counting it as a hit or a miss
+        :param key: The query key
+        :param default: What to return on a miss
+        :return: The cached path (a tuple, or None if the query had no path), or default
+        """
+        if key in self._paths:
+            self._paths.move_to_end(key)
+            self.hits += 1
+            instrumentation.count("path_cache.hits")
+            return self._paths[key]
+        self.misses += 1
+        instrumentation.count("path_cache.misses")
+        return default
+
+    def put(self, key: Hashable, path) -> None:
+        """
+        Stores a path, evicting the least recently used one if the cache is full
+        :param key: The query key
+        :param path: The path, or None to remember that there is no path
+        """
+        self._paths[key] = tuple(path) if path is not None else None
+        self._paths.move_to_end(key)
+        if len(self._paths) > self.max_size:
+            self._paths.popitem(last=False)
+            self.evictions += 1
+            instrumentation.count("path_cache.evictions")
+
+    def clear(self) -> None:
+        """Forgets every path. The statistics are kept"""
+        self._paths.clear()
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """
+        :return: The hit, miss and eviction counts, the hit rate and how full the cache is
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "hit_rate": self.hit_rate,
+                "size": len(self._paths), "max_size": self.max_size}
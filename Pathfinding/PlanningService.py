@@ -0,0 +1,174 @@
+"""
+Plans paths in the background, so a slow search doesn't hold up the frame that asked for it.
+
+Requests go to a thread pool (or a process pool) and come back as concurrent.futures.Future objects. The planners keep
+per-search state in their arrays, so one planner can't search on two workers at once. What they precompute from the
+grid (the HPA* cluster graph, the JPS jump distances) is read only though: it's built once per process (or passed in
+by the caller) and every worker thread searches its own search_copy of it, keeping the last few copies it made (keyed
+by the grid they were built from) for the next requests.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Hashable
+
+import numpy as np
+
+from Pathfinding.GridAStar import GridAStar
+from Pathfinding.HierarchicalPlanner import HierarchicalPlanner
+from Pathfinding.JumpPointSearch import JumpPointSearch
+from Pathfinding.ThetaStar import ThetaStar, LazyThetaStar
+from Utils.Instrumentation import instrumentation
+
+# the planners a worker can build, by name (the same names as BasicPathfindBot.GRID_PLANNERS)
+PLANNERS = {"astar": GridAStar, "jps": JumpPointSearch, "hpa": HierarchicalPlanner, "theta": ThetaStar,
+            "lazy_theta": LazyThetaStar}
+# how many planners each worker keeps, and how many planners the workers of a process share
+WORKER_PLANNER_CACHE_SIZE = 4
+SHARED_PLANNER_CACHE_SIZE = 4
+
+# the planners of the worker running in this thread (in a process pool, each process has its own module state)
+_worker_state = threading.local()
+# the planners every worker thread of this process makes its copies from. (grid key, planner) -> [lock, planner or
+# None until it's built], least recently used first
+_shared_planners: OrderedDict = OrderedDict()
+_shared_planners_lock = threading.Lock()
+
+
+def _shared_planner(planner: str, grid: np.ndarray, grid_key: Hashable) -> GridAStar | HierarchicalPlanner:
+    """The planner for grid_key shared by the workers of this process, built by the first worker that needs it"""
+    key = (grid_key, planner)
+    with _shared_planners_lock:
+        entry = _shared_planners.get(key)
+        if entry is None:
+            entry = _shared_planners[key] = [threading.Lock(), None]
+            if len(_shared_planners) > SHARED_PLANNER_CACHE_SIZE:
+                _shared_planners.popitem(last=False)
+        else:
+            _shared_planners.move_to_end(key)
+    # the other workers that need the same planner wait for it instead of building their own
+    with entry[0]:
+        if entry[1] is None:
+            entry[1] = PLANNERS[planner](grid)
+        return entry[1]
+
+
+def _find_path(planner: str, grid: np.ndarray, grid_key: Hashable, start: tuple[int, int], goal: tuple[int, int],
+               shared: GridAStar | HierarchicalPlanner = None) -> list[tuple[int, int]] | None:
+    """
+    Runs in a worker: finds a path with this worker's planner for grid_key, copying it from the shared one (or from
+    shared, if given) if this worker hasn't yet
+    """
+    planners = getattr(_worker_state, "planners", None)
+    if planners is None:
+        planners = _worker_state.planners = OrderedDict()
+    key = (grid_key, planner)
+    if key in planners:
+        planners.move_to_end(key)
+    else:
+        if shared is None:
+            shared = _shared_planner(planner, grid, grid_key)
+        planners[key] = shared.search_copy()
+        if len(planners) > WORKER_PLANNER_CACHE_SIZE:
+            planners.popitem(last=False)
+    return planners[key].find_path(start, goal)
+
+
+class PlanningService:
+    """
+    A pool of workers that find paths between cells of occupancy grids.
+
+    submit returns a future right away. The caller polls it (future.done()) instead of waiting, and cancels the
+    requests it no longer needs: a request that hasn't started yet is dropped, one that has is left to finish and its
+    result is ignored.
+    """
+
+    def __init__(self, max_workers: int = None, use_processes: bool = False):
+        """
+        :param max_workers: How many searches can run at once. If none, the executor's default
+        :param use_processes: If the searches run in other processes instead of threads. Processes search in parallel
+        (threads share the interpreter lock with the frame loop), but every request has to copy its grid over, and
+        every process builds its own planners. Threads share one planner per grid (see submit)
+        """
+        self.use_processes = use_processes
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor = executor(max_workers=max_workers)
+        self._pending: set[Future] = set()
+        self._lock = threading.Lock()
+
+        # statistics since the service was made
+        self.submitted = 0
+        self.cancelled = 0
+
+    def submit(self, planner: str, grid: np.ndarray, grid_key: Hashable, start: tuple[int, int],
+               goal: tuple[int, int], shared: GridAStar | HierarchicalPlanner = None) -> Future:
+        """
+        Requests a path
+        :param planner: Which of PLANNERS to use
+        :param grid: A (width, height) boolean array, True where the cell is blocked. It must not change afterwards,
+        workers keep planners built from it
+        :param grid_key: Something that identifies the grid, workers reuse their planner for requests with the same key
+        (BasicPathfindBot uses (margin version, resolution))
+        :param start: The (x, y) cell to start from
+        :param goal: The (x, y) cell to go to
+        :param shared: A planner of this kind already built from the grid (BasicPathfindBot passes the one from its
+        cache), for the worker threads to copy instead of building their own. Ignored with processes, it would have to
+        be copied over
+        :return: A future of the list of (x, y) cells from start to goal (both included), or None if there is no path
+        """
+        if planner not in PLANNERS:
+            raise ValueError(f"Unknown planner {planner}, the planning service runs {sorted(PLANNERS)}")
+        if self.use_processes:
+            shared = None
+        future = self._executor.submit(_find_path, planner, grid, grid_key, start, goal, shared)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._finished)
+        self.submitted += 1
+        instrumentation.count("planning_service.submitted")
+        return future
+
+    def _finished(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    @property
+    def pending(self) -> int:
+        """How many requests are queued or running"""
+        with self._lock:
+            return len(self._pending)
+
+    def cancel(self, future: Future) -> bool:
+        """
+        Cancels a request
+        :param future: What submit returned
+        :return: If it was dropped before it started
+        """
+        cancelled = future.cancel()
+        if cancelled:
+            self.cancelled += 1
+            instrumentation.count("planning_service.cancelled")
+        return cancelled
+
+    def cancel_all(self) -> int:
+        """
+        Cancels every request that hasn't started
+        :return: How many were dropped
+        """
+        with self._lock:
+            pending = list(self._pending)
+        return sum(self.cancel(future) for future in pending)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Cancels the requests that haven't started and stops the workers
+        :param wait: If it should wait for the running searches to finish
+        """
+        self.cancel_all()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
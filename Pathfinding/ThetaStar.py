@@ -0,0 +1,177 @@
+from heapq import heappush, heappop
+from math import sqrt
+
+from Pathfinding.GridAStar import GridAStar, SQRT_2
+from Utils.Instrumentation import instrumentation
+
+
+class ThetaStar(GridAStar):
+    """
+    Theta*, an any-angle version of GridAStar.
+
+    It searches the same 8-connected grid, but a cell's parent doesn't have to be a neighbour: whenever the parent of
+    the current cell can see a new cell in a straight line, the new cell is linked straight to it. Costs are euclidean
+    distances, so the result is a short list of cells joined by straight segments that only cross free cells, instead
+    of one cell per step. The paths are usually close to the true shortest path but aren't guaranteed to be.
+
+    Line of sight is checked between cell centers over every cell the segment touches. A segment going exactly
+    through a corner needs both cells beside the corner to be free, the same rule GridAStar uses for diagonal steps.
+    line_of_sight_checks counts the checks done by the last search.
+    """
+
+    # Lazy Theta* assumes there is line of sight when a cell is generated and only checks it once the cell is
+    # expanded, which needs a lot fewer checks
+    lazy = False
+
+    def __init__(self, grid):
+        super().__init__(grid)
+        self.line_of_sight_checks = 0
+
+    def find_path(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        """
+        Finds a short any-angle path between two cells.
+        The start cell itself is allowed to be blocked (the robot may be sitting inside a margin), the goal is not.
+        :param start: The (x, y) cell to start from
+        :param goal: The (x, y) cell to go to
+        :return: The corners of the path from start to goal (both included), each in sight of the next, or None if
+        there is no path
+        """
+        self.line_of_sight_checks = 0
+        path = super().find_path(start, goal)
+        if instrumentation.enabled:
+            instrumentation.count(f"planner.{type(self).__name__}.line_of_sight_checks", self.line_of_sight_checks)
+        return path
+
+    def line_of_sight(self, a: int, b: int) -> bool:
+        """
+        Checks if the straight segment between the centers of two cells only crosses free cells.
+        The first cell isn't checked, so a blocked start can still see out
+        :param a: The id of the cell to look from
+        :param b: The id of the cell to look at
+        :return: True if a can see b
+        """
+        self.line_of_sight_checks += 1
+        blocked = self._blocked
+        stride = self._stride
+        ax, ay = divmod(a, stride)
+        bx, by = divmod(b, stride)
+        dx, dy = abs(bx - ax), abs(by - ay)
+        step_x = stride if bx > ax else -stride
+        step_y = 1 if by > ay else -1
+
+        # walks every cell the segment touches: the next cell is across whichever cell edge the segment reaches
+        # first, compared in integers (edge i is crossed at t = (2i + 1) / 2dx)
+        cell = a
+        i = j = 0
+        while i < dx or j < dy:
+            crossing = (2 * i + 1) * dy - (2 * j + 1) * dx
+            if crossing == 0:
+                # exactly through a corner
+                if blocked[cell + step_x] or blocked[cell + step_y]:
+                    return False
+                cell += step_x + step_y
+                i += 1
+                j += 1
+            elif crossing < 0:
+                cell += step_x
+                i += 1
+            else:
+                cell += step_y
+                j += 1
+            if blocked[cell]:
+                return False
+        return True
+
+    def _distance(self, a: int, b: int) -> float:
+        ax, ay = divmod(a, self._stride)
+        bx, by = divmod(b, self._stride)
+        return sqrt((ax - bx) ** 2 + (ay - by) ** 2)
+
+    def _neighbours(self, cell: int) -> list[tuple[int, float]]:
+        """The (neighbour, step cost) pairs of a cell, with the same rules as GridAStar"""
+        blocked = self._blocked
+        free = [not blocked[cell + offset] for offset in self._orthogonal_offsets]
+        neighbours = [(cell + offset, 1.0) for offset, is_free in zip(self._orthogonal_offsets, free) if is_free]
+        for offset, a, b in self._diagonal_offsets:
+            if free[a] and free[b] and not blocked[cell + offset]:
+                neighbours.append((cell + offset, SQRT_2))
+        return neighbours
+
+    def _search(self, start: tuple[int, int], goal: tuple[int, int]) -> list[tuple[int, int]] | None:
+        generation = self._next_generation()
+        g, parent, seen, closed = self._g, self._parent, self._seen, self._closed
+        stride = self._stride
+        lazy = self.lazy
+
+        goal_x, goal_y = goal[0] + 1, goal[1] + 1
+        start_cell = self.cell_id(*start)
+        goal_cell = self.cell_id(*goal)
+
+        def heuristic(cell: int) -> float:
+            x, y = divmod(cell, stride)
+            return sqrt((x - goal_x) ** 2 + (y - goal_y) ** 2)
+
+        g[start_cell] = 0.0
+        parent[start_cell] = start_cell  # the start is its own parent, so it's always a candidate to see from
+        seen[start_cell] = generation
+        open_heap = [(heuristic(start_cell), heuristic(start_cell), start_cell)]
+        expanded = 0
+
+        while open_heap:
+            f, _, current = heappop(open_heap)
+            if closed[current] == generation:
+                continue
+            if lazy and current != start_cell and not self.line_of_sight(parent[current], current):
+                # the parent guessed when current was generated can't see it: fall back to the best expanded
+                # neighbour, which always exists (current was generated from one)
+                best_g, best_parent = None, -1
+                for neighbour, cost in self._neighbours(current):
+                    if closed[neighbour] == generation and (best_g is None or g[neighbour] + cost < best_g):
+                        best_g, best_parent = g[neighbour] + cost, neighbour
+                g[current] = best_g
+                parent[current] = best_parent
+                h = heuristic(current)
+                if best_g + h > f + 1e-9:
+                    # it got more expensive, so something else may be better to expand first
+                    heappush(open_heap, (best_g + h, h, current))
+                    continue
+            closed[current] = generation
+            expanded += 1
+
+            if current == goal_cell:
+                self.nodes_expanded = expanded
+                return self._reconstruct(current)
+
+            current_parent = parent[current]
+            for neighbour, cost in self._neighbours(current):
+                if closed[neighbour] == generation:
+                    continue
+                # path 2: straight from current's parent, path 1: through current
+                if lazy or self.line_of_sight(current_parent, neighbour):
+                    new_parent = current_parent
+                    new_g = g[current_parent] + self._distance(current_parent, neighbour)
+                else:
+                    new_parent = current
+                    new_g = g[current] + cost
+                if seen[neighbour] != generation or new_g < g[neighbour]:
+                    seen[neighbour] = generation
+                    g[neighbour] = new_g
+                    parent[neighbour] = new_parent
+                    h = heuristic(neighbour)
+                    heappush(open_heap, (new_g + h, h, neighbour))
+
+        self.nodes_expanded = expanded
+        return None
+
+    def _reconstruct(self, cell: int) -> list[tuple[int, int]]:
+        path = [self.cell_position(cell)]
+        parent = self._parent
+        while parent[cell] != cell:
+            cell = parent[cell]
+            path.append(self.cell_position(cell))
+        return path[::-1]
+
+
+class LazyThetaStar(ThetaStar):
+    """Lazy Theta*: the same paths as ThetaStar in most cases, with line of sight only checked on expansion"""
+    lazy = True
@@ -0,0 +1,267 @@
+import time
+from heapq import heappush, heappop
+from math import hypot
+
+import numpy as np
+import pygame
+
+from Utils.Contours import remove_pinches, trace_contours, simplify_contours
+from Utils.Instrumentation import instrumentation
+from Utils.Position import Position
+from Utils.RayCast import ray_cast_many
+
+# how far (in pixels) the nodes are kept from the margin, on top of how far the simplified boundary can be from it.
+# the segments between nodes are sampled at whole pixels, so they need a little room to pass the corners
+CLEARANCE = 1.5
+# a node is never moved further than this many times its clearance from its corner (a very sharp corner would send
+# it far out along the bisector)
+MAX_MITER = 4.0
+
+
+def corners_from_image(image: pygame.Surface, size: tuple[int, int]) -> np.ndarray:
+    """
+    Reads the obstacle corners marked in an image like images/Corners.png: one opaque pixel per corner, on a
+    transparent background, drawn over the map. The paths of a graph built from them are only as short as the marked
+    corners allow, a corner that isn't marked can't be cut
+    :param image: The image
+    :param size: The (width, height) of the field, the corners are scaled from the image to it
+    :return: An (n, 2) array of the (x, y) corners, in pixels of the field
+    """
+    alpha = pygame.surfarray.array_alpha(image)
+    xs, ys = np.nonzero(alpha > 127)
+    scale_x, scale_y = size[0] / image.get_width(), size[1] / image.get_height()
+    # the center of the marked pixel, in the field's pixels
+    return np.stack([(xs + 0.5) * scale_x, (ys + 0.5) * scale_y], axis=1)
+
+
+class VisibilityGraph:
+    """
+    A visibility graph over the corners of the margin: the shortest path around polygonal obstacles only ever bends
+    at their convex corners, so a graph of those corners, linked wherever two of them can see each other, has the
+    shortest any-angle path in it.
+
+    The graph is built once per margin mask. Its nodes are the convex corners of the free space's boundary (traced
+    and simplified like the nav mesh does it), or given obstacle corners (see corners_from_image) pushed out of the
+    margin. Every pair of nodes is checked for line of sight against the margin in one batch of rays. A query only
+    casts rays from its start and goal to the nodes, then runs A* over a graph of a few dozen nodes, which is much
+    cheaper than searching a grid.
+
+    Paths are in pixels, from the start to the goal (both included) with only the corners in between. A start or goal
+    inside the margin is joined to the closest free pixel first. nodes_expanded counts the nodes expanded by the last
+    query, rays_cast the rays it cast.
+    """
+
+    def __init__(self, field, corners: np.ndarray = None, tolerance: float = 2.0):
+        """
+        :param field: The field, its current margin mask is the one planned around
+        :param corners: An (n, 2) array of obstacle corners, in pixels. If none, the corners of the margin are traced
+        :param tolerance: How far (in pixels) the simplified boundaries can be from the real ones, when tracing
+        """
+        start_time = time.perf_counter()
+        self.grid: np.ndarray = field.margin_occupancy
+        self.margin_version = field.margin_version
+        if corners is None:
+            nodes = self._traced_corners(self.grid, tolerance)
+        else:
+            nodes = self._cleared_corners(field, np.asarray(corners, dtype=np.float64).reshape(-1, 2))
+        self.nodes: np.ndarray = nodes
+
+        # every pair of nodes that can see each other is linked. rays are sampled from their start, so one that grazes
+        # the margin can get through one way and not the other: a pair is only linked if it sees both ways
+        node_count = len(nodes)
+        firsts, seconds = np.triu_indices(node_count, k=1)
+        hits, _ = ray_cast_many(np.concatenate([nodes[firsts], nodes[seconds]]),
+                                np.concatenate([nodes[seconds], nodes[firsts]]), self.grid, tolerance=0)
+        hits = hits[:len(firsts)] | hits[len(firsts):]
+        firsts, seconds = firsts[~hits], seconds[~hits]
+        lengths = np.hypot(*(nodes[seconds] - nodes[firsts]).T)
+        # node -> [(neighbour, distance), ...]
+        self.neighbours: list[list[tuple[int, float]]] = [[] for _ in range(node_count)]
+        for a, b, length in zip(firsts.tolist(), seconds.tolist(), lengths.tolist()):
+            self.neighbours[a].append((b, length))
+            self.neighbours[b].append((a, length))
+        self.edge_count = len(lengths)
+
+        self.nodes_expanded = 0
+        self.rays_cast = 0
+        self.search_time = 0.0
+        self.build_time = time.perf_counter() - start_time
+        if instrumentation.enabled:
+            instrumentation.add_time("planner.VisibilityGraph.build", self.build_time)
+
+    @staticmethod
+    def _traced_corners(grid: np.ndarray, tolerance: float) -> np.ndarray:
+        """The convex corners of the obstacles (in the margin), moved out into the free space"""
+        contours = simplify_contours(trace_contours(remove_pinches(grid)), tolerance)
+        clearance = tolerance + CLEARANCE
+        nodes = []
+        for contour in contours:
+            points = contour.astype(np.float64)
+            incoming = points - np.roll(points, 1, axis=0)
+            outgoing = np.roll(points, -1, axis=0) - points
+            incoming /= np.hypot(*incoming.T)[:, None]
+            outgoing /= np.hypot(*outgoing.T)[:, None]
+            # the boundary keeps the free space on the same side, so it turns the same way around every convex
+            # obstacle corner, whether the obstacle is a hole in the free space or the free space is a hole in it
+            convex = incoming[:, 0] * outgoing[:, 1] - incoming[:, 1] * outgoing[:, 0] < 0
+            # out along the bisector, far enough to be clearance away from both edges
+            bisectors = incoming[convex] - outgoing[convex]
+            half_turn_cos = np.hypot(*bisectors.T) / 2
+            offsets = clearance / np.maximum(half_turn_cos, 1 / MAX_MITER)
+            nodes.append(points[convex] + bisectors / np.hypot(*bisectors.T)[:, None] * offsets[:, None])
+        nodes = np.concatenate(nodes) if nodes else np.zeros((0, 2))
+        return nodes[VisibilityGraph._free(grid, nodes)]
+
+    @staticmethod
+    def _cleared_corners(field, corners: np.ndarray) -> np.ndarray:
+        """Obstacle corners, moved away from the obstacle until they're clear of the margin"""
+        occupancy = field.occupancy
+        grid = field.margin_occupancy
+        width, height = occupancy.shape
+        radius = 3
+        nodes = []
+        for x, y in corners.tolist():
+            # away from the obstacle pixels around the corner, which is along the bisector of a convex corner
+            cx, cy = int(x), int(y)
+            window = occupancy[max(cx - radius, 0):cx + radius + 1, max(cy - radius, 0):cy + radius + 1]
+            xs, ys = np.nonzero(window)
+            if len(xs) == 0 or len(xs) == window.size:
+                continue
+            dx = cx - (xs.mean() + max(cx - radius, 0))
+            dy = cy - (ys.mean() + max(cy - radius, 0))
+            length = hypot(dx, dy)
+            if length == 0:
+                continue
+            dx, dy = dx / length, dy / length
+            distance = max(field.margin, 1)
+            while distance < 4 * max(field.margin, 1) + 2:
+                px, py = x + dx * distance, y + dy * distance
+                if 0 <= px < width and 0 <= py < height and not grid[int(px), int(py)]:
+                    nodes.append((x + dx * (distance + CLEARANCE), y + dy * (distance + CLEARANCE)))
+                    break
+                distance += 1
+        nodes = np.array(nodes, dtype=np.float64).reshape(-1, 2)
+        return nodes[VisibilityGraph._free(grid, nodes)]
+
+    @staticmethod
+    def _free(grid: np.ndarray, points: np.ndarray) -> np.ndarray:
+        """Which points are inside the grid and on a free pixel"""
+        width, height = grid.shape
+        inside = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+        free = inside.copy()
+        free[inside] = ~grid[points[inside, 0].astype(np.intp), points[inside, 1].astype(np.intp)]
+        return free
+
+    def nearest_free(self, position: Position) -> Position | None:
+        """
+        Finds the free pixel closest to a position, for positions inside the margin
+        :param position: The position, in pixels
+        :return: The position itself if it's free, otherwise the center of the closest free pixel, or None if there
+        is no free pixel
+        """
+        grid = self.grid
+        width, height = grid.shape
+        x, y = int(position.x), int(position.y)
+        if 0 <= x < width and 0 <= y < height and not grid[x, y]:
+            return position
+        # the closest free pixel is within a square that grows until it has one
+        radius = 8
+        while True:
+            left, top = max(min(x, width - 1) - radius, 0), max(min(y, height - 1) - radius, 0)
+            window = grid[left:max(x, 0) + radius + 1, top:max(y, 0) + radius + 1]
+            xs, ys = np.nonzero(~window)
+            if len(xs):
+                distances = (xs + left + 0.5 - position.x) ** 2 + (ys + top + 0.5 - position.y) ** 2
+                closest = int(np.argmin(distances))
+                return Position(float(xs[closest] + left + 0.5), float(ys[closest] + top + 0.5))
+            if window.shape == grid.shape:
+                return None
+            radius *= 2
+
+    def find_path(self, start: Position, goal: Position) -> list[Position] | None:
+        """
+        Finds the shortest path between two positions through the graph
+        :param start: Where to start, in pixels
+        :param goal: Where to go, in pixels
+        :return: The corners of the path from start to goal (both included), or None if there is no path
+        """
+        start_time = time.perf_counter()
+        self.nodes_expanded = 0
+        self.rays_cast = 0
+        try:
+            return self._find_path(start, goal)
+        finally:
+            self.search_time = time.perf_counter() - start_time
+            if instrumentation.enabled:
+                instrumentation.add_time("planner.VisibilityGraph", self.search_time)
+                instrumentation.count("planner.VisibilityGraph.nodes_expanded", self.nodes_expanded)
+                instrumentation.count("planner.VisibilityGraph.rays_cast", self.rays_cast)
+
+    def _find_path(self, start: Position, goal: Position) -> list[Position] | None:
+        free_start, free_goal = self.nearest_free(start), self.nearest_free(goal)
+        if free_start is None or free_goal is None:
+            return None
+        # the bits from inside the margin out to the free space, if any
+        head = [start.copy()] if free_start is not start else []
+        tail = [goal.copy()] if free_goal is not goal else []
+        sx, sy = free_start.x, free_start.y
+        gx, gy = free_goal.x, free_goal.y
+
+        # one batch: start to goal, start to every node, goal to every node
+        nodes = self.nodes
+        node_count = len(nodes)
+        starts = np.empty((2 * node_count + 1, 2))
+        starts[0] = starts[1:node_count + 1] = (sx, sy)
+        starts[node_count + 1:] = (gx, gy)
+        ends = np.empty_like(starts)
+        ends[0] = (gx, gy)
+        ends[1:node_count + 1] = ends[node_count + 1:] = nodes
+        hits, _ = ray_cast_many(starts, ends, self.grid, tolerance=0)
+        self.rays_cast = len(starts)
+        if not hits[0]:
+            return head + [free_start.copy(), free_goal.copy()] + tail
+        start_sees = np.flatnonzero(~hits[1:node_count + 1]).tolist()
+        goal_sees = np.flatnonzero(~hits[node_count + 1:]).tolist()
+        if not start_sees or not goal_sees:
+            return None
+
+        # A* from the start over the nodes. the goal is node_count, and only the nodes that see it lead to it
+        goal_node = node_count
+        to_goal = {node: hypot(gx - x, gy - y) for node, (x, y) in zip(goal_sees, nodes[goal_sees].tolist())}
+        heuristics = np.hypot(nodes[:, 0] - gx, nodes[:, 1] - gy).tolist() + [0.0]
+        neighbours = self.neighbours
+        costs = {}
+        parents = {}
+        heap = []
+        for node, (x, y) in zip(start_sees, nodes[start_sees].tolist()):
+            cost = hypot(x - sx, y - sy)
+            costs[node] = cost
+            parents[node] = -1
+            heappush(heap, (cost + heuristics[node], cost, node))
+        closed = set()
+        while heap:
+            _, cost, current = heappop(heap)
+            if current in closed:
+                continue
+            if current == goal_node:
+                break
+            closed.add(current)
+            self.nodes_expanded += 1
+            moves = neighbours[current]
+            if current in to_goal:
+                moves = moves + [(goal_node, to_goal[current])]
+            for neighbour, length in moves:
+                new_cost = cost + length
+                if new_cost < costs.get(neighbour, float("inf")):
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = current
+                    heappush(heap, (new_cost + heuristics[neighbour], new_cost, neighbour))
+        if goal_node not in parents:
+            return None
+
+        corners = []
+        node = parents[goal_node]
+        while node != -1:
+            corners.append(Position(*nodes[node].tolist()))
+            node = parents[node]
+        return head + [free_start.copy()] + corners[::-1] + [free_goal.copy()] + tail
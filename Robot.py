@@ -8,14 +8,15 @@ from Utils.AccelerationSmoother import AccelerationSmoother
 import Field
 from Field import Circle
 from math import cos, sin, pi
-from Utils.DebugPrint import DebugPrint
+from Utils.Instrumentation import instrumentation
 from Utils.UtilFuncs import sign
 
 
 class Robot(ABC):
     def __init__(self, field: Field, starting_position: Position = Position(0, 0), max_acceleration: float = 1000,
                  max_velocity: float = 100, sprite: Circle = Circle(0, 0, 10)):
-        self.position = starting_position
+        # copied, since the position is changed in place and the default would be shared by every robot
+        self.position = starting_position.copy()
         self.velocity = Position(0, 0)
         self.max_velocity = max_velocity
         self.max_acceleration = max_acceleration
@@ -43,6 +44,14 @@ class Robot(ABC):
             critical_duration ** 2)  # integral calculation should stay the same
         return critical_distance
 
+    def set_clock(self, clock) -> None:
+        """
+        Sets where the robot gets the time from, instead of the wall clock
+        :param clock: A function returning the current time in seconds
+        :return:
+        """
+        self.acceleration_smoother.set_clock(clock)
+
     def set_trajectory(self, trajectory: list[Position]) -> None:
         """
         Sets the trajectory of the robot
@@ -98,14 +107,14 @@ class Robot(ABC):
         # Listen to me, I don't understand how any of this works.
         # I did this by trial and error, just let the black magic do its thing
         target_distance = target_position.get_distance_to(self.position)
-        current_magnitude = self.velocity.get_distance_to(Position(0, 0))
+        current_magnitude = self.velocity.norm()
 
         # if within tolerance just set current position to target
         # NOTE: might cause it to have some jittery motion at low fps
         if target_distance < time_delta_seconds * (self.max_acceleration - self.acceleration_smoother.get_value()):
             self.acceleration_smoother.set_state(0)
             if slowdown: self.velocity = Position(0, 0)
-            current_magnitude = self.velocity.get_distance_to(Position(0, 0)) / time_delta_seconds
+            current_magnitude = self.velocity.norm() / time_delta_seconds
             at_target = True
 
         # handles accelerating down: checks that it is within the "critical distance" of the target
@@ -122,7 +131,8 @@ class Robot(ABC):
             cos(rotation_to * pi / 180) * current_magnitude,
             sin(rotation_to * pi / 180) * current_magnitude
         )
-        change = new_velocity - self.velocity
+        change = new_velocity
+        change -= self.velocity
 
         # just for testing
         # simulate sliding, so robot decelerates slower
@@ -132,7 +142,7 @@ class Robot(ABC):
         #     1
         # )
 
-        # DebugPrint.add_debug_function(f"{error_func(change)=}, {change=}, {self.velocity=}")
+        # instrumentation.event("robot.change", f"{error_func(change)=}, {change=}, {self.velocity=}")
         self.apply_force(change, time_delta_seconds, limit_acceleration=True, apply_velocity=update_position)
         return at_target
 
@@ -160,18 +170,17 @@ class Robot(ABC):
         """
         This function updates the robot's position based on its current velocity
         :param time_delta_seconds: The time since the last update
-        :param debug: Prints position and velocity if true
+        :param debug: Records the position and velocity as an instrumentation event if true
         :return:
         """
-        self.position += self.velocity * time_delta_seconds
-        if debug:
-            DebugPrint.add_debug_function(f"{self.position=}")
-            DebugPrint.add_debug_function(f"{self.velocity=}")
+        self.position.add_scaled(self.velocity, time_delta_seconds)
+        if debug and instrumentation.enabled:
+            instrumentation.event("robot.update", f"{self.position=}, {self.velocity=}")
 
     def apply_force(self, force: Position, time_delta_seconds: float, limit_acceleration: bool = False,
-                    apply_velocity: bool = True, error_function=lambda pos: pos * 1) -> None:
+                    apply_velocity: bool = True, error_function=None) -> None:
         """ This function applies a force to the robot
-        :param error_function: Function to add error to the force
+        :param error_function: Function to add error to the force, if any
         :param force: The force to apply to the robot
         :param time_delta_seconds: The time since the last update
         :param limit_acceleration: If the acceleration should be limited to the robot's max
@@ -179,7 +188,8 @@ class Robot(ABC):
         :return:
         """
         # adds error to the force
-        force = error_function(force)
+        if error_function is not None:
+            force = error_function(force)
         # limits acceleration
         if limit_acceleration:
             force.scale_to(self.max_acceleration, only_downscale=True)
@@ -0,0 +1,307 @@
+"""
+Many robots moved at once with numpy, one array operation per tick instead of a few Position objects per robot.
+Runs headless: python -m RobotBatch [robots] [steps] checks the batch against Robot and times both
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from Utils.Position import Position
+
+# the arrays that go_to_positions changes, besides the positions
+_MOTION_ARRAYS = ("velocities", "accelerations", "speeds", "speed_targets", "speed_directions")
+
+
+class RobotBatch:
+    """
+    The motion of a batch of robots, stored as arrays with one row per robot.
+
+    go_to_positions and apply_force move every robot exactly like Robot.go_to_position and Robot.apply_force: the
+    speed is ramped by the same acceleration smoother (speeds, speed_targets and speed_directions are its state), the
+    change in velocity per tick is limited to max_acceleration and the velocity to max_velocity.
+    Positions are (x, y) only, the scalar robots never turn.
+    """
+
+    def __init__(self, count: int, max_velocity: float | np.ndarray = 100, max_acceleration: float | np.ndarray = 1000,
+                 positions: np.ndarray = None):
+        """
+        :param count: How many robots
+        :param max_velocity: The max velocity of every robot, or an array with one per robot
+        :param max_acceleration: The max acceleration of every robot, or an array with one per robot
+        :param positions: A (count, 2) array of starting positions. If none, they all start at (0, 0)
+        """
+        self.count = count
+        self.max_velocities = np.broadcast_to(np.asarray(max_velocity, dtype=np.float64), (count,)).copy()
+        self.max_accelerations = np.broadcast_to(np.asarray(max_acceleration, dtype=np.float64), (count,)).copy()
+        self.positions = np.zeros((count, 2)) if positions is None else \
+            np.array(positions, dtype=np.float64).reshape(count, 2)
+        self.velocities = np.zeros((count, 2))
+        # the (limited) change in velocity applied by the last apply_force
+        self.accelerations = np.zeros((count, 2))
+        # acceleration smoother state
+        self.speeds = np.zeros(count)
+        self.speed_targets = np.zeros(count)
+        self.speed_directions = np.zeros(count)
+        # waypoints for follow_trajectories (see set_trajectories), padded to the longest trajectory. robot i is
+        # headed to trajectory_points[i, trajectory_indices[i]] and has reached all of its waypoints once
+        # trajectory_indices[i] gets to trajectory_lengths[i]
+        self.trajectory_points = np.zeros((count, 1, 2))
+        self.trajectory_indices = np.zeros(count, dtype=np.intp)
+        self.trajectory_lengths = np.zeros(count, dtype=np.intp)
+
+    @classmethod
+    def from_robots(cls, robots: list) -> "RobotBatch":
+        """
+        Makes a batch with the state of some robots, see to_robots to copy it back
+        :param robots: The robots
+        :return: The batch
+        """
+        batch = cls(len(robots), [robot.max_velocity for robot in robots],
+                    [robot.max_acceleration for robot in robots],
+                    [(robot.position.x, robot.position.y) for robot in robots])
+        batch.velocities[:] = [(robot.velocity.x, robot.velocity.y) for robot in robots]
+        batch.speeds[:] = [robot.acceleration_smoother._current_value for robot in robots]
+        batch.speed_targets[:] = [robot.acceleration_smoother._current_target for robot in robots]
+        batch.speed_directions[:] = [robot.acceleration_smoother._current_direction for robot in robots]
+        batch.trajectories = [list(robot.trajectory) for robot in robots]
+        return batch
+
+    def to_robots(self, robots: list) -> None:
+        """
+        Copies the state of the batch to robots, in the same order as from_robots
+        :param robots: The robots
+        :return:
+        """
+        for i, robot in enumerate(robots):
+            x, y = self.positions[i].tolist()
+            robot.position = Position(x, y, robot.position.rotation)
+            robot.velocity = Position(*self.velocities[i].tolist())
+            smoother = robot.acceleration_smoother
+            smoother._current_value = float(self.speeds[i])
+            smoother._current_target = float(self.speed_targets[i])
+            smoother._current_direction = int(self.speed_directions[i])
+            robot.trajectory = list(self.trajectories[i])
+
+    def set_trajectories(self, trajectories: list[list[Position]]) -> None:
+        """
+        Gives every robot a new trajectory to follow, like Robot.set_trajectory
+        :param trajectories: The waypoints of each robot, in order
+        :return:
+        """
+        if len(trajectories) != self.count:
+            raise ValueError(f"Expected {self.count} trajectories, got {len(trajectories)}")
+        lengths = [len(trajectory) for trajectory in trajectories]
+        self.trajectory_points = np.zeros((self.count, max(lengths, default=0) or 1, 2))
+        for i, trajectory in enumerate(trajectories):
+            if trajectory:
+                self.trajectory_points[i, :len(trajectory)] = [(point.x, point.y) for point in trajectory]
+        self.trajectory_indices = np.zeros(self.count, dtype=np.intp)
+        self.trajectory_lengths = np.array(lengths, dtype=np.intp)
+
+    @property
+    def trajectories(self) -> list[list[Position]]:
+        """The waypoints each robot has left"""
+        return [[Position(x, y) for x, y in self.trajectory_points[i, start:end].tolist()]
+                for i, (start, end) in enumerate(zip(self.trajectory_indices.tolist(),
+                                                     self.trajectory_lengths.tolist()))]
+
+    @trajectories.setter
+    def trajectories(self, trajectories: list[list[Position]]) -> None:
+        self.set_trajectories(trajectories)
+
+    def _active(self, mask) -> np.ndarray:
+        return np.ones(self.count, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+    def update(self, time_delta_seconds: float, mask: np.ndarray = None) -> None:
+        """
+        Moves the robots by their velocity, like Robot.update
+        :param time_delta_seconds: The time since the last update
+        :param mask: Which robots to move. If none, all of them
+        :return:
+        """
+        active = self._active(mask)
+        self.positions += np.where(active[:, None], self.velocities * time_delta_seconds, 0.0)
+
+    def apply_force(self, forces: np.ndarray, time_delta_seconds: float, limit_acceleration: bool = False,
+                    apply_velocity: bool = True, mask: np.ndarray = None) -> None:
+        """
+        Applies a force to every robot, like Robot.apply_force
+        :param forces: A (count, 2) array, the change in velocity of each robot
+        :param time_delta_seconds: The time since the last update
+        :param limit_acceleration: If each force should be limited to its robot's max acceleration
+        :param apply_velocity: If the new velocities should be applied to the positions
+        :param mask: Which robots to apply it to. If none, all of them
+        :return:
+        """
+        active = self._active(mask)
+        forces = np.array(forces, dtype=np.float64).reshape(self.count, 2)
+        if limit_acceleration:
+            forces *= _downscale(forces, self.max_accelerations)[:, None]
+        forces[~active] = 0.0
+        self.accelerations = forces
+
+        velocities = self.velocities + forces
+        velocities *= _downscale(velocities, self.max_velocities)[:, None]
+        self.velocities = np.where(active[:, None], velocities, self.velocities)
+        if apply_velocity:
+            self.update(time_delta_seconds, active)
+
+    def _update_speeds(self, targets: np.ndarray, time_delta_seconds: float, mask: np.ndarray) -> np.ndarray:
+        """AccelerationSmoother.update for the robots in mask, returns the new speed of every robot"""
+        directions = np.sign(targets - self.speeds)
+        speeds = self.speeds + self.max_accelerations * directions * time_delta_seconds
+        speeds = np.where(np.sign(targets - speeds) != directions, targets, speeds)
+        speeds = np.maximum(np.minimum(speeds, self.max_velocities), 0.0)
+        self.speeds = np.where(mask, speeds, self.speeds)
+        self.speed_targets = np.where(mask, targets, self.speed_targets)
+        self.speed_directions = np.where(mask, directions, self.speed_directions)
+        return speeds
+
+    def go_to_positions(self, targets: np.ndarray, time_delta_seconds: float, update_position: bool = False,
+                        slowdown: bool | np.ndarray = True, mask: np.ndarray = None) -> np.ndarray:
+        """
+        Moves every robot towards its target, like Robot.go_to_position
+        :param targets: A (count, 2) array of the positions to go to
+        :param time_delta_seconds: The time since the last update
+        :param update_position: If the positions should be updated
+        :param slowdown: If the robots should slow down close to their target, or an array with one per robot
+        :param mask: Which robots to move. If none, all of them
+        :return: A bool array, True for the robots that are at their target
+        """
+        active = self._active(mask)
+        slowdown = np.broadcast_to(np.asarray(slowdown, dtype=bool), (self.count,))
+        targets = np.asarray(targets, dtype=np.float64).reshape(self.count, 2)
+        offsets = targets - self.positions
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        magnitudes = np.hypot(self.velocities[:, 0], self.velocities[:, 1])
+
+        # the same three cases as the scalar version: at the target, within braking distance, or speeding up
+        at_target = active & (distances < time_delta_seconds * (self.max_accelerations - self.speeds))
+        critical_distances = (self.max_accelerations / 2) * (self.speeds / self.max_accelerations) ** 2
+        braking = active & ~at_target & (distances <= critical_distances)
+        speeding_up = active & ~at_target & ~braking
+
+        stopping = at_target & slowdown
+        self.velocities[stopping] = 0.0
+        self.speeds[at_target] = self.speed_targets[at_target] = self.speed_directions[at_target] = 0.0
+        magnitudes = np.where(at_target, np.hypot(self.velocities[:, 0], self.velocities[:, 1]) / time_delta_seconds,
+                              magnitudes)
+        smoothed = (braking & slowdown) | speeding_up
+        speeds = self._update_speeds(np.where(speeding_up, self.max_accelerations, 0.0), time_delta_seconds, smoothed)
+        magnitudes = np.where(smoothed, speeds, magnitudes)
+
+        # degrees on a unit circle, the way Position.get_angle_to does it
+        angles = (np.arctan2(offsets[:, 1], offsets[:, 0]) * 180 / np.pi + 360) % 360 * np.pi / 180
+        new_velocities = np.stack([np.cos(angles) * magnitudes, np.sin(angles) * magnitudes], axis=1)
+        self.apply_force(new_velocities - self.velocities, time_delta_seconds, limit_acceleration=True,
+                         apply_velocity=update_position, mask=active)
+        return at_target
+
+    def follow_trajectories(self, time_delta_seconds: float) -> np.ndarray:
+        """
+        Moves every robot along its trajectory, like Robot.follow_trajectory: it slows down for the last waypoint only,
+        and a waypoint is removed once it's reached
+        :param time_delta_seconds: The time since the last update
+        :return: A bool array, True for the robots that had no waypoints left
+        """
+        remaining = self.trajectory_lengths - self.trajectory_indices
+        done = remaining <= 0
+        rows = np.flatnonzero(~done)
+        if len(rows) == self.count:
+            moving = self
+        else:
+            # most robots are done long before the last ones, so the rest move as a batch of their own instead of
+            # being masked out of every array operation
+            self.accelerations = np.zeros((self.count, 2))
+            if len(rows) == 0:
+                return done
+            moving = self._take(rows)
+        targets = self.trajectory_points[rows, self.trajectory_indices[rows]]
+        reached = moving.go_to_positions(targets, time_delta_seconds, update_position=True,
+                                         slowdown=remaining[rows] == 1)
+        if moving is not self:
+            self._put(rows, moving)
+        self.trajectory_indices[rows] += reached
+        return done
+
+    def _take(self, rows: np.ndarray) -> "RobotBatch":
+        """A batch of the motion of some of the robots, see _put to copy it back"""
+        # without __init__, which would only make arrays to throw away
+        batch = RobotBatch.__new__(RobotBatch)
+        batch.count = len(rows)
+        batch.max_velocities = self.max_velocities[rows]
+        batch.max_accelerations = self.max_accelerations[rows]
+        batch.positions = self.positions[rows]
+        for name in _MOTION_ARRAYS:
+            setattr(batch, name, getattr(self, name)[rows])
+        return batch
+
+    def _put(self, rows: np.ndarray, batch: "RobotBatch") -> None:
+        """Copies the motion of a batch from _take back to its robots"""
+        self.positions[rows] = batch.positions
+        for name in _MOTION_ARRAYS:
+            getattr(self, name)[rows] = getattr(batch, name)
+
+
+def _downscale(vectors: np.ndarray, limits: np.ndarray) -> np.ndarray:
+    """How much to scale each vector so it's no longer than its limit (Position.scale_to with only_downscale)"""
+    lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+    return np.minimum(np.divide(limits, lengths, out=np.zeros_like(lengths), where=lengths != 0), 1.0)
+
+
+def parity_check(count: int = 64, steps: int = 500, time_delta_seconds: float = 1 / 50, seed: int = 0) -> dict:
+    """
+    Runs the same robots with the scalar Robot and with RobotBatch, following random trajectories
+    :param count: How many robots
+    :param steps: How many ticks
+    :param time_delta_seconds: The length of a tick
+    :param seed: The random seed
+    :return: The largest difference in position and velocity, and the time each took
+    """
+    import pygame
+    from BeeLineRobot import BeeLineRobot
+
+    pygame.init()
+    rng = np.random.default_rng(seed)
+    robots = []
+    for _ in range(count):
+        robot = BeeLineRobot(None, max_velocity=float(rng.uniform(100, 500)),
+                             max_acceleration=float(rng.uniform(200, 1500)))
+        robot.position = Position(*rng.uniform(0, 800, 2).tolist())
+        robot.set_trajectory([Position(*point) for point in rng.uniform(0, 800, (int(rng.integers(1, 5)), 2)).tolist()])
+        robots.append(robot)
+    batch = RobotBatch.from_robots(robots)
+
+    start_time = time.perf_counter()
+    for _ in range(steps):
+        for robot in robots:
+            robot.follow_trajectory(time_delta_seconds)
+    scalar_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in range(steps):
+        batch.follow_trajectories(time_delta_seconds)
+    batch_time = time.perf_counter() - start_time
+
+    positions = np.array([(robot.position.x, robot.position.y) for robot in robots])
+    velocities = np.array([(robot.velocity.x, robot.velocity.y) for robot in robots])
+    return {
+        "robots": count, "steps": steps,
+        "max_position_error": float(np.abs(positions - batch.positions).max()),
+        "max_velocity_error": float(np.abs(velocities - batch.velocities).max()),
+        "trajectories_match": [len(robot.trajectory) for robot in robots] == [len(t) for t in batch.trajectories],
+        "scalar_seconds": scalar_time, "batch_seconds": batch_time,
+    }
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    results = parity_check(int(sys.argv[1]) if len(sys.argv) > 1 else 64,
+                           int(sys.argv[2]) if len(sys.argv) > 2 else 500)
+    print(results)
+    if results["max_position_error"] > 1e-6 or results["max_velocity_error"] > 1e-6 or \
+            not results["trajectories_match"]:
+        sys.exit("RobotBatch doesn't match Robot")
+    print(f"{results['scalar_seconds'] / results['batch_seconds']:.1f}x faster than the scalar robots")
@@ -0,0 +1,278 @@
+"""
+Routes between named field locations (scoring nodes, pickup stations, starting positions...), planned offline.
+A table is built once for a field and margin, saved, and then loaded to answer route queries with a dict lookup.
+Queries between positions that aren't in the table fall back to planning with a BasicPathfindBot.
+Runs headless: python -m RouteTable [workers] builds a table for a few locations on the map and times it
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from BasicPathfindBot import BasicPathfindBot
+from Field import Field, field_hash
+from Pathfinding.FlowField import FlowField
+from Pathfinding.GridAStar import GridAStar
+from Utils.Position import Position
+
+# bump when the file layout changes, old files are rejected instead of misread
+ROUTE_TABLE_VERSION = 1
+
+
+def _corners(cells: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """The cells of a grid path where it changes direction (and both ends), the same path with fewer points"""
+    corners = [cells[0]]
+    for previous, cell, following in zip(cells, cells[1:], cells[2:]):
+        if (cell[0] - previous[0], cell[1] - previous[1]) != (following[0] - cell[0], following[1] - cell[1]):
+            corners.append(cell)
+    if len(cells) > 1:
+        corners.append(cells[-1])
+    return corners
+
+
+def _routes_to(grid: np.ndarray, goal: tuple[int, int], starts: list[tuple[int, int]]) \
+        -> list[list[tuple[int, int]] | None]:
+    """Runs in a worker: the corners of the shortest path from every start to one goal, with one flow field"""
+    flow_field = FlowField(GridAStar(grid), goal)
+    paths = [flow_field.find_path(start) for start in starts]
+    return [None if path is None else _corners(path) for path in paths]
+
+
+class RouteTable:
+    """
+    The shortest route between every pair of a set of named locations, for one field and margin.
+
+    Routes are lists of Positions like BasicPathfindBot.path_find returns (starting at the start location and ending
+    at the goal location), or [None] if there is no route. They're found with one flow field per location, so n
+    locations cost n sweeps of the planning grid instead of n * n searches, and the sweeps run in parallel.
+    """
+
+    # the planners whose paths are the table's routes: shortest paths over the 8-connected planning grid. only queries
+    # for one of these can be answered from the table
+    ROUTE_PLANNERS = ("astar", "jps", "flow_field", "dstar_lite", "anytime")
+
+    def __init__(self, field: Field, locations: dict[str, Position], resolution: float = 1 / 4,
+                 fallback_planner: str = "astar"):
+        """
+        Makes an empty table, see build and load
+        :param field: The field, with the margin the routes are for
+        :param locations: name -> position, in pixels
+        :param resolution: The resolution of the planning grid, in cells per pixel
+        :param fallback_planner: What planner to plan with for positions that aren't in the table. The routes in the
+        table are always shortest grid paths (see ROUTE_PLANNERS), whatever this is
+        """
+        self.field = field
+        self.locations = {name: position.copy() for name, position in locations.items()}
+        self.resolution = resolution
+        self.fallback_planner = fallback_planner
+        self.margin = field.margin
+        self.margin_shape = field.margin_shape
+        self.field_hash = field_hash(field)
+        # (start name, goal name) -> ((x, y), ...) points of the route, or None if there is none
+        self.routes: dict[tuple[str, str], tuple[tuple[float, float], ...] | None] = {}
+        self.build_time = 0.0
+        # the planning grid cell of each location -> its name, to find locations by position
+        self._names_by_cell = {self._cell(position): name for name, position in self.locations.items()}
+        self._robot = BasicPathfindBot(field, planner=fallback_planner, planning_resolution=resolution)
+
+    def _cell(self, position: Position) -> tuple[int, int]:
+        return int(position.x * self.resolution), int(position.y * self.resolution)
+
+    @classmethod
+    def build(cls, field: Field, locations: dict[str, Position], resolution: float = 1 / 4,
+              fallback_planner: str = "astar", workers: int = None) -> "RouteTable":
+        """
+        Plans every route between the locations
+        :param field: The field, with the margin to plan for
+        :param locations: name -> position, in pixels
+        :param resolution: The resolution of the planning grid, in cells per pixel
+        :param fallback_planner: What planner to plan with for positions that aren't in the table
+        :param workers: How many processes to plan in. If 1, everything is planned in this process
+        :return: The table
+        """
+        start_time = time.perf_counter()
+        table = cls(field, locations, resolution, fallback_planner)
+        robot = table._robot
+        names = list(table.locations)
+        grid = field.get_occupancy(resolution)
+        cells = {}
+        for name in names:
+            position = table.locations[name]
+            start, goal, _ = robot._grid_query(position, position, resolution, "flow_field")
+            # a location can be in a blocked cell of the (conservative) grid, it's still reached from its free
+            # neighbour, the same way path_find does it
+            cells[name] = (start, robot._free_goal_cell(goal, position, resolution))
+
+        jobs = [(grid, cells[goal][1], [cells[start][0] for start in names]) for goal in names]
+        if workers == 1:
+            results = [_routes_to(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_routes_to, *zip(*jobs)))
+
+        for goal, paths in zip(names, results):
+            for start, path in zip(names, paths):
+                if path is None:
+                    table.routes[start, goal] = None
+                    continue
+                # the route goes from the locations themselves, the cells in between are at their centers
+                points = [((x + 0.5) / resolution, (y + 0.5) / resolution) for x, y in path[1:-1]]
+                start_position, goal_position = table.locations[start], table.locations[goal]
+                table.routes[start, goal] = tuple([start_position.as_xy()] + points + [goal_position.as_xy()])
+        table.build_time = time.perf_counter() - start_time
+        return table
+
+    @staticmethod
+    def cache_key(field: Field, resolution: float = 1 / 4) -> str:
+        """A name for the table of a field, margin and resolution, for saving tables side by side"""
+        return f"{field_hash(field)[:16]}_{field.margin_shape}{field.margin}_{resolution:g}"
+
+    @classmethod
+    def load_or_build(cls, field: Field, locations: dict[str, Position], directory: str = "routes",
+                      resolution: float = 1 / 4, fallback_planner: str = "astar",
+                      workers: int = None) -> "RouteTable":
+        """
+        Loads the table for the field and margin from directory if it was saved there with the same locations,
+        otherwise builds it and saves it
+        :return: The table
+        """
+        filename = os.path.join(directory, cls.cache_key(field, resolution) + ".npz")
+        if os.path.exists(filename):
+            try:
+                table = cls.load(filename, field, fallback_planner)
+                if table.locations == locations:
+                    return table
+            except ValueError:
+                pass  # made for something else, rebuild it
+        table = cls.build(field, locations, resolution, fallback_planner, workers)
+        os.makedirs(directory, exist_ok=True)
+        table.save(filename)
+        return table
+
+    def save(self, filename: str) -> None:
+        """
+        Saves the table as a compressed .npz: every route's points in one float32 array, with an offset per route
+        :param filename: The name of the file to save to, ending in .npz
+        :return:
+        """
+        if not filename.endswith(".npz"):
+            raise ValueError("File must be a .npz file")
+        names = list(self.locations)
+        offsets = [0]
+        points = []
+        for start in names:
+            for goal in names:
+                route = self.routes.get((start, goal))
+                # a route without points has no path, a route always has at least its two ends
+                if route is not None:
+                    points.extend(route)
+                offsets.append(len(points))
+        meta = {"version": ROUTE_TABLE_VERSION, "field_hash": self.field_hash, "margin": self.margin,
+                "margin_shape": self.margin_shape, "resolution": self.resolution, "names": names}
+        np.savez_compressed(filename, meta=np.array(json.dumps(meta)),
+                            locations=np.array([self.locations[name].as_xy() for name in names], dtype=np.float64),
+                            offsets=np.array(offsets, dtype=np.int32),
+                            points=np.array(points, dtype=np.float32).reshape(-1, 2))
+
+    @classmethod
+    def load(cls, filename: str, field: Field, fallback_planner: str = "astar") -> "RouteTable":
+        """
+        Loads a table saved by save
+        :param filename: The file
+        :param field: The field it's for. Its obstacles, margin and margin shape have to be the ones the table was
+        built with
+        :param fallback_planner: What planner to plan with for positions that aren't in the table
+        :return: The table
+        """
+        with np.load(filename) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != ROUTE_TABLE_VERSION:
+                raise ValueError(f"{filename} is route table version {meta.get('version')}, "
+                                 f"this is version {ROUTE_TABLE_VERSION}")
+            if (meta["margin"], meta["margin_shape"]) != (field.margin, field.margin_shape):
+                raise ValueError(f"{filename} is for a {meta['margin_shape']} margin of {meta['margin']}, the field "
+                                 f"has a {field.margin_shape} margin of {field.margin}")
+            if meta["field_hash"] != field_hash(field):
+                raise ValueError(f"{filename} is for a different field image")
+            names = meta["names"]
+            locations = {name: Position(float(x), float(y)) for name, (x, y) in zip(names, data["locations"].tolist())}
+            offsets = data["offsets"].tolist()
+            points = [tuple(point) for point in data["points"].astype(np.float64).tolist()]
+
+        table = cls(field, locations, meta["resolution"], fallback_planner)
+        for i, (start, goal) in enumerate((start, goal) for start in names for goal in names):
+            route = points[offsets[i]:offsets[i + 1]]
+            table.routes[start, goal] = tuple(route) if route else None
+        return table
+
+    def name_of(self, position: Position) -> str | None:
+        """
+        :param position: A position, in pixels
+        :return: The name of the location in the same planning grid cell, if there is one
+        """
+        return self._names_by_cell.get(self._cell(position))
+
+    def lookup(self, start: str | Position, goal: str | Position) -> list[Position] | None:
+        """
+        Looks a route up, without planning
+        :param start: The name of a location, or a position in the same planning grid cell as one
+        :param goal: The name of a location, or a position in the same planning grid cell as one
+        :return: The route (new Positions, so they can be changed), [None] if the table knows there is no route, or
+        None if the route isn't in the table or the field's margin changed since the table was made
+        """
+        if (self.field.margin, self.field.margin_shape) != (self.margin, self.margin_shape):
+            return None
+        start_name = start if isinstance(start, str) else self.name_of(start)
+        goal_name = goal if isinstance(goal, str) else self.name_of(goal)
+        key = (start_name, goal_name)
+        if key not in self.routes:
+            return None
+        route = self.routes[key]
+        if route is None:
+            return [None]
+        return [Position(x, y) for x, y in route]
+
+    def route(self, start: str | Position, goal: str | Position) -> list[Position]:
+        """
+        Gets a route from the table, or plans it if it isn't in the table
+        :param start: The name of a location, or any position
+        :param goal: The name of a location, or any position
+        :return: The route, or [None] if there is no route
+        """
+        route = self.lookup(start, goal)
+        if route is not None:
+            return route
+        if isinstance(start, str):
+            start = self.locations[start]
+        if isinstance(goal, str):
+            goal = self.locations[goal]
+        return self._robot.path_find(goal, curr_position=start, resolution=self.resolution)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+
+    pygame.init()
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    field = Field(pygame.transform.scale2x(pygame.image.load("images/Map.png")), margin=25)
+    locations = {f"location_{i}": Position(x * 2, y * 2) for i, (x, y) in enumerate(
+        [(592, 176), (395, 200), (193, 115), (525, 146), (632, 293), (361, 240), (639, 80), (205, 311)])}
+
+    table = RouteTable.build(field, locations, workers=workers)
+    print(f"Built {len(table.routes)} routes between {len(locations)} locations in {table.build_time:.2f} seconds")
+
+    robot = BasicPathfindBot(field, planner="astar", planning_resolution=1 / 4)
+    start_time = time.perf_counter()
+    for start, goal in table.routes:
+        robot.path_find(locations[goal], curr_position=locations[start], resolution=1 / 4)
+    live_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    for start, goal in table.routes:
+        table.route(start, goal)
+    table_time = time.perf_counter() - start_time
+    print(f"Live planning: {live_time / len(table.routes) * 1000:.3f} ms per route, "
+          f"table: {table_time / len(table.routes) * 1000:.4f} ms per route")
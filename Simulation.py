@@ -0,0 +1,270 @@
+"""
+A headless, fixed timestep simulation of robots on a field.
+Time comes from a SimulationClock that only moves when the simulation steps, so a run is the same every time and runs
+as fast as the robots can be updated. Drawing is an optional observer (see Renderer).
+Runs headless: python -m Simulation [steps]
+"""
+import heapq
+import os
+import sys
+import time
+from itertools import count
+
+import pygame
+
+from Field import Field
+from Robot import Robot
+from Utils.Instrumentation import instrumentation
+from Utils.Position import Position
+
+
+class SimulationClock:
+    """A clock that only moves when it's advanced. Calling it returns the current time in seconds"""
+
+    def __init__(self, start_time: float = 0.0):
+        self.time = start_time
+
+    def __call__(self) -> float:
+        return self.time
+
+    def advance(self, seconds: float) -> None:
+        self.time += seconds
+
+
+class RobotRecord:
+    """What the simulation keeps track of for each robot"""
+
+    def __init__(self, robot: Robot, running: bool):
+        self.robot = robot
+        self.running = running
+        self.collisions = 0  # how many times the robot ran into the field
+        self.colliding = False
+        self.in_margin = False
+        self.margin_steps = 0  # how many steps the robot spent in the margin
+        self.finished_time: float | None = None  # when it last reached the end of its trajectory
+
+    def stats(self) -> dict:
+        return {"collisions": self.collisions, "margin_steps": self.margin_steps, "finished_time": self.finished_time,
+                "position": self.robot.position.as_tuple()[:2]}
+
+
+class Simulation:
+    """
+    Steps robots along their trajectories with a fixed time step, counting collisions with the field.
+
+    Every step, each running robot follows its trajectory for time_step seconds, then is checked against the field's
+    mask (a collision is counted once per contact) and margin mask. Waypoints can be scripted to be added at a given
+    time. Observers are called with the simulation after every step, which is how it gets drawn (see Renderer).
+    """
+
+    def __init__(self, field: Field, time_step: float = 1 / 50, clock: SimulationClock = None):
+        """
+        :param field: The field the robots drive on
+        :param time_step: The length of a step in seconds
+        :param clock: The clock to use. If none, a new one starting at 0
+        """
+        if time_step <= 0:
+            raise ValueError("time_step must be positive")
+        self.field = field
+        self.time_step = time_step
+        self.clock = clock if clock is not None else SimulationClock()
+        self.records: list[RobotRecord] = []
+        self.observers = []
+        self.steps = 0
+        self.stopped = False  # set by an observer (or anyone) to end run early
+        # (time, order added, robot index, waypoint), soonest first
+        self._script: list[tuple[float, int, int, Position]] = []
+        self._script_order = count()
+        self._unstepped_time = 0.0  # the part of advance's time that didn't make a whole step yet
+
+    @property
+    def robots(self) -> list[Robot]:
+        return [record.robot for record in self.records]
+
+    @property
+    def time(self) -> float:
+        return self.clock()
+
+    def add_robot(self, robot: Robot, waypoints: list[Position] = None, running: bool = True) -> int:
+        """
+        Adds a robot, which from now on gets its time from the simulation's clock
+        :param robot: The robot
+        :param waypoints: Waypoints to add to its trajectory
+        :param running: If the robot starts following its trajectory straight away, otherwise see start
+        :return: The index of the robot
+        """
+        robot.set_clock(self.clock)
+        for waypoint in waypoints or []:
+            robot.add_waypoint(waypoint)
+        self.records.append(RobotRecord(robot, running))
+        return len(self.records) - 1
+
+    def start(self, robot_index: int) -> None:
+        """Makes a robot follow its trajectory"""
+        self.records[robot_index].running = True
+
+    def schedule_waypoint(self, at_time: float, robot_index: int, waypoint: Position) -> None:
+        """
+        Adds a waypoint to a robot's trajectory once the clock gets to at_time, and makes the robot run
+        :param at_time: The simulation time, in seconds
+        :param robot_index: The index add_robot returned
+        :param waypoint: The waypoint to add
+        :return:
+        """
+        heapq.heappush(self._script, (at_time, next(self._script_order), robot_index, waypoint))
+
+    def add_observer(self, observer) -> None:
+        """
+        :param observer: Called with the simulation after every step
+        :return:
+        """
+        self.observers.append(observer)
+
+    @property
+    def done(self) -> bool:
+        """If no robot is running and no waypoints are left to add"""
+        return not self._script and not any(record.running for record in self.records)
+
+    def step(self) -> None:
+        """Moves the simulation forward by one time step"""
+        with instrumentation.timer("simulation.step"):
+            while self._script and self._script[0][0] <= self.clock():
+                _, _, robot_index, waypoint = heapq.heappop(self._script)
+                self.records[robot_index].robot.add_waypoint(waypoint)
+                self.records[robot_index].running = True
+
+            for record in self.records:
+                robot = record.robot
+                if record.running and robot.follow_trajectory(self.time_step):
+                    record.running = False
+                    record.finished_time = self.clock() + self.time_step
+
+                colliding = robot.collided_with_mask(self.field.mask)
+                if colliding and not record.colliding:
+                    record.collisions += 1
+                record.colliding = colliding
+                record.in_margin = colliding or robot.collided_with_mask(self.field.margin_mask)
+                record.margin_steps += record.in_margin
+
+        self.clock.advance(self.time_step)
+        self.steps += 1
+        instrumentation.count("simulation.steps")
+        for observer in self.observers:
+            observer(self)
+
+    def advance(self, seconds: float, max_steps: int = 10) -> int:
+        """
+        Runs as many steps as fit in the given time, keeping the rest for the next call. For driving the simulation
+        from a real time loop
+        :param seconds: How much time passed
+        :param max_steps: The most steps to run, so a long pause doesn't make the simulation spend ages catching up
+        :return: How many steps were run
+        """
+        self._unstepped_time += seconds
+        steps = min(int(self._unstepped_time / self.time_step), max_steps)
+        self._unstepped_time = min(self._unstepped_time - steps * self.time_step, self.time_step)
+        for _ in range(steps):
+            self.step()
+        return steps
+
+    def run(self, duration: float = None, max_steps: int = None) -> int:
+        """
+        Steps until every robot is done (see done), or a limit is hit, or stopped is set
+        :param duration: The most simulated seconds to run for
+        :param max_steps: The most steps to run
+        :return: How many steps were run
+        """
+        steps = 0
+        end_time = None if duration is None else self.clock() + duration
+        self.stopped = False
+        while not self.done and not self.stopped:
+            if max_steps is not None and steps >= max_steps:
+                break
+            if end_time is not None and self.clock() + self.time_step > end_time + 1e-9:
+                break
+            self.step()
+            steps += 1
+        return steps
+
+    def results(self) -> dict:
+        """
+        :return: The time, step count and the stats of every robot
+        """
+        return {"time": self.clock(), "steps": self.steps, "robots": [record.stats() for record in self.records]}
+
+
+class Renderer:
+    """
+    An observer that draws the simulation to a pygame window, and stops it if the window is closed
+    """
+
+    def __init__(self, screen: pygame.Surface = None, frame_rate: float = 0, show_margin_mask: bool = True):
+        """
+        :param screen: The surface to draw to. If none, a window the size of the field is opened on the first step
+        :param frame_rate: The most frames per second, to watch in real time. 0 doesn't limit it
+        :param show_margin_mask: If the margin is drawn
+        """
+        self.screen = screen
+        self.frame_rate = frame_rate
+        self.show_margin_mask = show_margin_mask
+        self.clock = pygame.time.Clock()
+
+    def __call__(self, simulation: Simulation) -> None:
+        with instrumentation.timer("simulation.render"):
+            self.render(simulation)
+
+    def render(self, simulation: Simulation) -> None:
+        if self.screen is None:
+            self.screen = pygame.display.set_mode(simulation.field.image.get_size())
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                simulation.stopped = True
+
+        self.screen.fill((255, 255, 255))
+        simulation.field.draw(self.screen, show_margin_mask=self.show_margin_mask)
+        for record in simulation.records:
+            robot = record.robot
+            points = [(robot.position.x, robot.position.y)] + [(waypoint.x, waypoint.y) for waypoint in robot.trajectory]
+            if len(points) > 1:
+                pygame.draw.lines(self.screen, (0, 0, 255), False, points, 3)
+            if record.colliding:
+                robot.sprite.set_color((255, 0, 0, 255))
+            elif record.in_margin:
+                robot.sprite.set_color((255, 125, 0, 255))
+            else:
+                robot.sprite.set_color((0, 255, 0, 255))
+            robot.display(self.screen)
+        pygame.display.flip()
+        if self.frame_rate:
+            self.clock.tick(self.frame_rate)
+
+
+if __name__ == "__main__":
+    # a scripted run on the map: a few robots, each sent to a few waypoints over time
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    from BeeLineRobot import BeeLineRobot
+    from Field import Circle
+
+    pygame.init()
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    field = Field(pygame.image.load("images/Map.png"), margin=10)
+    simulation = Simulation(field, time_step=1 / 50)
+    routes = [
+        [Position(160, 100), Position(620, 100), Position(620, 290)],
+        [Position(620, 290), Position(160, 290), Position(160, 100)],
+        [Position(400, 100), Position(400, 290)],
+    ]
+    for route in routes:
+        robot = BeeLineRobot(field, max_velocity=200, max_acceleration=400)
+        robot.position = Position(route[0].x, route[0].y)
+        robot.sprite = Circle(0, 0, 10)
+        index = simulation.add_robot(robot)
+        for i, waypoint in enumerate(route):
+            simulation.schedule_waypoint(i * 2.0, index, waypoint)
+
+    start_time = time.perf_counter()
+    ran = simulation.run(max_steps=steps)
+    wall_time = time.perf_counter() - start_time
+    print(simulation.results())
+    print(f"{ran} steps ({simulation.time:.2f} simulated seconds) in {wall_time:.3f} seconds, "
+          f"{ran / max(wall_time, 1e-9):.0f} steps per second")
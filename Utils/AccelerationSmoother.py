@@ -3,7 +3,7 @@ from Utils.UtilFuncs import sign, clamp, get_current_time
 class AccelerationSmoother:
     def __init__(self, acceleration, max_value: float | None = None, min_value: float | None = None,
                  initial_value=0.0,
-                 initial_target=0.0):
+                 initial_target=0.0, clock=get_current_time):
         #   constants ish
         self._max_value = max_value
         self._min_value = min_value
@@ -14,7 +14,14 @@ class AccelerationSmoother:
         self._current_direction = 0  # -1 or 1
         self._current_value = initial_value
         self._current_target = initial_target
-        self._last_time = get_current_time()
+        # where the time comes from when update isn't given a time difference. a simulation can swap in its own
+        # clock so nothing depends on the wall clock
+        self._clock = clock
+        self._last_time = clock()
+
+    def set_clock(self, clock):
+        self._clock = clock
+        self._last_time = clock()
 
     def set_state(self, value):
         self._current_value = value
@@ -35,7 +42,7 @@ class AccelerationSmoother:
 
         #   calculate time difference
         if time_difference is None:
-            current_time = get_current_time()
+            current_time = self._clock()
             time_difference = current_time - self._last_time
         else:
             self._last_time += time_difference
@@ -52,7 +59,7 @@ class AccelerationSmoother:
         self._current_value = clamp(self._current_value, self._min_value, self._max_value)
 
         #   update last time
-        self._last_time = get_current_time()
+        self._last_time = self._clock()
 
         #   return speed
         return self._current_value
@@ -0,0 +1,218 @@
+import numpy as np
+
+
+def remove_pinches(grid: np.ndarray) -> np.ndarray:
+    """
+    Blocks cells until no two free cells only touch at a corner (a 2x2 block with free and blocked cells on the
+    diagonals). The planners can't move through those corners anyway, and without them every free region has a clean
+    boundary that never touches itself or another boundary.
+    :param grid: A (width, height) boolean array, True where blocked
+    :return: A copy of the grid with the pinches blocked
+    """
+    padded = np.ones((grid.shape[0] + 2, grid.shape[1] + 2), dtype=bool)
+    padded[1:-1, 1:-1] = grid
+    while True:
+        free = ~padded
+        a, b, c, d = free[:-1, :-1], free[1:, :-1], free[:-1, 1:], free[1:, 1:]
+        main_diagonal = a & d & ~b & ~c
+        other_diagonal = b & c & ~a & ~d
+        if not (main_diagonal.any() or other_diagonal.any()):
+            return padded[1:-1, 1:-1].copy()
+        # blocking one free cell of each pinch can make new ones, hence the loop
+        padded[:-1, :-1] |= main_diagonal
+        padded[1:, :-1] |= other_diagonal
+
+
+def trace_contours(grid: np.ndarray) -> list[np.ndarray]:
+    """
+    Traces the boundaries of the free regions of a grid along the pixel edges.
+    Vertices are pixel corners: cell (x, y) covers [x, x + 1] by [y, y + 1]. Only corners where the boundary turns are
+    kept. The boundary of a free region has a positive signed area (see signed_area), the boundary of an obstacle
+    inside one has a negative area. The grid must not have pinches (see remove_pinches), otherwise boundaries can touch.
+    :param grid: A (width, height) boolean array, True where blocked. Everything outside the grid counts as blocked
+    :return: One (n, 2) int array of vertices per boundary
+    """
+    width, height = grid.shape
+    padded = np.ones((width + 2, height + 2), dtype=bool)
+    padded[1:-1, 1:-1] = grid
+    free = ~padded[1:-1, 1:-1]
+    column_count = height + 1
+
+    # directed edges with the free cell on the same side every time: (cells, start offset, end offset)
+    sides = (
+        (free & padded[1:-1, :-2], (0, 0), (1, 0)),  # blocked above
+        (free & padded[2:, 1:-1], (1, 0), (1, 1)),  # blocked to the right
+        (free & padded[1:-1, 2:], (1, 1), (0, 1)),  # blocked below
+        (free & padded[:-2, 1:-1], (0, 1), (0, 0)),  # blocked to the left
+    )
+    next_vertex = np.full((width + 1) * column_count, -1, dtype=np.int64)
+    for cells, (start_x, start_y), (end_x, end_y) in sides:
+        xs, ys = np.nonzero(cells)
+        next_vertex[(xs + start_x) * column_count + ys + start_y] = (xs + end_x) * column_count + ys + end_y
+
+    contours = []
+    remaining = next_vertex.copy()
+    next_list = next_vertex.tolist()
+    for start in np.flatnonzero(remaining >= 0).tolist():
+        if remaining[start] < 0:
+            continue
+        loop = [start]
+        vertex = next_list[start]
+        while vertex != start:
+            loop.append(vertex)
+            vertex = next_list[vertex]
+        loop = np.array(loop)
+        remaining[loop] = -1
+        points = np.stack(np.divmod(loop, column_count), axis=1)
+        # keeps the corners only
+        incoming = points - np.roll(points, 1, axis=0)
+        outgoing = np.roll(points, -1, axis=0) - points
+        corners = (incoming[:, 0] * outgoing[:, 1] - incoming[:, 1] * outgoing[:, 0]) != 0
+        contours.append(points[corners])
+    return contours
+
+
+def signed_area(points: np.ndarray) -> float:
+    """The shoelace area of a closed polygon, positive when it goes clockwise on screen (y pointing down)"""
+    x, y = points[:, 0].astype(np.float64), points[:, 1].astype(np.float64)
+    return float(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) / 2)
+
+
+def contains_point(polygon: np.ndarray, x: float, y: float) -> bool:
+    """Even-odd point in polygon test"""
+    x0, y0 = polygon[:, 0].astype(np.float64), polygon[:, 1].astype(np.float64)
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    crosses = (y0 > y) != (y1 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_x = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.count_nonzero(crosses & (x < crossing_x)) % 2)
+
+
+def _simplify_open(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker on an open polyline, returns a bool array of the points to keep"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = points[first].astype(np.float64)
+        direction = points[last] - start
+        middle = points[first + 1:last] - start
+        length = np.hypot(*direction)
+        if length == 0:
+            distances = np.hypot(middle[:, 0], middle[:, 1])
+        else:
+            distances = np.abs(direction[0] * middle[:, 1] - direction[1] * middle[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def simplify_contour(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of a closed contour: no original vertex ends up further than tolerance from the
+    simplified contour.
+    :param points: An (n, 2) array of vertices
+    :param tolerance: The maximum distance, in the units of the points
+    :return: A bool array, True for the vertices to keep. At least 3 are kept if the contour has 3
+    """
+    count = len(points)
+    if count <= 3:
+        return np.ones(count, dtype=bool)
+    # split the loop at the vertex furthest from the first one, so both halves are open polylines
+    far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+    keep = np.zeros(count, dtype=bool)
+    keep[:far + 1] = _simplify_open(points[:far + 1], tolerance)
+    keep[far:] |= _simplify_open(np.concatenate([points[far:], points[:1]]), tolerance)[:-1]
+    if np.count_nonzero(keep) < 3:
+        # a tiny contour, make sure it stays a polygon by also keeping the vertex furthest from the other two
+        kept = points[keep].astype(np.float64)
+        direction = kept[1] - kept[0]
+        offsets = points - kept[0]
+        keep[int(np.argmax(np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0])))] = True
+    return keep
+
+
+def _segments_cross(p1, q1, p2, q2) -> bool:
+    """True if two segments share any point, including touching"""
+    def orientation(a, b, c):
+        value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (value > 0) - (value < 0)
+
+    def on_segment(a, b, c):  # b on segment ac, given that they're collinear
+        return min(a[0], c[0]) <= b[0] <= max(a[0], c[0]) and min(a[1], c[1]) <= b[1] <= max(a[1], c[1])
+
+    o1, o2 = orientation(p1, q1, p2), orientation(p1, q1, q2)
+    o3, o4 = orientation(p2, q2, p1), orientation(p2, q2, q1)
+    if o1 != o2 and o3 != o4:
+        return True
+    return (o1 == 0 and on_segment(p1, p2, q1)) or (o2 == 0 and on_segment(p1, q2, q1)) or \
+        (o3 == 0 and on_segment(p2, p1, q2)) or (o4 == 0 and on_segment(p2, q1, q2))
+
+
+def simplify_contours(contours: list[np.ndarray], tolerance: float, bucket_size: int = 32) -> list[np.ndarray]:
+    """
+    Simplifies a set of non-touching contours (see trace_contours) so they still don't touch.
+    Each contour is simplified on its own, then every simplified segment that crosses or touches another segment gets
+    its original vertices back, until nothing crosses.
+    :param contours: The contours, (n, 2) int arrays
+    :param tolerance: See simplify_contour
+    :param bucket_size: The size of the grid buckets used to find segments that might cross
+    :return: The simplified contours
+    """
+    keeps = [simplify_contour(contour, tolerance) for contour in contours]
+    vertices = [contour.tolist() for contour in contours]  # python ints are a lot faster one at a time
+    while True:
+        # (contour, first vertex, last vertex) of every simplified segment, bucketed by bounding box
+        segments = []
+        buckets: dict[tuple[int, int], list[int]] = {}
+        for contour_index, (contour, keep) in enumerate(zip(contours, keeps)):
+            kept = np.flatnonzero(keep).tolist()
+            for first, last in zip(kept, kept[1:] + kept[:1]):
+                a, b = vertices[contour_index][first], vertices[contour_index][last]
+                segment = len(segments)
+                segments.append((contour_index, first, last))
+                for bucket_x in range(min(a[0], b[0]) // bucket_size, max(a[0], b[0]) // bucket_size + 1):
+                    for bucket_y in range(min(a[1], b[1]) // bucket_size, max(a[1], b[1]) // bucket_size + 1):
+                        buckets.setdefault((bucket_x, bucket_y), []).append(segment)
+
+        conflicts = set()
+        checked = set()
+        for bucket in buckets.values():
+            for i, first_segment in enumerate(bucket):
+                contour_a, first_a, last_a = segments[first_segment]
+                for second_segment in bucket[i + 1:]:
+                    pair = (first_segment, second_segment)
+                    if pair in checked:
+                        continue
+                    checked.add(pair)
+                    contour_b, first_b, last_b = segments[second_segment]
+                    shared = contour_a == contour_b and {first_a, last_a} & {first_b, last_b}
+                    if shared:
+                        # neighbouring segments share a vertex, they only conflict if they overlap
+                        if len({first_a, last_a, first_b, last_b}) > 2:
+                            continue
+                    a1, a2 = vertices[contour_a][first_a], vertices[contour_a][last_a]
+                    b1, b2 = vertices[contour_b][first_b], vertices[contour_b][last_b]
+                    if _segments_cross(a1, a2, b1, b2):
+                        conflicts.update(pair)
+        if not conflicts:
+            break
+
+        progress = False
+        for segment in conflicts:
+            contour_index, first, last = segments[segment]
+            keep = keeps[contour_index]
+            span = np.arange(first, last + 1) if first < last else \
+                np.concatenate([np.arange(first, len(keep)), np.arange(0, last + 1)])
+            progress |= not keep[span].all()
+            keep[span] = True
+        if not progress:
+            break  # only original segments are left, which never cross
+    return [contour[keep] for contour, keep in zip(contours, keeps)]
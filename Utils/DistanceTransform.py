@@ -0,0 +1,69 @@
+import numpy as np
+
+# how many rows (along x) are processed together in the second pass, and how often a block re-checks which of its
+# cells can still get closer to an obstacle
+_BLOCK_SIZE = 32
+_RECHECK_EVERY = 8
+
+
+def _row_distances(grid: np.ndarray) -> np.ndarray:
+    """
+    For every cell, the distance along the x axis to the nearest set cell in the same row (inf if the row is empty)
+    """
+    width = grid.shape[0]
+    x = np.arange(width, dtype=np.float64)[:, None]
+    previous = np.maximum.accumulate(np.where(grid, x, -np.inf), axis=0)
+    following = np.minimum.accumulate(np.where(grid, x, np.inf)[::-1], axis=0)[::-1]
+    return np.minimum(x - previous, following - x).astype(np.float32)
+
+
+def distance_transform(grid: np.ndarray, metric: str = "euclidean") -> np.ndarray:
+    """
+    Computes the exact distance from every cell to the nearest set cell of the grid (0 on set cells).
+
+    The transform is separable: the first pass finds the nearest set cell along each row, the second combines rows by
+    trying every vertical offset k. The second pass works on blocks of rows, and a block stops (or narrows down to the
+    cells that can still improve) as soon as k is larger than the distances left in it, so the cost depends on how
+    far cells are from obstacles rather than on the size of the grid.
+    :param grid: A (width, height) boolean array (see Utils.Occupancy.mask_to_grid)
+    :param metric: "euclidean" or "chebyshev" (max(|dx|, |dy|), the distance a square margin grows by)
+    :return: A float32 array the same shape as the grid. Cells are inf if the grid has no set cells
+    """
+    if metric not in ("euclidean", "chebyshev"):
+        raise ValueError("metric must be either 'euclidean' or 'chebyshev'")
+    euclidean = metric == "euclidean"
+
+    row_distances = _row_distances(np.asarray(grid, dtype=bool))
+    if euclidean:
+        row_distances **= 2  # works on squared distances, so combining rows is just an addition
+    distances = row_distances.copy()
+    width, height = distances.shape
+
+    for x in range(0, width, _BLOCK_SIZE):
+        block = distances[x:x + _BLOCK_SIZE]
+        block_rows = row_distances[x:x + _BLOCK_SIZE]
+        low = high = 0
+        for k in range(1, height):
+            offset_cost = np.float32(k * k if euclidean else k)
+            if (k - 1) % _RECHECK_EVERY == 0:
+                # only cells further than the offset can still get closer
+                improvable = np.flatnonzero((block > offset_cost).any(axis=0))
+                if improvable.size == 0:
+                    break
+                low, high = improvable[0], improvable[-1] + 1
+
+            # candidates from the row k cells above, then from the row k cells below
+            start = max(low, k)
+            if start < high:
+                candidates = block_rows[:, start - k:high - k]
+                candidates = candidates + offset_cost if euclidean else np.maximum(candidates, offset_cost)
+                np.minimum(block[:, start:high], candidates, out=block[:, start:high])
+            end = min(high, height - k)
+            if low < end:
+                candidates = block_rows[:, low + k:end + k]
+                candidates = candidates + offset_cost if euclidean else np.maximum(candidates, offset_cost)
+                np.minimum(block[:, low:end], candidates, out=block[:, low:end])
+
+    if euclidean:
+        np.sqrt(distances, out=distances)
+    return distances
@@ -0,0 +1,267 @@
+"""
+Counters, timers, rolling histograms and per-frame spans, for finding out where the time goes.
+
+Everything goes through the shared `instrumentation` object. It starts disabled, and while it's disabled every call
+returns straight away without recording anything. Hot paths check `instrumentation.enabled` first, so that they don't
+even build the arguments:
+
+    if instrumentation.enabled:
+        instrumentation.count("ray_cast.rays")
+
+The results can be exported with to_json or to_csv. Recording is thread safe: the planning service's workers report
+into the same object as the frame loop.
+"""
+import csv
+import json
+import threading
+import time
+from collections import deque
+
+
+class _Timer:
+    """Adds the time spent inside a with block to a timer"""
+    __slots__ = ("instrumentation", "name", "start_time")
+
+    def __init__(self, instrumentation: "Instrumentation", name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start_time)
+
+
+class _NullTimer:
+    """What timer returns while instrumentation is disabled"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Instrumentation:
+    """
+    Collects:
+    - counters: named totals (nodes expanded, rays cast, cache hits...)
+    - timers: how many times something ran and how long it took (total, min, max)
+    - histograms: the last histogram_size values of something, for percentiles
+    - frames: for each of the last frame_history frames (see begin_frame), the time of each timer inside it
+    - events: the last event_history messages, instead of printing them
+    """
+
+    def __init__(self, enabled: bool = False, histogram_size: int = 1000, frame_history: int = 300,
+                 event_history: int = 1000):
+        self.enabled = enabled
+        self.histogram_size = histogram_size
+        self.counters: dict[str, float] = {}
+        # name -> [calls, total seconds, min seconds, max seconds]
+        self.timers: dict[str, list[float]] = {}
+        self.histograms: dict[str, deque] = {}
+        self.frames: deque[dict[str, float]] = deque(maxlen=frame_history)
+        self.events: deque[tuple[float, str, str]] = deque(maxlen=event_history)
+        self.frame_count = 0
+        self._frame: dict[str, float] | None = None
+        self._frame_start_time = 0.0
+        # the thread that began the current frame. only its timers are the frame's, a worker's don't run inside it
+        self._frame_thread: int | None = None
+        # held while recording or reading, workers record from their own threads
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+        with self._lock:
+            self._frame = None
+
+    def reset(self) -> None:
+        """Forgets everything recorded so far"""
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+            self.histograms.clear()
+            self.frames.clear()
+            self.events.clear()
+            self.frame_count = 0
+            self._frame = None
+
+    def count(self, name: str, amount: float = 1) -> None:
+        """Adds to a counter"""
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float) -> None:
+        """Adds a value to a rolling histogram"""
+        if self.enabled:
+            with self._lock:
+                self._observe(name, value)
+
+    def _observe(self, name: str, value: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = deque(maxlen=self.histogram_size)
+        histogram.append(value)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """Records one run of a timer. Also adds it to the current frame, if there is one and this is its thread"""
+        if not self.enabled:
+            return
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds < timer[2]:
+                    timer[2] = seconds
+                if seconds > timer[3]:
+                    timer[3] = seconds
+            frame = self._frame
+            if frame is not None and self._frame_thread == threading.get_ident():
+                frame[name] = frame.get(name, 0.0) + seconds
+
+    def timer(self, name: str):
+        """
+        Times a with block:
+            with instrumentation.timer("path_find"):
+                ...
+        :param name: The timer to add the time to
+        :return: The context manager
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def event(self, name: str, message: str = "") -> None:
+        """Records something that happened, with the time it happened"""
+        if self.enabled:
+            with self._lock:
+                self.events.append((time.time(), name, message))
+
+    def begin_frame(self) -> None:
+        """Starts a frame: until end_frame, every timer on this thread is also added to this frame's spans"""
+        if self.enabled:
+            with self._lock:
+                self._frame = {}
+                self._frame_thread = threading.get_ident()
+                self._frame_start_time = time.perf_counter()
+
+    def end_frame(self) -> None:
+        """Ends the current frame, recording how long it took as the "frame" span and histogram"""
+        if not self.enabled:
+            return
+        with self._lock:
+            frame = self._frame
+            if frame is None:
+                return
+            self._frame = None
+            frame["frame"] = time.perf_counter() - self._frame_start_time
+            self.frames.append(frame)
+            self.frame_count += 1
+            self._observe("frame", frame["frame"])
+
+    def histogram_stats(self, name: str) -> dict:
+        """
+        :param name: The histogram
+        :return: The count, mean, min, max and 50th, 90th and 99th percentiles of the values it has now
+        """
+        with self._lock:
+            values = sorted(self.histograms.get(name, ()))
+        if not values:
+            return {"count": 0}
+
+        def percentile(fraction: float) -> float:
+            return values[min(len(values) - 1, int(fraction * len(values)))]
+
+        return {"count": len(values), "mean": sum(values) / len(values), "min": values[0], "max": values[-1],
+                "p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99)}
+
+    def snapshot(self) -> dict:
+        """
+        :return: Everything recorded, as plain lists and dicts
+        """
+        # copied under the lock, workers can add new names while this runs
+        with self._lock:
+            frames = [dict(frame) for frame in self.frames]
+            counters = dict(self.counters)
+            timers = {name: list(timer) for name, timer in self.timers.items()}
+            histogram_names = list(self.histograms)
+            frame_count = self.frame_count
+            events = list(self.events)
+        spans: dict[str, list[float]] = {}
+        for frame in frames:
+            for name, seconds in frame.items():
+                spans.setdefault(name, []).append(seconds)
+        return {
+            "counters": counters,
+            "timers": {name: {"calls": calls, "total": total, "mean": total / calls, "min": low, "max": high}
+                       for name, (calls, total, low, high) in timers.items()},
+            "histograms": {name: self.histogram_stats(name) for name in histogram_names},
+            # the mean time per frame of everything timed inside frames, over the frames that are kept
+            "frames": {"count": frame_count, "kept": len(frames),
+                       "mean_spans": {name: sum(times) / len(frames) for name, times in spans.items()}},
+            "events": [{"time": at, "name": name, "message": message} for at, name, message in events],
+        }
+
+    def to_json(self, filename: str = None) -> str:
+        """
+        :param filename: Where to write it, if anywhere
+        :return: The snapshot as JSON
+        """
+        text = json.dumps(self.snapshot(), indent=2)
+        if filename is not None:
+            with open(filename, "w") as fout:
+                fout.write(text)
+        return text
+
+    def to_csv(self, filename: str) -> None:
+        """
+        Writes the counters, timers, histograms and mean frame spans as rows of (kind, name, field, value)
+        :param filename: Where to write it
+        :return:
+        """
+        snapshot = self.snapshot()
+        with open(filename, "w", newline="") as fout:
+            writer = csv.writer(fout)
+            writer.writerow(["kind", "name", "field", "value"])
+            for name, value in snapshot["counters"].items():
+                writer.writerow(["counter", name, "value", value])
+            for kind in ("timers", "histograms"):
+                for name, fields in snapshot[kind].items():
+                    for field, value in fields.items():
+                        writer.writerow([kind[:-1], name, field, value])
+            for name, value in snapshot["frames"]["mean_spans"].items():
+                writer.writerow(["span", name, "mean", value])
+
+    def report(self) -> str:
+        """A short human readable summary of the timers and counters"""
+        with self._lock:
+            timers = [(name, list(timer)) for name, timer in self.timers.items()]
+            counters = list(self.counters.items())
+        lines = []
+        for name, (calls, total, low, high) in sorted(timers, key=lambda item: -item[1][1]):
+            lines.append(f"{name}: {calls} calls, {total * 1000:.2f} ms total, {total / calls * 1000:.3f} ms mean, "
+                         f"{high * 1000:.3f} ms max")
+        for name, value in sorted(counters):
+            lines.append(f"{name}: {value}")
+        frame = self.histogram_stats("frame")
+        if frame["count"]:
+            lines.append(f"frame: {frame['mean'] * 1000:.2f} ms mean, {frame['p99'] * 1000:.2f} ms p99")
+        return "\n".join(lines)
+
+
+# shared by everything, see the module docstring
+instrumentation = Instrumentation()
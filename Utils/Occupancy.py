@@ -0,0 +1,26 @@
+import numpy as np
+import pygame
+
+
+def mask_to_grid(mask: pygame.mask.Mask) -> np.ndarray:
+    """
+    Converts a pygame mask into a boolean occupancy grid.
+    The grid is indexed like the mask, so grid[x, y] == mask.get_at((x, y))
+    :param mask: The mask to convert
+    :return: A (width, height) boolean array that is True where the mask is set
+    """
+    surface = mask.to_surface(setcolor=(255, 255, 255, 255), unsetcolor=(0, 0, 0, 0))
+    return pygame.surfarray.array_alpha(surface) > 0
+
+
+def grid_to_mask(grid: np.ndarray) -> pygame.mask.Mask:
+    """
+    Converts a boolean occupancy grid (indexed grid[x, y]) back into a pygame mask
+    :param grid: The grid to convert
+    :return: A mask that is set wherever the grid is True
+    """
+    surface = pygame.Surface(grid.shape, pygame.SRCALPHA)
+    alpha = pygame.surfarray.pixels_alpha(surface)
+    alpha[...] = np.where(grid, 255, 0)
+    del alpha  # unlocks the surface
+    return pygame.mask.from_surface(surface)
@@ -6,11 +6,26 @@ from Utils.Translation import Translation
 class Position(Translation):
     """A Translation with a rotation
     x and y are the position the robot's centers,
-    rotation is the rotation of the robot in degrees on a unit circle"""
+    rotation is the rotation of the robot in degrees on a unit circle
+    Like Translation, the in place operators change the position itself (and every reference to it), and it hashes by
+    value, so one that is a dict key or in a set mustn't be changed"""
+    __slots__ = ("rotation",)
 
     def __init__(self, x, y, rotation: float | Rotation = Rotation(0)):
-        super().__init__(x, y)
-        self.rotation = Rotation(rotation)  # in degrees
+        self.x = x
+        self.y = y
+        # in degrees. rotations are immutable, so one that already is a Rotation is kept as is
+        self.rotation = rotation if type(rotation) is Rotation else Rotation(rotation)
+
+    def copy(self):
+        return Position(self.x, self.y, self.rotation)
+
+    def add_scaled(self, other: "Position", scale: float):
+        """self += other * scale, without making the other * scale Position in between"""
+        self.x += other.x * scale
+        self.y += other.y * scale
+        self.rotation = self.rotation + other.rotation * scale
+        return self
 
     def get_rotation_difference(self, other):
         return Rotation.distance_to(self.rotation, other.rotation)
@@ -35,8 +50,9 @@ class Position(Translation):
 
             scale = min(other.as_list()[:2]) / max(this.as_list()[:2])
         elif isinstance(scale, float) or isinstance(scale, int):
-            if not self.get_distance_to(Position(0, 0)) == 0:
-                scale = scale / self.get_distance_to(Position(0, 0))
+            norm = self.norm()
+            if not norm == 0:
+                scale = scale / norm
             else:
                 scale = 0
         else:
@@ -86,6 +102,66 @@ class Position(Translation):
         else:
             raise TypeError(f"other must be a float, int, or Position, not {type(other)}")
 
+    # in place versions of the operators above, see Translation. the rotation is rewrapped like the constructor does,
+    # only + and - of a Rotation return one
+
+    def __iadd__(self, other: "float | int | Position"):
+        if isinstance(other, float) or isinstance(other, int):
+            self.x += other
+            self.y += other
+            self.rotation = self.rotation + other
+        elif isinstance(other, Position):
+            self.x += other.x
+            self.y += other.y
+            self.rotation = self.rotation + other.rotation
+        else:
+            raise TypeError(f"other must be a float, int, or Position, not {type(other)}")
+        return self
+
+    def __isub__(self, other: "float | int | Position"):
+        if isinstance(other, float) or isinstance(other, int):
+            self.x -= other
+            self.y -= other
+            self.rotation = self.rotation - other
+        elif isinstance(other, Position):
+            self.x -= other.x
+            self.y -= other.y
+            self.rotation = self.rotation - other.rotation
+        else:
+            raise TypeError(f"other must be a float, int, or Position, not {type(other)}")
+        return self
+
+    def __imul__(self, other: "float | int | Position"):
+        if isinstance(other, float) or isinstance(other, int):
+            self.x *= other
+            self.y *= other
+            self.rotation = Rotation(self.rotation * other)
+        elif isinstance(other, Position):
+            self.x *= other.x
+            self.y *= other.y
+            self.rotation = Rotation(self.rotation * other.rotation)
+        else:
+            raise TypeError(f"other must be a float, int, or Position, not {type(other)}")
+        return self
+
+    def __itruediv__(self, other: "float | int | Position"):
+        if isinstance(other, float) or isinstance(other, int):
+            self.x /= other
+            self.y /= other
+            self.rotation = Rotation(self.rotation / other)
+        elif isinstance(other, Position):
+            self.x /= other.x
+            self.y /= other.y
+            self.rotation = Rotation(self.rotation / other.rotation)
+        else:
+            raise TypeError(f"other must be a float, int, or Position, not {type(other)}")
+        return self
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+        yield self.rotation
+
     def __getitem__(self, item):
         if item == 2:
             return self.rotation
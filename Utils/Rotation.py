@@ -5,6 +5,8 @@ class Rotation(float):
     """
     Used for: Rotation calculations. Based on a unit circle, but in degrees (0 is right, 90 is up, etc.)
     """
+    __slots__ = ()
+
     @staticmethod
     def distance_to(a, b):
         return Rotation((float(a) - float(b) + 180) % 360 - 180)
@@ -2,16 +2,45 @@ import math
 
 
 class Translation:
+    """
+    An (x, y) pair.
+    The in place operators (+=, -=, *=, /=) change the object itself, so every reference to it sees the change. It
+    hashes by value, so one that is a dict key or in a set mustn't be changed, or it can't be found anymore. Use the
+    plain operators (a = a + b) or copy it first for those
+    """
+    # no instance dict: these are made and thrown away on every hot path, slots make them smaller and faster
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
 
+    @classmethod
+    def from_xy(cls, xy):
+        """Makes one from any (x, y) pair: a tuple, a list, a numpy row..."""
+        x, y = xy[0], xy[1]
+        return cls(x, y)
+
     def get_distance_to(self, other):
-        return math.sqrt((self.x - other.x)**2 + (self.y - other.y)**2)
+        return math.hypot(self.x - other.x, self.y - other.y)
+
+    def norm(self) -> float:
+        """The distance to the origin, without making a Position(0, 0) to measure from"""
+        return math.hypot(self.x, self.y)
+
+    def copy(self):
+        return Translation(self.x, self.y)
 
     def as_list(self):
         return [self.x, self.y]
 
+    def as_xy(self) -> tuple:
+        return self.x, self.y
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
     def __add__(self, other):
         return Translation(self.x + other.x, self.y + other.y)
 
@@ -24,6 +53,28 @@ class Translation:
     def __truediv__(self, other):
         return Translation(self.x / other, self.y / other)
 
+    # the in place operators change this object instead of making a new one, so a += b changes every reference to a
+
+    def __iadd__(self, other):
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def __isub__(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def __imul__(self, other):
+        self.x *= other
+        self.y *= other
+        return self
+
+    def __itruediv__(self, other):
+        self.x /= other
+        self.y /= other
+        return self
+
     def __str__(self):
         return f"({self.x}, {self.y})"
 
@@ -0,0 +1,419 @@
+"""
+Triangulation of polygons with holes.
+
+triangulate_polygon is ear clipping in the style of mapbox's earcut: the vertices live in a circular doubly linked
+list, holes are joined to the outer ring by bridge edges, and an ear (a convex vertex whose triangle has no other
+vertex in it) is clipped until only a triangle is left. When no ear can be found (which only happens with bad input),
+it tries filtering degenerate vertices, curing local self intersections, and finally splitting the polygon in two.
+Ear checks look up vertices in a bucket grid instead of walking the whole polygon.
+
+make_delaunay then flips edges until the triangulation is constrained Delaunay: no triangle has a vertex it can see
+inside its circumcircle, so there are as few thin slivers as the polygon allows.
+"""
+from math import floor
+
+
+class _Node:
+    __slots__ = ("i", "x", "y", "prev", "next", "steiner", "removed", "ring")
+
+    def __init__(self, i: int, x: float, y: float, ring: int = 0):
+        self.i = i
+        self.x = x
+        self.y = y
+        self.prev: _Node = None
+        self.next: _Node = None
+        self.steiner = False
+        self.removed = False
+        self.ring = ring  # which ring the node is on, so ear checks can skip the buckets' nodes from other rings
+
+
+def _area(p: _Node, q: _Node, r: _Node) -> float:
+    """Twice the signed area of the triangle pqr. Negative for the convex (ear) side of the rings built here"""
+    return (q.y - p.y) * (r.x - q.x) - (q.x - p.x) * (r.y - q.y)
+
+
+def _equals(a: _Node, b: _Node) -> bool:
+    return a.x == b.x and a.y == b.y
+
+
+def _point_in_triangle(ax, ay, bx, by, cx, cy, px, py) -> bool:
+    return (cx - px) * (ay - py) >= (ax - px) * (cy - py) and \
+        (ax - px) * (by - py) >= (bx - px) * (ay - py) and \
+        (bx - px) * (cy - py) >= (cx - px) * (by - py)
+
+
+def _sign(x: float) -> int:
+    return (x > 0) - (x < 0)
+
+
+def _on_segment(p: _Node, q: _Node, r: _Node) -> bool:
+    return min(p.x, r.x) <= q.x <= max(p.x, r.x) and min(p.y, r.y) <= q.y <= max(p.y, r.y)
+
+
+def _intersects(p1: _Node, q1: _Node, p2: _Node, q2: _Node) -> bool:
+    o1, o2 = _sign(_area(p1, q1, p2)), _sign(_area(p1, q1, q2))
+    o3, o4 = _sign(_area(p2, q2, p1)), _sign(_area(p2, q2, q1))
+    if o1 != o2 and o3 != o4:
+        return True
+    return (o1 == 0 and _on_segment(p1, p2, q1)) or (o2 == 0 and _on_segment(p1, q2, q1)) or \
+        (o3 == 0 and _on_segment(p2, p1, q2)) or (o4 == 0 and _on_segment(p2, q1, q2))
+
+
+def _locally_inside(a: _Node, b: _Node) -> bool:
+    """Checks if the diagonal ab starts off inside the polygon at a"""
+    if _area(a.prev, a, a.next) < 0:
+        return _area(a, b, a.next) >= 0 and _area(a, a.prev, b) >= 0
+    return _area(a, b, a.prev) < 0 or _area(a, a.next, b) < 0
+
+
+def _middle_inside(a: _Node, b: _Node) -> bool:
+    p = a
+    inside = False
+    px, py = (a.x + b.x) / 2, (a.y + b.y) / 2
+    while True:
+        if (p.y > py) != (p.next.y > py) and p.next.y != p.y and \
+                px < (p.next.x - p.x) * (py - p.y) / (p.next.y - p.y) + p.x:
+            inside = not inside
+        p = p.next
+        if p is a:
+            return inside
+
+
+def _intersects_polygon(a: _Node, b: _Node) -> bool:
+    p = a
+    while True:
+        if p.i != a.i and p.next.i != a.i and p.i != b.i and p.next.i != b.i and _intersects(p, p.next, a, b):
+            return True
+        p = p.next
+        if p is a:
+            return False
+
+
+def _sector_contains_sector(m: _Node, p: _Node) -> bool:
+    return _area(m.prev, m, p.prev) < 0 and _area(p.next, m, m.next) < 0
+
+
+def _is_valid_diagonal(a: _Node, b: _Node) -> bool:
+    if a.next.i == b.i or a.prev.i == b.i or _intersects_polygon(a, b):
+        return False
+    if _locally_inside(a, b) and _locally_inside(b, a) and _middle_inside(a, b) and \
+            (_area(a.prev, a, b.prev) or _area(a, b.prev, b)):
+        return True
+    return _equals(a, b) and _area(a.prev, a, a.next) > 0 and _area(b.prev, b, b.next) > 0
+
+
+class _Triangulator:
+    def __init__(self, bucket_size: float):
+        self.bucket_size = bucket_size
+        self.buckets: dict[tuple[int, int], list[_Node]] = {}
+        self.triangles: list[tuple[int, int, int]] = []
+        self._ring_count = 1
+
+    def _bucket(self, x: float, y: float) -> tuple[int, int]:
+        return floor(x / self.bucket_size), floor(y / self.bucket_size)
+
+    def _insert_node(self, i: int, x: float, y: float, last: _Node | None) -> _Node:
+        p = _Node(i, x, y)
+        if last is None:
+            p.prev = p.next = p
+        else:
+            p.next = last.next
+            p.prev = last
+            last.next.prev = p
+            last.next = p
+        self.buckets.setdefault(self._bucket(x, y), []).append(p)
+        return p
+
+    @staticmethod
+    def _remove_node(p: _Node) -> None:
+        p.next.prev = p.prev
+        p.prev.next = p.next
+        p.removed = True
+
+    def _split_polygon(self, a: _Node, b: _Node) -> _Node:
+        """Joins a and b with a diagonal, splitting the ring in two. Returns the copy of b on the second ring"""
+        a2 = _Node(a.i, a.x, a.y, a.ring)
+        b2 = _Node(b.i, b.x, b.y, b.ring)
+        an, bp = a.next, b.prev
+        a.next = b
+        b.prev = a
+        a2.next = an
+        an.prev = a2
+        b2.next = a2
+        a2.prev = b2
+        bp.next = b2
+        b2.prev = bp
+        self.buckets.setdefault(self._bucket(a2.x, a2.y), []).append(a2)
+        self.buckets.setdefault(self._bucket(b2.x, b2.y), []).append(b2)
+        return b2
+
+    def _new_ring(self, start: _Node) -> None:
+        """Gives every node of start's ring a new ring id"""
+        ring = self._ring_count
+        self._ring_count += 1
+        p = start
+        while True:
+            p.ring = ring
+            p = p.next
+            if p is start:
+                return
+
+    def linked_list(self, ring: list[tuple[int, float, float]], clockwise: bool) -> _Node | None:
+        """Makes a ring of nodes from (index, x, y) vertices, in the given winding"""
+        area = 0.0
+        for (_, x0, y0), (_, x1, y1) in zip(ring[-1:] + ring[:-1], ring):
+            area += (x0 - x1) * (y1 + y0)
+        last = None
+        for i, x, y in (ring if clockwise == (area > 0) else ring[::-1]):
+            last = self._insert_node(i, x, y, last)
+        if last is not None and _equals(last, last.next):
+            self._remove_node(last)
+            last = last.next
+        return last
+
+    def filter_points(self, start: _Node | None, end: _Node = None) -> _Node | None:
+        """Removes duplicate and collinear vertices"""
+        if start is None:
+            return start
+        if end is None:
+            end = start
+        p = start
+        while True:
+            again = False
+            if not p.steiner and (_equals(p, p.next) or _area(p.prev, p, p.next) == 0):
+                self._remove_node(p)
+                p = end = p.prev
+                if p is p.next:
+                    break
+                again = True
+            else:
+                p = p.next
+            if not again and p is end:
+                break
+        return end
+
+    def _is_ear(self, ear: _Node) -> bool:
+        a, b, c = ear.prev, ear, ear.next
+        if _area(a, b, c) >= 0:
+            return False  # reflex
+        min_x, max_x = min(a.x, b.x, c.x), max(a.x, b.x, c.x)
+        min_y, max_y = min(a.y, b.y, c.y), max(a.y, b.y, c.y)
+        low_x, low_y = self._bucket(min_x, min_y)
+        high_x, high_y = self._bucket(max_x, max_y)
+        for bucket_x in range(low_x, high_x + 1):
+            for bucket_y in range(low_y, high_y + 1):
+                for p in self.buckets.get((bucket_x, bucket_y), ()):
+                    if p.removed or p.ring != b.ring or p is a or p is c:
+                        continue
+                    if min_x <= p.x <= max_x and min_y <= p.y <= max_y and \
+                            _point_in_triangle(a.x, a.y, b.x, b.y, c.x, c.y, p.x, p.y) and \
+                            _area(p.prev, p, p.next) >= 0:
+                        return False
+        return True
+
+    def _cure_local_intersections(self, start: _Node) -> _Node:
+        p = start
+        while True:
+            a, b = p.prev, p.next.next
+            if not _equals(a, b) and _intersects(a, p, p.next, b) and _locally_inside(a, b) and \
+                    _locally_inside(b, a):
+                self.triangles.append((a.i, p.i, b.i))
+                self._remove_node(p)
+                self._remove_node(p.next)
+                p = start = b
+            p = p.next
+            if p is start:
+                break
+        return self.filter_points(p)
+
+    def _split_earcut(self, start: _Node) -> None:
+        a = start
+        while True:
+            b = a.next.next
+            while b is not a.prev:
+                if a.i != b.i and _is_valid_diagonal(a, b):
+                    c = self._split_polygon(a, b)
+                    a = self.filter_points(a, a.next)
+                    c = self.filter_points(c, c.next)
+                    self._new_ring(c)
+                    self.earcut_linked(a)
+                    self.earcut_linked(c)
+                    return
+                b = b.next
+            a = a.next
+            if a is start:
+                return
+
+    def earcut_linked(self, ear: _Node | None, attempt: int = 0) -> None:
+        if ear is None:
+            return
+        stop = ear
+        while ear.prev is not ear.next:
+            prev, following = ear.prev, ear.next
+            if self._is_ear(ear):
+                self.triangles.append((prev.i, ear.i, following.i))
+                self._remove_node(ear)
+                ear = stop = following.next
+                continue
+            ear = following
+            if ear is stop:
+                # went all the way round without finding an ear
+                if attempt == 0:
+                    self.earcut_linked(self.filter_points(ear), 1)
+                elif attempt == 1:
+                    self.earcut_linked(self._cure_local_intersections(self.filter_points(ear)), 2)
+                else:
+                    self._split_earcut(ear)
+                break
+
+    def _find_hole_bridge(self, hole: _Node, outer: _Node) -> _Node | None:
+        """Finds a vertex of the outer ring that the leftmost vertex of a hole can be joined to"""
+        p = outer
+        hx, hy = hole.x, hole.y
+        qx = float("-inf")
+        m = None
+        # the nearest segment to the left of the hole's vertex
+        while True:
+            if p.y >= hy >= p.next.y != p.y:
+                x = p.x + (hy - p.y) * (p.next.x - p.x) / (p.next.y - p.y)
+                if qx < x <= hx:
+                    qx = x
+                    m = p if p.x < p.next.x else p.next
+                    if x == hx:
+                        return m  # the hole touches the segment
+            p = p.next
+            if p is outer:
+                break
+        if m is None:
+            return None
+
+        # the vertex of that segment may be hidden behind other vertices, pick the visible one at the smallest angle
+        stop = m
+        mx, my = m.x, m.y
+        tan_min = float("inf")
+        p = m
+        while True:
+            if hx >= p.x >= mx and hx != p.x and _point_in_triangle(
+                    hx if hy < my else qx, hy, mx, my, qx if hy < my else hx, hy, p.x, p.y):
+                tan = abs(hy - p.y) / (hx - p.x)
+                if _locally_inside(p, hole) and (tan < tan_min or (tan == tan_min and (
+                        p.x > m.x or (p.x == m.x and _sector_contains_sector(m, p))))):
+                    m = p
+                    tan_min = tan
+            p = p.next
+            if p is stop:
+                return m
+
+    def eliminate_holes(self, holes: list[_Node], outer: _Node) -> _Node:
+        def leftmost(start: _Node) -> _Node:
+            best = p = start
+            while True:
+                if p.x < best.x or (p.x == best.x and p.y < best.y):
+                    best = p
+                p = p.next
+                if p is start:
+                    return best
+
+        for hole in sorted((leftmost(hole) for hole in holes), key=lambda node: node.x):
+            bridge = self._find_hole_bridge(hole, outer)
+            if bridge is None:
+                continue
+            bridge_reverse = self._split_polygon(bridge, hole)
+            self.filter_points(bridge_reverse, bridge_reverse.next)
+            outer = self.filter_points(bridge, bridge.next)
+        return outer
+
+
+def _nudged(points: list[tuple[float, float]]) -> list[tuple[float, float]]:
+    """
+    Moves every point by a tiny amount, the same for the same index every time. Pixel corners are full of exactly
+    collinear vertices, which trip up the hole bridging and leave flat triangles; this breaks the ties without
+    changing anything else
+    """
+    return [(x + ((i * 2654435761) % 997 - 498) * 1e-9, y + ((i * 40503) % 991 - 495) * 1e-9)
+            for i, (x, y) in enumerate(points)]
+
+
+def triangulate_polygon(points: list[tuple[float, float]], rings: list[list[int]],
+                        bucket_size: float = 16) -> list[tuple[int, int, int]]:
+    """
+    Triangulates a polygon with holes.
+    :param points: The (x, y) of every vertex
+    :param rings: The outer ring first, then the holes, each a list of indices into points. Rings must not cross
+    :param bucket_size: The size of the buckets used to speed up ear checks, about the length of an edge works well
+    :return: (a, b, c) triangles of indices into points, all wound the same way
+    """
+    points = _nudged(points)
+    triangulator = _Triangulator(bucket_size)
+    outer = triangulator.linked_list([(i, *points[i]) for i in rings[0]], True)
+    if outer is None or outer.next is outer.prev:
+        return []
+    holes = []
+    for ring in rings[1:]:
+        hole = triangulator.linked_list([(i, *points[i]) for i in ring], False)
+        if hole is not None:
+            if hole is hole.next:
+                hole.steiner = True
+            holes.append(hole)
+    if holes:
+        outer = triangulator.eliminate_holes(holes, outer)
+    triangulator.earcut_linked(outer)
+    return triangulator.triangles
+
+
+def _in_circumcircle(a, b, c, d) -> bool:
+    """True if d is strictly inside the circumcircle of the counterclockwise (in x/y terms) triangle abc"""
+    adx, ady = a[0] - d[0], a[1] - d[1]
+    bdx, bdy = b[0] - d[0], b[1] - d[1]
+    cdx, cdy = c[0] - d[0], c[1] - d[1]
+    determinant = (adx * adx + ady * ady) * (bdx * cdy - cdx * bdy) - \
+        (bdx * bdx + bdy * bdy) * (adx * cdy - cdx * ady) + \
+        (cdx * cdx + cdy * cdy) * (adx * bdy - bdx * ady)
+    return determinant > 1e-9
+
+
+def _cross(o, a, b) -> float:
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def make_delaunay(points: list[tuple[float, float]], triangles: list[tuple[int, int, int]],
+                  constrained_edges: set[tuple[int, int]]) -> list[tuple[int, int, int]]:
+    """
+    Flips edges (Lawson's algorithm) until the triangulation is constrained Delaunay.
+    :param points: The (x, y) of every vertex
+    :param triangles: The triangles, all wound the same way
+    :param constrained_edges: (a, b) edges that must not be flipped, with a < b. Usually the polygon's boundary
+    :return: The new triangles, wound counterclockwise in x/y terms
+    """
+    points = _nudged(points)  # same as triangulate_polygon, so flat triangles can still be flipped away
+    triangles = [list(t) if _cross(*(points[i] for i in t)) > 0 else [t[0], t[2], t[1]] for t in triangles]
+    # directed edge -> the triangle it belongs to. every triangle is counterclockwise, so each edge is listed once
+    # per direction, and the other direction belongs to the triangle on the other side
+    edge_triangles = {}
+    for index, (a, b, c) in enumerate(triangles):
+        edge_triangles[(a, b)] = edge_triangles[(b, c)] = edge_triangles[(c, a)] = index
+
+    stack = [edge for edge in edge_triangles if edge[0] < edge[1]]
+    while stack:
+        a, b = stack.pop()
+        if (min(a, b), max(a, b)) in constrained_edges or (a, b) not in edge_triangles or \
+                (b, a) not in edge_triangles:
+            continue
+        first, second = edge_triangles[(a, b)], edge_triangles[(b, a)]
+        # the vertices opposite the edge: first is (a, b, c), second is (b, a, d)
+        c = next(i for i in triangles[first] if i != a and i != b)
+        d = next(i for i in triangles[second] if i != a and i != b)
+        pa, pb, pc, pd = points[a], points[b], points[c], points[d]
+        if not _in_circumcircle(pa, pb, pc, pd):
+            continue
+        # only flip if the quad is convex, so the new edge cd stays inside it
+        if _cross(pc, pa, pd) <= 0 or _cross(pd, pb, pc) <= 0:
+            continue
+        for edge in ((a, b), (b, a), (b, c), (c, a), (a, d), (d, b)):
+            edge_triangles.pop(edge, None)
+        triangles[first] = [c, a, d]
+        triangles[second] = [d, b, c]
+        edge_triangles[(c, a)] = edge_triangles[(a, d)] = edge_triangles[(d, c)] = first
+        edge_triangles[(d, b)] = edge_triangles[(b, c)] = edge_triangles[(c, d)] = second
+        stack.extend(((a, d), (d, b), (b, c), (c, a)))
+    return [tuple(t) for t in triangles]
@@ -6,8 +6,9 @@ from BasicPathfindBot import BasicPathfindBot
 from Field import Field, Circle
 from Utils.Position import Position
 from Utils.RayCast import ray_cast
-from Utils.DebugPrint import DebugPrint
-from Utils.DebugPrint import DebugPrint
+from Simulation import Simulation
+from Pathfinding.PlanningService import PlanningService
+from Utils.Instrumentation import instrumentation
 
 def time_function(func, *args, **kwargs):
     start_time = time.time()
@@ -16,7 +17,7 @@ def time_function(func, *args, **kwargs):
 
 
 if __name__ == "__main__":
-    DebugPrinter = DebugPrint(1)
+    instrumentation.enable()  # press i to print what it has recorded and save it to instrumentation.json
     # set up pygame
     pygame.init()
     map_scale = 2
@@ -34,17 +35,22 @@ if __name__ == "__main__":
     cursor = Circle(5, 5, 3)
     robot = BasicPathfindBot(field, max_velocity=400, max_acceleration=600)
     robot.position = Position(screen.get_width()/2, screen.get_height()/2)
+    # plans the waypoints in the background, the robot waits where it is until the plan for the next one arrives
+    planning_service = PlanningService()
+    robot.planning_service = planning_service
     mouse_x, mouse_y = pygame.mouse.get_pos()
     mouse_just_pressed = (False, False, False)
 
-    # track collisions
+    # the simulation moves the robot in fixed steps and tracks its collisions, this loop just feeds it the time
+    simulation = Simulation(field, time_step=1 / 50)
+    robot_index = simulation.add_robot(robot, running=False)
+    robot_record = simulation.records[robot_index]
     collisions = 0
-    colliding = False
-    robot_running = False
 
     # main loop
     running = True
     while running:
+        instrumentation.begin_frame()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False  # quit when the window is closed
@@ -52,11 +58,14 @@ if __name__ == "__main__":
             # check for key presses
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_r:  # reset collision count if r is pressed
-                    collisions = 0
-                if event.key == pygame.K_c: # clear waypoints if c is pressed
-                    robot.trajectory = []
+                    robot_record.collisions = collisions = 0
+                if event.key == pygame.K_c: # clear waypoints (and cancel their plans) if c is pressed
+                    robot.clear_trajectory()
                 if event.key == pygame.K_s: # start robot if s is pressed
-                    robot_running = True
+                    simulation.start(robot_index)
+                if event.key == pygame.K_i:  # print and save the instrumentation if i is pressed
+                    print(instrumentation.report())
+                    instrumentation.to_json("instrumentation.json")
 
         # update basics
         time_delta_seconds = time.time() - last_time
@@ -67,14 +76,11 @@ if __name__ == "__main__":
         if pygame.mouse.get_pressed()[0] and not mouse_just_pressed[0]:
             robot.add_waypoint(Position(mouse_x, mouse_y))
 
-        # follow trajectory if there is one
-        if robot_running:
-            # reset robot if it reaches the end of the trajectory
-            if robot.follow_trajectory(time_delta_seconds):
-                robot_running = False
+        # follow trajectory if there is one (the robot stops running when it reaches the end of the trajectory)
+        simulation.advance(time_delta_seconds)
 
         # set margin mask if the middle mouse button is pressed
-        # NOTE: this operation is so slow that it may cause the physics to act weirdly, because the time_delta is so big
+        # NOTE: the first non-zero margin computes the field's distance transform, after that toggling is cached
         if pygame.mouse.get_pressed()[1] and field.margin == margin:
             field.set_margin_mask(abs(margin - 25))  # quirky way to toggle between 0 and 15
         elif not pygame.mouse.get_pressed()[1] and field.margin != margin:  # super hacky way to run once per click
@@ -87,20 +93,19 @@ if __name__ == "__main__":
             cursor.set_color((0, 255, 0, 255))
 
         # check for collisions with robot
-        if robot.collided_with_mask(field.mask):
-            if not colliding:  # updates collision
-                collisions += 1
-                colliding = True  # this makes sure we don't call it multiple times in the same collision
+        if robot_record.colliding:
+            if robot_record.collisions != collisions:  # a new collision
+                collisions = robot_record.collisions
                 screen.blit(font.render(f"Collisions: {collisions}", True, (255, 0, 0)), (10, 50))
                 screen.blit(font.render(f"COLLIDED", True, (255, 0, 0)), (screen.get_width()/2, screen.get_height()/2))
                 pygame.display.flip()
                 time.sleep(0.5)
-            
+                last_time = time.time()  # the pause isn't simulated
+
             robot.sprite.set_color((255, 0, 0, 255))
-        elif robot.collided_with_mask(field.margin_mask):  # check if robot is in the margin
+        elif robot_record.in_margin:  # check if robot is in the margin
             robot.sprite.set_color((255, 125, 0, 255))
         else:
-            colliding = False
             robot.sprite.set_color((0, 255, 0, 255))
 
         """Draw everything"""
@@ -120,12 +125,13 @@ if __name__ == "__main__":
         robot.display(screen)
         # ray cast to cursor
         if len(robot.trajectory):
-            if ray_cast(robot.trajectory[-1], Position(mouse_x, mouse_y), field.mask):
+            if ray_cast(robot.trajectory[-1], Position(mouse_x, mouse_y), field.mask,
+                        distance_field=field.distance_field):
                 pygame.draw.line(screen, (255, 0, 0), (robot.trajectory[-1].x, robot.trajectory[-1].y), (mouse_x, mouse_y), 5)
             else:
                 pygame.draw.line(screen, (0, 255, 0), (robot.trajectory[-1].x, robot.trajectory[-1].y), (mouse_x, mouse_y), 5)
         else:
-            if ray_cast(robot.position, Position(mouse_x, mouse_y), field.mask):
+            if ray_cast(robot.position, Position(mouse_x, mouse_y), field.mask, distance_field=field.distance_field):
                 pygame.draw.line(screen, (255, 0, 0), (robot.position.x, robot.position.y), (mouse_x, mouse_y), 5)
             else:
                 pygame.draw.line(screen, (0, 255, 0), (robot.position.x, robot.position.y), (mouse_x, mouse_y), 5)
@@ -150,4 +156,6 @@ if __name__ == "__main__":
         # update just pressed
         mouse_just_pressed = pygame.mouse.get_pressed()
 
-        DebugPrinter.update()
+        instrumentation.end_frame()
+
+    planning_service.shutdown(wait=False)
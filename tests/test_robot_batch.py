@@ -0,0 +1,30 @@
+import os
+import unittest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from RobotBatch import parity_check  # noqa: E402
+
+TOLERANCE = 1e-6
+
+
+class RobotBatchParityTest(unittest.TestCase):
+    """RobotBatch.follow_trajectories has to move robots exactly like Robot.follow_trajectory"""
+
+    def check(self, count: int, steps: int, seed: int) -> None:
+        results = parity_check(count, steps, seed=seed)
+        self.assertLessEqual(results["max_position_error"], TOLERANCE)
+        self.assertLessEqual(results["max_velocity_error"], TOLERANCE)
+        self.assertTrue(results["trajectories_match"])
+
+    def test_while_following(self):
+        # every robot still has waypoints left
+        self.check(64, 50, seed=0)
+
+    def test_until_done(self):
+        # most robots reach their last waypoint and stop while the rest keep going
+        self.check(64, 500, seed=1)
+
+
+if __name__ == "__main__":
+    unittest.main()